@@ -10,9 +10,89 @@ load_dotenv()
 # GCP Configuration
 GOOGLE_APPLICATION_CREDENTIALS = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
 GCP_SERVICE_ACCOUNT_JSON = os.getenv('GCP_SERVICE_ACCOUNT_JSON')
+# Streamlit secrets file holding a [gcp_service_account] section, read without importing Streamlit
+STREAMLIT_SECRETS_PATH = os.getenv('STREAMLIT_SECRETS_PATH', '.streamlit/secrets.toml')
+
+# Storage engine configuration ("bigquery" or "sqlite")
+STORAGE_ENGINE = os.getenv('STORAGE_ENGINE', 'bigquery')
+SQLITE_DATABASE_PATH = os.getenv('SQLITE_DATABASE_PATH', 'special_ed.db')
+
+# Blocking storage calls run on a bounded thread pool, with a concurrency limit per table
+# STORAGE_TABLE_CONCURRENCY_OVERRIDES example: "assessment=8,student=2"
+STORAGE_MAX_WORKERS = int(os.getenv('STORAGE_MAX_WORKERS', '16'))
+STORAGE_TABLE_CONCURRENCY = int(os.getenv('STORAGE_TABLE_CONCURRENCY', '4'))
+STORAGE_TABLE_CONCURRENCY_OVERRIDES = os.getenv('STORAGE_TABLE_CONCURRENCY_OVERRIDES', '')
+
+# Storage calls failing with a transient error (rate limits, 5xx, dropped connections)
+# are retried up to RETRY_ATTEMPTS times, backing off exponentially with jitter
+STORAGE_RETRY_ATTEMPTS = int(os.getenv('STORAGE_RETRY_ATTEMPTS', '4'))
+STORAGE_RETRY_BASE_SECONDS = float(os.getenv('STORAGE_RETRY_BASE_SECONDS', '0.2'))
+STORAGE_RETRY_MAX_WAIT_SECONDS = float(os.getenv('STORAGE_RETRY_MAX_WAIT_SECONDS', '5'))
+
+# Deadline per kind of endpoint, retries included; past it the request gets a 504
+STORAGE_READ_DEADLINE_SECONDS = float(os.getenv('STORAGE_READ_DEADLINE_SECONDS', '30'))
+STORAGE_ID_LOOKUP_DEADLINE_SECONDS = float(os.getenv('STORAGE_ID_LOOKUP_DEADLINE_SECONDS', '15'))
+STORAGE_UPLOAD_DEADLINE_SECONDS = float(os.getenv('STORAGE_UPLOAD_DEADLINE_SECONDS', '300'))
+
+# A read still running after the HEDGE_PERCENTILE latency of the last LATENCY_WINDOW
+# reads of the same table is started a second time and the first answer is used
+STORAGE_HEDGED_READS_ENABLED = os.getenv('STORAGE_HEDGED_READS_ENABLED', 'false').lower() == 'true'
+STORAGE_HEDGE_PERCENTILE = float(os.getenv('STORAGE_HEDGE_PERCENTILE', '95'))
+STORAGE_HEDGE_MIN_SAMPLES = int(os.getenv('STORAGE_HEDGE_MIN_SAMPLES', '20'))
+STORAGE_LATENCY_WINDOW = int(os.getenv('STORAGE_LATENCY_WINDOW', '200'))
+
+# Read-through cache for the /get-* endpoints
+# Entries older than the TTL are served stale (up to MAX_STALE) while a background refresh runs
+TABLE_CACHE_ENABLED = os.getenv('TABLE_CACHE_ENABLED', 'true').lower() == 'true'
+TABLE_CACHE_TTL_SECONDS = float(os.getenv('TABLE_CACHE_TTL_SECONDS', '30'))
+TABLE_CACHE_MAX_STALE_SECONDS = float(os.getenv('TABLE_CACHE_MAX_STALE_SECONDS', '300'))
+
+# Identical reads arriving while one is running (same table, filters, columns and format)
+# wait for that read instead of querying storage again
+READ_SINGLE_FLIGHT_ENABLED = os.getenv('READ_SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+
+# Tables served from an in-memory Arrow copy instead of storage, as table=key_column pairs
+# (e.g. "student=student_id,parent=parent_id,teacher=teacher_id,class=class_id").
+# Writes through this process patch the copy before the next read, changes made
+# elsewhere are picked up from the change feed every LOCAL_REPLICA_REFRESH_SECONDS
+LOCAL_REPLICA_TABLES = os.getenv('LOCAL_REPLICA_TABLES', '')
+LOCAL_REPLICA_REFRESH_SECONDS = float(os.getenv('LOCAL_REPLICA_REFRESH_SECONDS', '30'))
+
+# Set to a local file path when running several worker processes (uvicorn --workers,
+# gunicorn -w). The workers then share table versions, cached reads and ID counters
+# through that SQLite file, so a write in one worker is seen by the others on their next read
+MULTI_WORKER_STATE_PATH = os.getenv('MULTI_WORKER_STATE_PATH', '')
+
+# Table schemas are cached in process and refreshed after this many seconds
+SCHEMA_CACHE_TTL_SECONDS = float(os.getenv('SCHEMA_CACHE_TTL_SECONDS', '600'))
+
+# New rows from the add endpoints are queued and written with one load job per table
+# once the queue holds MAX_ROWS rows or its oldest row is FLUSH_SECONDS old
+INSERT_BUFFER_ENABLED = os.getenv('INSERT_BUFFER_ENABLED', 'true').lower() == 'true'
+INSERT_BUFFER_MAX_ROWS = int(os.getenv('INSERT_BUFFER_MAX_ROWS', '500'))
+INSERT_BUFFER_FLUSH_SECONDS = float(os.getenv('INSERT_BUFFER_FLUSH_SECONDS', '2'))
+
+# Deletes only write a tombstone and hide the rows, a background compactor removes
+# the rows with one DELETE per table every TOMBSTONE_COMPACTION_SECONDS
+SOFT_DELETE_ENABLED = os.getenv('SOFT_DELETE_ENABLED', 'true').lower() == 'true'
+TOMBSTONE_COMPACTION_SECONDS = float(os.getenv('TOMBSTONE_COMPACTION_SECONDS', '60'))
+
+# Updates and deletes to a table are collected for this long and applied as one batch
+WRITE_BATCH_WINDOW_SECONDS = float(os.getenv('WRITE_BATCH_WINDOW_SECONDS', '0.05'))
+
+# BigQuery writes stage their rows in uniquely named tables of this dataset.
+# The staging script drops them, anything left behind by a failed write expires.
+STAGING_DATASET = os.getenv('STAGING_DATASET', 'staging')
+STAGING_TABLE_EXPIRATION_SECONDS = int(os.getenv('STAGING_TABLE_EXPIRATION_SECONDS', '3600'))
+
+# The change feed re-sends changes from this many seconds before the requested watermark,
+# covering clock skew between servers. It goes back at least STORAGE_UPLOAD_DEADLINE_SECONDS,
+# for writes of other processes that commit long after their timestamp
+CHANGE_FEED_OVERLAP_SECONDS = float(os.getenv('CHANGE_FEED_OVERLAP_SECONDS', '5'))
+
+# Uploads are spooled to disk and parsed in blocks of this many bytes
+UPLOAD_BLOCK_SIZE_BYTES = int(os.getenv('UPLOAD_BLOCK_SIZE_BYTES', str(4 * 1024 * 1024)))
 
 # Set the environment variable for Google Cloud SDK
 if GOOGLE_APPLICATION_CREDENTIALS:
     os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = GOOGLE_APPLICATION_CREDENTIALS
-else:
-    print("GOOGLE_APPLICATION_CREDENTIALS is not set")
@@ -1,13 +1,28 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from dotenv import load_dotenv
 
-load_dotenv()
+from services.startup import start_warm_up, timed_import
+from services.async_storage import shutdown_executor
+from services.insert_buffer import flush_all
+from services.storage_engine import close_storage_engine
+from services.resilience import StorageDeadlineExceeded
 
-# Import settings to ensure configuration is loaded
-from config import settings
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # Credentials, client and access token are set up in the background, /health/ready
+    # turns ready once they are; requests arriving earlier open the engine themselves
+    start_warm_up()
+    yield
+    # Write the rows still queued by the add endpoints before the process exits
+    flush_all()
+    shutdown_executor()
+    close_storage_engine()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -18,10 +33,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-from routes import student, parent, teacher, assessment, class_
+@app.exception_handler(StorageDeadlineExceeded)
+async def storage_deadline_exceeded(request, exc):
+    # Reads, ID lookups and uploads that ran out of time (retries included)
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+# Shared heavy dependencies first, so each router's import cost below is its own
+for module_name in ("pandas", "pyarrow"):
+    timed_import(module_name)
 
-app.include_router(student.router)
-app.include_router(parent.router)
-app.include_router(teacher.router)
-app.include_router(assessment.router)
-app.include_router(class_.router)
+for module_name in ("student", "parent", "teacher", "assessment", "class_", "batch", "changes", "health"):
+    app.include_router(timed_import(f"routes.{module_name}").router)
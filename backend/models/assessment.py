@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import Optional
 from datetime import date
 
 class AssessmentCreate(BaseModel):
@@ -14,4 +15,15 @@ class AssessmentUpdate(BaseModel):
     assessment_name: str
     assessment_date: date
     assessment_score: float
-    assessment_notes: str
\ No newline at end of file
+    assessment_notes: str
+    row_version: Optional[int] = None
+
+class AssessmentPatch(BaseModel):
+    """Only the fields that changed, next to the ID."""
+    assessment_id: str
+    student_id: Optional[str] = None
+    assessment_name: Optional[str] = None
+    assessment_date: Optional[date] = None
+    assessment_score: Optional[float] = None
+    assessment_notes: Optional[str] = None
+    row_version: Optional[int] = None
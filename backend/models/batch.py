@@ -0,0 +1,9 @@
+from pydantic import BaseModel
+from typing import Literal
+
+
+class BatchOperation(BaseModel):
+    entity: str
+    op: Literal["add", "update", "delete"]
+    rows: list[dict] = []
+    ids: list[str] = []
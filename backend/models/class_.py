@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import Optional
 
 class ClassCreate(BaseModel):
     class_id: str
@@ -14,4 +15,15 @@ class ClassUpdate(BaseModel):
     grade_level: str
     teacher_id: str
     room_number: str
-    schedule: str
\ No newline at end of file
+    schedule: str
+    row_version: Optional[int] = None
+
+class ClassPatch(BaseModel):
+    """Only the fields that changed, next to the ID."""
+    class_id: str
+    class_name: Optional[str] = None
+    grade_level: Optional[str] = None
+    teacher_id: Optional[str] = None
+    room_number: Optional[str] = None
+    schedule: Optional[str] = None
+    row_version: Optional[int] = None
@@ -0,0 +1,14 @@
+from models.student import StudentUpdate
+from models.parent import ParentUpdate
+from models.teacher import TeacherUpdate
+from models.class_ import ClassUpdate
+from models.assessment import AssessmentUpdate
+
+# entity: (dataset, table, key column, ID prefix, model listing the columns)
+ENTITIES = {
+    "student": ("groups", "student", "student_id", "S", StudentUpdate),
+    "parent": ("groups", "parent", "parent_id", "P", ParentUpdate),
+    "teacher": ("groups", "teacher", "teacher_id", "T", TeacherUpdate),
+    "class": ("groups", "class", "class_id", "C", ClassUpdate),
+    "assessment": ("assessment", "assessment", "assessment_id", "A", AssessmentUpdate),
+}
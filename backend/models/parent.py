@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import Optional
 
 class ParentCreate(BaseModel):
     name: str
@@ -11,4 +12,14 @@ class ParentUpdate(BaseModel):
     name: str
     phone_number: str
     email: str 
-    address: str 
\ No newline at end of file
+    address: str
+    row_version: Optional[int] = None
+
+class ParentPatch(BaseModel):
+    """Only the fields that changed, next to the ID."""
+    parent_id: str
+    name: Optional[str] = None
+    phone_number: Optional[str] = None
+    email: Optional[str] = None
+    address: Optional[str] = None
+    row_version: Optional[int] = None
@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import Optional
 from datetime import date 
 
 
@@ -11,6 +12,7 @@ class StudentUpdate(BaseModel):
     address: str 
     parent_id: str 
     teacher_id: str
+    row_version: Optional[int] = None
 
 class StudentCreate(BaseModel):
     student_id: str
@@ -20,4 +22,16 @@ class StudentCreate(BaseModel):
     gender: str 
     address: str 
     parent_id: str 
-    teacher_id: str
\ No newline at end of file
+    teacher_id: str
+
+class StudentPatch(BaseModel):
+    """Only the fields that changed, next to the ID."""
+    student_id: str
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    date_of_birth: Optional[date] = None
+    gender: Optional[str] = None
+    address: Optional[str] = None
+    parent_id: Optional[str] = None
+    teacher_id: Optional[str] = None
+    row_version: Optional[int] = None
@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import Optional
 
 class TeacherCreate(BaseModel):
     name: str
@@ -12,3 +13,13 @@ class TeacherUpdate(BaseModel):
     email: str
     phone_number: str
     class_id: str
+    row_version: Optional[int] = None
+
+class TeacherPatch(BaseModel):
+    """Only the fields that changed, next to the ID."""
+    teacher_id: str
+    name: Optional[str] = None
+    email: Optional[str] = None
+    phone_number: Optional[str] = None
+    class_id: Optional[str] = None
+    row_version: Optional[int] = None
@@ -1,58 +1,57 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
 from services.bigquery_service import *
-from models.assessment import AssessmentUpdate, AssessmentCreate
-import pandas as pd
-from io import StringIO, BytesIO
-import re
+from services.id_allocator import allocate_ids
+from services.async_storage import run_storage_call
+from services.resilience import ID_LOOKUP, READ, StorageDeadlineExceeded, call_with_policy
+from services.write_scheduler import count_updated, schedule_delete, schedule_upsert
+from services.table_cache import cached_table_response
+from services.read_query import parse_read_query
+from services.streaming import ndjson_response, wants_ndjson
+from services.arrow_format import arrow_table_response, wants_arrow
+from services.ingest import ingest_upload
+from models.assessment import AssessmentUpdate, AssessmentPatch
 
 router = APIRouter()
 
-def get_next_assessment_id():
-    """Generate the next sequential assessment ID (A001, A002, etc.)"""
+async def get_next_assessment_ids(count):
+    """Reserve `count` sequential assessment IDs (A001, A002, etc.) with a single query"""
     table_ref = get_table("assessment", "assessment")
-    try:
-        query = f"""
-            SELECT assessment_id FROM `{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}`
-            WHERE assessment_id LIKE 'A%'
-            ORDER BY assessment_id DESC
-            LIMIT 1
-        """
-        query_job = client.query(query)
-        results = query_job.result()
-        if results.total_rows == 0:
-            return "A001"
-        latest_id = list(results)[0]['assessment_id']
-        match = re.match(r'A(\d+)', latest_id)
-        if match:
-            next_num = int(match.group(1)) + 1
-            return f"A{next_num:03d}"
-        else:
-            return "A001"
-    except Exception as e:
-        print(f"Error generating next assessment ID: {e}")
-        return "A001"
+    return await call_with_policy(ID_LOOKUP, table_ref, allocate_ids, table_ref, "assessment_id", "A", count)
 
 @router.get("/get-assessment")
-async def get_data():
+async def get_data(request: Request):
+    """
+    List assessments. Optional query parameters: limit, cursor, columns, order_by,
+    descending, <column>=value and <column>_from / <column>_to.
+    Send Accept: application/x-ndjson to stream the rows as NDJSON, or
+    Accept: application/vnd.apache.arrow.stream for an Arrow IPC stream.
+    """
     table_ref = get_table("assessment", "assessment")
-    return fetch_data_from_bigquery(table_ref)
+    read_query = parse_read_query(request, AssessmentUpdate, "assessment_id")
+    if wants_ndjson(request):
+        return ndjson_response(table_ref, read_query)
+    if wants_arrow(request):
+        return await arrow_table_response(request, table_ref, read_query)
+    return await cached_table_response(
+        request,
+        table_ref,
+        lambda: call_with_policy(READ, table_ref, fetch_data_from_bigquery, table_ref, read_query),
+        variant=read_query.cache_key() if read_query else "",
+    )
 
 @router.post("/upload-assessment")
 async def upload_data(file: UploadFile = File(...)):
     try:
-        content = await file.read()
-
-        if file.filename.endswith(".csv"):
-            df = pd.read_csv(StringIO(content.decode("utf-8")))
-        elif file.filename.endswith((".xls", ".xlsx")):
-            df = pd.read_excel(BytesIO(content))
-        else:
+        if not file.filename.endswith((".csv", ".xls", ".xlsx")):
             return {"error": "Unsupported file type"}
         
         table_ref = get_table("assessment", "assessment")
         
-        upload_data_to_bigquery(df, table_ref, "assessment_id")
-        return {"message": "File uploaded to BigQuery"}
+        summary = await ingest_upload(file, table_ref, "assessment_id")
+        return {"message": "File uploaded to BigQuery", **summary}
+    except StorageDeadlineExceeded:
+        # Answered with 504 by the handler in main.py
+        raise
     except Exception as e:
         return {"error": str(e)}
 
@@ -66,8 +65,8 @@ async def add_assessments(assessments: list[dict]):
     try:
         print(f"Received {len(assessments)} assessments to add:")
         rows_to_insert = []
-        for assessment_data in assessments:
-            new_id = get_next_assessment_id()
+        new_ids = await get_next_assessment_ids(len(assessments))
+        for assessment_data, new_id in zip(assessments, new_ids):
             print(f"Generated ID: {new_id} for assessment: {assessment_data.get('assessment_name', 'Unknown')}")
             row_to_insert = {
                 "assessment_id": new_id,
@@ -80,15 +79,15 @@ async def add_assessments(assessments: list[dict]):
             rows_to_insert.append(row_to_insert)
             print(f"Row to insert: {row_to_insert}")
         print(f"Inserting {len(rows_to_insert)} rows into BigQuery...")
-        errors = client.insert_rows_json(
-            f"{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}",
-            rows_to_insert
-        )
+        errors = await run_storage_call(table_ref, insert_data_into_bigquery, table_ref, rows_to_insert, key_column="assessment_id")
         if errors:
             print(f"BigQuery errors: {errors}")
             raise HTTPException(status_code=400, detail=str(errors))
         print(f"Successfully added {len(assessments)} assessments")
         return {"message": f"Added {len(assessments)} assessment(s) successfully"}
+    except StorageDeadlineExceeded:
+        # Answered with 504 by the handler in main.py
+        raise
     except Exception as e:
         print(f"Error in add_assessments: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -97,31 +96,55 @@ async def add_assessments(assessments: list[dict]):
 async def update_assessment(assessments: list[AssessmentUpdate]):
     table_ref = get_table("assessment", "assessment")
     try:
-        queries = []
+        rows = []
         for assessment in assessments:
-            query = f"""
-                UPDATE `{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}`
-                SET
-                    assessment_id = '{assessment.assessment_id}',
-                    student_id = '{assessment.student_id}',
-                    assessment_name = '{assessment.assessment_name}',
-                    assessment_date = '{assessment.assessment_date}',
-                    assessment_score = {assessment.assessment_score},
-                    assessment_notes = '{assessment.assessment_notes}'
-                WHERE
-                    assessment_id = '{assessment.assessment_id}'
-"""
-            queries.append(query)
+            rows.append({
+                "assessment_id": assessment.assessment_id,
+                "student_id": assessment.student_id,
+                "assessment_name": assessment.assessment_name,
+                "assessment_date": assessment.assessment_date,
+                "assessment_score": assessment.assessment_score,
+                "assessment_notes": assessment.assessment_notes,
+                "row_version": assessment.row_version
+            })
 
-        query_job = client.query(";\n".join(queries))
-        query_job.result()
-        return {"message": f"Updated {len(assessments)} assessments successfully"}
+        results = await schedule_upsert(table_ref, rows, "assessment_id")
+        return {"message": f"Updated {count_updated(results)} of {len(assessments)} assessment(s)", "results": results}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        client.close()
+
+@router.patch("/update-assessment")
+async def patch_assessments(assessments: list[AssessmentPatch]):
+    """
+    Update only the fields sent for each assessment. Rows setting the same fields
+    are written together, and each statement only touches those columns.
+    With row_version set, a row changed by someone else since is left alone
+    and reported with status "conflict".
+    """
+    table_ref = get_table("assessment", "assessment")
+    try:
+        rows = [assessment.model_dump(exclude_unset=True) for assessment in assessments]
+        results = await schedule_upsert(table_ref, rows, "assessment_id")
+        return {"message": f"Updated {count_updated(results)} of {len(assessments)} assessment(s)", "results": results}
+    except Exception as e:
+        print(f"Error in patch_assessments: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/delete-assessment/{assessment_id}")
 async def delete_assessment(assessment_id: str):
     table_ref = get_table("assessment", "assessment")
-    return delete_data_from_bigquery(table_ref,"assessment_id", assessment_id)
\ No newline at end of file
+    return await schedule_delete(table_ref, "assessment_id", [assessment_id])
+
+@router.delete("/delete-assessment")
+async def delete_assessments(assessment_ids: list[str]):
+    """
+    Delete several assessments with a single statement. Expects a list of assessment_id values.
+    Reports which IDs were deleted, missing, or blocked by BigQuery's streaming buffer.
+    """
+    table_ref = get_table("groups", "assessment")
+    try:
+        report = await schedule_delete(table_ref, "assessment_id", assessment_ids)
+        return {"message": f"Deleted {len(report['deleted'])} assessment(s)", **report}
+    except Exception as e:
+        print(f"Error in delete_assessments: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
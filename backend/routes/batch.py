@@ -0,0 +1,69 @@
+from fastapi import APIRouter, HTTPException
+from services.bigquery_service import *
+from services.id_allocator import allocate_ids
+from services.async_storage import run_storage_call
+from services.resilience import ID_LOOKUP, StorageDeadlineExceeded, call_with_policy
+from services.storage_engine import VERSION_COLUMN, VersionConflict, WriteOperation
+from models.batch import BatchOperation
+from models.entities import ENTITIES
+
+router = APIRouter()
+
+@router.post("/batch")
+async def apply_batch(operations: list[BatchOperation]):
+    """
+    Apply a mixed list of adds, updates and deletes across entities as one transaction.
+    Each operation is {"entity": "student", "op": "add" | "update" | "delete", "rows": [...], "ids": [...]}:
+    adds take rows without IDs, updates take rows with their ID and the columns to change,
+    deletes take ids. Either every operation is applied or none is.
+    An update row carrying row_version only applies if the stored row still has that
+    version, otherwise the whole batch is refused with 409 and the conflicting IDs.
+    """
+    for operation in operations:
+        if operation.entity not in ENTITIES:
+            raise HTTPException(status_code=400, detail=f"Unknown entity: {operation.entity}")
+
+    try:
+        write_operations = []
+        results = []
+        for operation in operations:
+            dataset_name, table_name, key_column, prefix, model = ENTITIES[operation.entity]
+            table_ref = get_table(dataset_name, table_name)
+            result = {"entity": operation.entity, "op": operation.op}
+            if operation.op == "delete":
+                write_operations.append(WriteOperation(table_ref, "delete", key_column, keys=operation.ids))
+            elif operation.op == "add":
+                # Same defaults as the /add-* endpoints
+                new_ids = await call_with_policy(ID_LOOKUP, table_ref, allocate_ids, table_ref, key_column, prefix, len(operation.rows))
+                rows = [
+                    {key_column: new_id, **{field: row.get(field, "") for field in model.model_fields if field not in (key_column, VERSION_COLUMN)}}
+                    for row, new_id in zip(operation.rows, new_ids)
+                ]
+                write_operations.append(WriteOperation(table_ref, "add", key_column, rows=rows))
+                result["ids"] = new_ids
+            else:
+                for row in operation.rows:
+                    if not row.get(key_column):
+                        raise HTTPException(status_code=400, detail=f"Every {operation.entity} update needs a {key_column}")
+                    unknown = [field for field in row if field not in model.model_fields]
+                    if unknown:
+                        raise HTTPException(status_code=400, detail=f"Unknown column(s) for {operation.entity}: {', '.join(unknown)}")
+                write_operations.append(WriteOperation(table_ref, "update", key_column, rows=operation.rows))
+            results.append(result)
+
+        row_counts = []
+        if write_operations:
+            # Counted against the first table's concurrency limit
+            table_ref = write_operations[0].table_ref
+            row_counts = await run_storage_call(table_ref, apply_batch_to_bigquery, write_operations)
+        for result, count in zip(results, row_counts):
+            result["rows"] = count
+        print(f"Applied batch of {len(operations)} operation(s)")
+        return {"message": f"Applied {len(operations)} operation(s)", "results": results}
+    except (HTTPException, StorageDeadlineExceeded):
+        raise
+    except VersionConflict as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "conflicts": e.keys})
+    except Exception as e:
+        print(f"Error in apply_batch: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
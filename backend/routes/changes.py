@@ -0,0 +1,37 @@
+import datetime
+from fastapi import APIRouter, HTTPException
+from services.bigquery_service import *
+from services.resilience import READ, StorageDeadlineExceeded, call_with_policy
+from models.entities import ENTITIES
+
+router = APIRouter()
+
+@router.get("/changes/{entity}")
+async def get_changes(entity: str, since: str = None):
+    """
+    Rows of an entity inserted or updated since the watermark, and the IDs deleted since.
+    Returns {"rows": [...], "deleted": [...], "watermark": "..."}; send the watermark
+    back as ?since= on the next call. Without since only the current watermark is returned,
+    take it before loading the full table.
+    """
+    if entity not in ENTITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown entity: {entity}")
+    since_time = None
+    if since is not None:
+        try:
+            since_time = datetime.datetime.fromisoformat(since)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid watermark: {since}")
+        if since_time.tzinfo is None:
+            since_time = since_time.replace(tzinfo=datetime.timezone.utc)
+
+    dataset_name, table_name, key_column, _, _ = ENTITIES[entity]
+    try:
+        table_ref = get_table(dataset_name, table_name)
+        return await call_with_policy(READ, table_ref, fetch_changes_from_bigquery, table_ref, key_column, since_time)
+    except StorageDeadlineExceeded:
+        # Answered with 504 by the handler in main.py
+        raise
+    except Exception as e:
+        print(f"Error in get_changes: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,45 +1,30 @@
-from fastapi import APIRouter, HTTPException
-from typing import List, Optional
-import pandas as pd
-from google.cloud import bigquery
-from services.bigquery_service import get_table, get_bigquery_client
-from models.class_ import ClassCreate, ClassUpdate
-import re
+from fastapi import APIRouter, HTTPException, Request
+from typing import List
+from services.bigquery_service import (
+    get_table,
+    fetch_data_from_bigquery,
+    insert_data_into_bigquery,
+)
+from services.id_allocator import allocate_ids
+from services.async_storage import run_storage_call
+from services.resilience import ID_LOOKUP, READ, StorageDeadlineExceeded, call_with_policy
+from services.write_scheduler import count_updated, schedule_delete, schedule_upsert
+from services.table_cache import cached_table_response
+from services.read_query import parse_read_query
+from services.streaming import ndjson_response, wants_ndjson
+from services.arrow_format import arrow_table_response, wants_arrow
+from models.class_ import ClassCreate, ClassUpdate, ClassPatch
 
 router = APIRouter()
 
-def get_next_class_id():
-    """Generate the next sequential class ID (C001, C002, etc.)"""
+async def get_next_class_ids(count):
+    """Reserve `count` sequential class IDs (C001, C002, etc.) with a single query"""
     table_ref = get_table("groups", "class")
-    client = get_bigquery_client()
-    try:
-        query = f"""
-            SELECT class_id FROM `{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}`
-            WHERE class_id LIKE 'C%'
-            ORDER BY class_id DESC
-            LIMIT 1
-        """
-        query_job = client.query(query)
-        results = query_job.result()
-        if results.total_rows == 0:
-            return "C001"
-        latest_id = list(results)[0]['class_id']
-        match = re.match(r'C(\d+)', latest_id)
-        if match:
-            next_num = int(match.group(1)) + 1
-            return f"C{next_num:03d}"
-        else:
-            return "C001"
-    except Exception as e:
-        print(f"Error generating next class ID: {e}")
-        return "C001"
-    finally:
-        client.close()
+    return await call_with_policy(ID_LOOKUP, table_ref, allocate_ids, table_ref, "class_id", "C", count)
 
 @router.post("/create-class")
 async def create_class(classes: List[ClassCreate]):
     table_ref = get_table("groups", "class")
-    client = get_bigquery_client()
     try:
         data = []
         for class_item in classes:
@@ -52,119 +37,110 @@ async def create_class(classes: List[ClassCreate]):
                 "schedule": class_item.schedule
             })
         
-        df = pd.DataFrame(data)
-        job_config = bigquery.LoadJobConfig(
-            write_disposition="WRITE_APPEND",
-            autodetect=True
-        )
-        
-        job = client.load_table_from_dataframe(df, table_ref, job_config=job_config)
-        job.result()
+        errors = await run_storage_call(table_ref, insert_data_into_bigquery, table_ref, data, use_load_job=True, key_column="class_id")
+        if errors:
+            raise HTTPException(status_code=400, detail=str(errors))
         
         return {"message": f"Created {len(classes)} class successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        client.close()
 
 @router.get("/get-classes")
-async def get_classes():
+async def get_classes(request: Request):
+    """
+    List classes. Optional query parameters: limit, cursor, columns, order_by,
+    descending, <column>=value and <column>_from / <column>_to.
+    Send Accept: application/x-ndjson to stream the rows as NDJSON, or
+    Accept: application/vnd.apache.arrow.stream for an Arrow IPC stream.
+    """
     table_ref = get_table("groups", "class")
-    client = get_bigquery_client()
+    read_query = parse_read_query(request, ClassUpdate, "class_id")
+    if wants_ndjson(request):
+        return ndjson_response(table_ref, read_query)
+    if wants_arrow(request):
+        return await arrow_table_response(request, table_ref, read_query)
     try:
-        query = f"SELECT * FROM `{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}`"
-        df = client.query(query).to_dataframe()
-        return df.to_dict('records')
+        return await cached_table_response(
+            request,
+            table_ref,
+            lambda: call_with_policy(READ, table_ref, fetch_data_from_bigquery, table_ref, read_query),
+            variant=read_query.cache_key() if read_query else "",
+        )
+    except StorageDeadlineExceeded:
+        # Answered with 504 by the handler in main.py
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        client.close()
 
 @router.put("/update-class")
 async def update_class(classes: list[ClassUpdate]):
     table_ref = get_table("groups", "class")
-    client = get_bigquery_client()
     try:
         # Debug logging
         print(f"Received {len(classes)} classes to update:")
         for i, class_item in enumerate(classes):
             print(f"Class {i+1}: {class_item}")
         
-        # Use temporary table approach to avoid streaming buffer issues
-        temp_table_id = f"{table_ref.project}.{table_ref.dataset_id}.temp_update_{table_ref.table_id}"
-        
-        # Create temporary table with updated data
-        temp_data = []
+        # Collect the updated values
+        rows = []
         for class_item in classes:
-            temp_data.append({
+            rows.append({
                 "class_id": class_item.class_id,
                 "class_name": class_item.class_name,
                 "grade_level": class_item.grade_level,
                 "teacher_id": class_item.teacher_id,
                 "room_number": class_item.room_number,
-                "schedule": class_item.schedule
+                "schedule": class_item.schedule,
+                "row_version": class_item.row_version
             })
-        
-        # Upload to temporary table
-        from google.cloud import bigquery
-        job_config = bigquery.LoadJobConfig(
-            write_disposition="WRITE_TRUNCATE",
-            autodetect=True
-        )
-        
-        temp_df = pd.DataFrame(temp_data)
-        client.load_table_from_dataframe(temp_df, temp_table_id, job_config=job_config).result()
-        print(f"Temporary table created: {temp_table_id}")
-        
-        # Use MERGE from temp table to main table
-        for class_item in classes:
-            merge_query = f"""
-                MERGE `{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}` T
-                USING `{temp_table_id}` S
-                ON T.class_id = S.class_id
-                WHEN MATCHED THEN
-                    UPDATE SET
-                        class_name = S.class_name,
-                        grade_level = S.grade_level,
-                        teacher_id = S.teacher_id,
-                        room_number = S.room_number,
-                        schedule = S.schedule
-            """
-            print(f"Executing MERGE query for class {class_item.class_id}")
-            query_job = client.query(merge_query)
-            query_job.result()
-            print(f"MERGE completed for class {class_item.class_id}")
 
-        # Clean up temporary table
-        client.delete_table(temp_table_id, not_found_ok=True)
-        print("Temporary table deleted")
+        results = await schedule_upsert(table_ref, rows, "class_id")
 
         print("All update operations completed successfully")
-        return {"message": f"Updated {len(classes)} class successfully"}
+        return {"message": f"Updated {count_updated(results)} of {len(classes)} class(s)", "results": results}
     except Exception as e:
         print(f"Error in update_class: {e}")
-        # Clean up temporary table on error
-        try:
-            client.delete_table(temp_table_id, not_found_ok=True)
-        except:
-            pass
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        client.close()
+
+@router.patch("/update-class")
+async def patch_classes(classes: list[ClassPatch]):
+    """
+    Update only the fields sent for each class. Rows setting the same fields
+    are written together, and each statement only touches those columns.
+    With row_version set, a row changed by someone else since is left alone
+    and reported with status "conflict".
+    """
+    table_ref = get_table("groups", "class")
+    try:
+        rows = [class_item.model_dump(exclude_unset=True) for class_item in classes]
+        results = await schedule_upsert(table_ref, rows, "class_id")
+        return {"message": f"Updated {count_updated(results)} of {len(classes)} class(s)", "results": results}
+    except Exception as e:
+        print(f"Error in patch_classes: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/delete-class/{class_id}")
 async def delete_class(class_id: str):
     table_ref = get_table("groups", "class")
-    client = get_bigquery_client()
     try:
-        query = f"DELETE FROM `{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}` WHERE class_id = '{class_id}'"
-        query_job = client.query(query)
-        query_job.result()
+        await schedule_delete(table_ref, "class_id", [class_id])
         return {"message": f"Deleted class {class_id} successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        client.close()
+
+@router.delete("/delete-class")
+async def delete_classes(class_ids: list[str]):
+    """
+    Delete several classes with a single statement. Expects a list of class_id values.
+    Reports which IDs were deleted, missing, or blocked by BigQuery's streaming buffer.
+    """
+    table_ref = get_table("groups", "class")
+    try:
+        report = await schedule_delete(table_ref, "class_id", class_ids)
+        return {"message": f"Deleted {len(report['deleted'])} class(es)", **report}
+    except Exception as e:
+        print(f"Error in delete_classes: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/add-class")
 async def add_classes(classes: list[dict]):
@@ -173,12 +149,11 @@ async def add_classes(classes: list[dict]):
     Expects a list of dictionaries with class data (without class_id).
     """
     table_ref = get_table("groups", "class")
-    client = get_bigquery_client()
     try:
         print(f"Received {len(classes)} classes to add:")
         rows_to_insert = []
-        for class_data in classes:
-            new_id = get_next_class_id()
+        new_ids = await get_next_class_ids(len(classes))
+        for class_data, new_id in zip(classes, new_ids):
             print(f"Generated ID: {new_id} for class: {class_data.get('class_name', 'Unknown')}")
             row_to_insert = {
                 "class_id": new_id,
@@ -191,17 +166,15 @@ async def add_classes(classes: list[dict]):
             rows_to_insert.append(row_to_insert)
             print(f"Row to insert: {row_to_insert}")
         print(f"Inserting {len(rows_to_insert)} rows into BigQuery...")
-        job_config = bigquery.LoadJobConfig(
-            write_disposition="WRITE_APPEND",
-            autodetect=True
-        )
-        df = pd.DataFrame(rows_to_insert)
-        job = client.load_table_from_dataframe(df, table_ref, job_config=job_config)
-        job.result()
+        errors = await run_storage_call(table_ref, insert_data_into_bigquery, table_ref, rows_to_insert, use_load_job=True, key_column="class_id")
+        if errors:
+            print(f"BigQuery errors: {errors}")
+            raise HTTPException(status_code=400, detail=str(errors))
         print(f"Successfully added {len(classes)} classes")
         return {"message": f"Added {len(classes)} class(es) successfully"}
+    except StorageDeadlineExceeded:
+        # Answered with 504 by the handler in main.py
+        raise
     except Exception as e:
         print(f"Error in add_classes: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        client.close() 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
@@ -0,0 +1,38 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from services.async_storage import executor_stats
+from services.insert_buffer import quarantine_stats
+from services.replica import replica_stats
+from services.resilience import resilience_stats
+from services.shared_state import shared_state_stats
+from services.single_flight import single_flight_stats
+from services.startup import is_ready, start_warm_up, startup_report
+from services.storage_engine import get_storage_engine
+
+router = APIRouter()
+
+@router.get("/health/storage")
+def storage_health():
+    """Storage connection pool, credentials and worker pool state, with retry, hedging, shared read and replica counts."""
+    return {
+        **get_storage_engine().health(),
+        "executor": executor_stats(),
+        "resilience": resilience_stats(),
+        "single_flight": single_flight_stats(),
+        "replicas": replica_stats(),
+        "shared_state": shared_state_stats(),
+        "insert_quarantine": quarantine_stats(),
+    }
+
+@router.get("/health/ready")
+def readiness():
+    """200 once the storage warm-up has finished, 503 before (a failed warm-up is retried)."""
+    if is_ready():
+        return {"ready": True}
+    start_warm_up()
+    return JSONResponse(status_code=503, content=startup_report())
+
+@router.get("/health/startup")
+def startup():
+    """Import cost per module and warm-up time of this process."""
+    return startup_report()
@@ -1,58 +1,57 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
 from services.bigquery_service import *
-from models.parent import ParentUpdate, ParentCreate
-import pandas as pd
-from io import StringIO, BytesIO
-import re
+from services.id_allocator import allocate_ids
+from services.async_storage import run_storage_call
+from services.resilience import ID_LOOKUP, READ, StorageDeadlineExceeded, call_with_policy
+from services.write_scheduler import count_updated, schedule_delete, schedule_upsert
+from services.table_cache import cached_table_response
+from services.read_query import parse_read_query
+from services.streaming import ndjson_response, wants_ndjson
+from services.arrow_format import arrow_table_response, wants_arrow
+from services.ingest import ingest_upload
+from models.parent import ParentUpdate, ParentPatch
 
 router = APIRouter()
 
-def get_next_parent_id():
-    """Generate the next sequential parent ID (P001, P002, etc.)"""
+async def get_next_parent_ids(count):
+    """Reserve `count` sequential parent IDs (P001, P002, etc.) with a single query"""
     table_ref = get_table("groups", "parent")
-    try:
-        query = f"""
-            SELECT parent_id FROM `{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}`
-            WHERE parent_id LIKE 'P%'
-            ORDER BY parent_id DESC
-            LIMIT 1
-        """
-        query_job = client.query(query)
-        results = query_job.result()
-        if results.total_rows == 0:
-            return "P001"
-        latest_id = list(results)[0]['parent_id']
-        match = re.match(r'P(\d+)', latest_id)
-        if match:
-            next_num = int(match.group(1)) + 1
-            return f"P{next_num:03d}"
-        else:
-            return "P001"
-    except Exception as e:
-        print(f"Error generating next parent ID: {e}")
-        return "P001"
+    return await call_with_policy(ID_LOOKUP, table_ref, allocate_ids, table_ref, "parent_id", "P", count)
 
 @router.get("/get-parent")
-async def get_data():
+async def get_data(request: Request):
+    """
+    List parents. Optional query parameters: limit, cursor, columns, order_by,
+    descending, <column>=value and <column>_from / <column>_to.
+    Send Accept: application/x-ndjson to stream the rows as NDJSON, or
+    Accept: application/vnd.apache.arrow.stream for an Arrow IPC stream.
+    """
     table_ref = get_table("groups", "parent")
-    return fetch_data_from_bigquery(table_ref)
+    read_query = parse_read_query(request, ParentUpdate, "parent_id")
+    if wants_ndjson(request):
+        return ndjson_response(table_ref, read_query)
+    if wants_arrow(request):
+        return await arrow_table_response(request, table_ref, read_query)
+    return await cached_table_response(
+        request,
+        table_ref,
+        lambda: call_with_policy(READ, table_ref, fetch_data_from_bigquery, table_ref, read_query),
+        variant=read_query.cache_key() if read_query else "",
+    )
 
 @router.post("/upload-parent")
 async def upload_data(file: UploadFile = File(...)):
     try:
-        content = await file.read()
-
-        if file.filename.endswith(".csv"):
-            df = pd.read_csv(StringIO(content.decode("utf-8")))
-        elif file.filename.endswith((".xls", ".xlsx")):
-            df = pd.read_excel(BytesIO(content))
-        else:
+        if not file.filename.endswith((".csv", ".xls", ".xlsx")):
             return {"error": "Unsupported file type"}
         
         table_ref = get_table("groups", "parent")
         
-        upload_data_to_bigquery(df, table_ref, "parent_id")
-        return {"message": "File uploaded to BigQuery"}
+        summary = await ingest_upload(file, table_ref, "parent_id")
+        return {"message": "File uploaded to BigQuery", **summary}
+    except StorageDeadlineExceeded:
+        # Answered with 504 by the handler in main.py
+        raise
     except Exception as e:
         return {"error": str(e)}
 
@@ -66,8 +65,8 @@ async def add_parents(parents: list[dict]):
     try:
         print(f"Received {len(parents)} parents to add:")
         rows_to_insert = []
-        for parent_data in parents:
-            new_id = get_next_parent_id()
+        new_ids = await get_next_parent_ids(len(parents))
+        for parent_data, new_id in zip(parents, new_ids):
             print(f"Generated ID: {new_id} for parent: {parent_data.get('name', 'Unknown')}")
             row_to_insert = {
                 "parent_id": new_id,
@@ -79,15 +78,15 @@ async def add_parents(parents: list[dict]):
             rows_to_insert.append(row_to_insert)
             print(f"Row to insert: {row_to_insert}")
         print(f"Inserting {len(rows_to_insert)} rows into BigQuery...")
-        errors = client.insert_rows_json(
-            f"{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}",
-            rows_to_insert
-        )
+        errors = await run_storage_call(table_ref, insert_data_into_bigquery, table_ref, rows_to_insert, key_column="parent_id")
         if errors:
             print(f"BigQuery errors: {errors}")
             raise HTTPException(status_code=400, detail=str(errors))
         print(f"Successfully added {len(parents)} parents")
         return {"message": f"Added {len(parents)} parent(s) successfully"}
+    except StorageDeadlineExceeded:
+        # Answered with 504 by the handler in main.py
+        raise
     except Exception as e:
         print(f"Error in add_parents: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -101,67 +100,58 @@ async def update_parent(parents: list[ParentUpdate]):
         for i, parent in enumerate(parents):
             print(f"Parent {i+1}: {parent}")
         
-        # Use temporary table approach to avoid streaming buffer issues
-        temp_table_id = f"{table_ref.project}.{table_ref.dataset_id}.temp_update_{table_ref.table_id}"
-        
-        # Create temporary table with updated data
-        temp_data = []
+        # Collect the updated values
+        rows = []
         for parent in parents:
-            temp_data.append({
+            rows.append({
                 "parent_id": parent.parent_id,
                 "name": parent.name,
                 "phone_number": parent.phone_number,
                 "email": parent.email,
-                "address": parent.address
+                "address": parent.address,
+                "row_version": parent.row_version
             })
-        
-        # Upload to temporary table
-        from google.cloud import bigquery
-        job_config = bigquery.LoadJobConfig(
-            write_disposition="WRITE_TRUNCATE",
-            autodetect=True
-        )
-        
-        temp_df = pd.DataFrame(temp_data)
-        client.load_table_from_dataframe(temp_df, temp_table_id, job_config=job_config).result()
-        print(f"Temporary table created: {temp_table_id}")
-        
-        # Use MERGE from temp table to main table
-        for parent in parents:
-            merge_query = f"""
-                MERGE `{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}` T
-                USING `{temp_table_id}` S
-                ON T.parent_id = S.parent_id
-                WHEN MATCHED THEN
-                    UPDATE SET
-                        name = S.name,
-                        phone_number = S.phone_number,
-                        email = S.email,
-                        address = S.address
-            """
-            print(f"Executing MERGE query for parent {parent.parent_id}")
-            query_job = client.query(merge_query)
-            query_job.result()
-            print(f"MERGE completed for parent {parent.parent_id}")
 
-        # Clean up temporary table
-        client.delete_table(temp_table_id, not_found_ok=True)
-        print("Temporary table deleted")
+        results = await schedule_upsert(table_ref, rows, "parent_id")
 
         print("All update operations completed successfully")
-        return {"message": f"Updated {len(parents)} parent successfully"}
+        return {"message": f"Updated {count_updated(results)} of {len(parents)} parent(s)", "results": results}
     except Exception as e:
         print(f"Error in update_parent: {e}")
-        # Clean up temporary table on error
-        try:
-            client.delete_table(temp_table_id, not_found_ok=True)
-        except:
-            pass
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        client.close()
+
+@router.patch("/update-parent")
+async def patch_parents(parents: list[ParentPatch]):
+    """
+    Update only the fields sent for each parent. Rows setting the same fields
+    are written together, and each statement only touches those columns.
+    With row_version set, a row changed by someone else since is left alone
+    and reported with status "conflict".
+    """
+    table_ref = get_table("groups", "parent")
+    try:
+        rows = [parent.model_dump(exclude_unset=True) for parent in parents]
+        results = await schedule_upsert(table_ref, rows, "parent_id")
+        return {"message": f"Updated {count_updated(results)} of {len(parents)} parent(s)", "results": results}
+    except Exception as e:
+        print(f"Error in patch_parents: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/delete-parent/{parent_id}")
 async def delete_parent(parent_id: str):
     table_ref = get_table("groups", "parent")
-    return delete_data_from_bigquery(table_ref,"parent_id", parent_id)
\ No newline at end of file
+    return await schedule_delete(table_ref, "parent_id", [parent_id])
+
+@router.delete("/delete-parent")
+async def delete_parents(parent_ids: list[str]):
+    """
+    Delete several parents with a single statement. Expects a list of parent_id values.
+    Reports which IDs were deleted, missing, or blocked by BigQuery's streaming buffer.
+    """
+    table_ref = get_table("groups", "parent")
+    try:
+        report = await schedule_delete(table_ref, "parent_id", parent_ids)
+        return {"message": f"Deleted {len(report['deleted'])} parent(s)", **report}
+    except Exception as e:
+        print(f"Error in delete_parents: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -1,69 +1,59 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
 from services.bigquery_service import *
-from models.student import StudentUpdate, StudentCreate
-import pandas as pd
-from io import StringIO, BytesIO
-from uuid import uuid4
+from services.id_allocator import allocate_ids
+from services.async_storage import run_storage_call
+from services.resilience import ID_LOOKUP, READ, StorageDeadlineExceeded, call_with_policy
+from services.write_scheduler import count_updated, schedule_delete, schedule_upsert
+from services.table_cache import cached_table_response
+from services.read_query import parse_read_query
+from services.streaming import ndjson_response, wants_ndjson
+from services.arrow_format import arrow_table_response, wants_arrow
+from services.ingest import ingest_upload
+from models.student import StudentUpdate, StudentPatch, StudentCreate
 from typing import List, Dict, Any
-import re
-from google.cloud import bigquery
 
 
 router = APIRouter()
 
-def get_next_student_id():
-    """Generate the next sequential student ID (S001, S002, etc.)"""
+async def get_next_student_ids(count):
+    """Reserve `count` sequential student IDs (S001, S002, etc.) with a single query"""
     table_ref = get_table("groups", "student")
-    try:
-        # Get all existing student IDs
-        query = f"""
-            SELECT student_id FROM `{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}`
-            WHERE student_id LIKE 'S%'
-            ORDER BY student_id DESC
-            LIMIT 1
-        """
-        query_job = client.query(query)
-        results = query_job.result()
-        
-        if results.total_rows == 0:
-            return "S001"
-        
-        # Get the highest existing ID
-        latest_id = list(results)[0]['student_id']
-        
-        # Extract the number part and increment
-        match = re.match(r'S(\d+)', latest_id)
-        if match:
-            next_num = int(match.group(1)) + 1
-            return f"S{next_num:03d}"
-        else:
-            return "S001"
-            
-    except Exception as e:
-        print(f"Error generating next ID: {e}")
-        return "S001"
+    return await call_with_policy(ID_LOOKUP, table_ref, allocate_ids, table_ref, "student_id", "S", count)
 
 @router.get("/get-student")
-async def get_data():
+async def get_data(request: Request):
+    """
+    List students. Optional query parameters: limit, cursor, columns, order_by,
+    descending, <column>=value and <column>_from / <column>_to.
+    Send Accept: application/x-ndjson to stream the rows as NDJSON, or
+    Accept: application/vnd.apache.arrow.stream for an Arrow IPC stream.
+    """
     table_ref = get_table("groups", "student")
-    return fetch_data_from_bigquery(table_ref)
+    read_query = parse_read_query(request, StudentUpdate, "student_id")
+    if wants_ndjson(request):
+        return ndjson_response(table_ref, read_query)
+    if wants_arrow(request):
+        return await arrow_table_response(request, table_ref, read_query)
+    return await cached_table_response(
+        request,
+        table_ref,
+        lambda: call_with_policy(READ, table_ref, fetch_data_from_bigquery, table_ref, read_query),
+        variant=read_query.cache_key() if read_query else "",
+    )
 
 @router.post("/upload-student")
 async def upload_data(file: UploadFile = File(...)):
     try:
-        content = await file.read()
-
-        if file.filename.endswith(".csv"):
-            df = pd.read_csv(StringIO(content.decode("utf-8")))
-        elif file.filename.endswith((".xls", ".xlsx")):
-            df = pd.read_excel(BytesIO(content))
-        else:
+        if not file.filename.endswith((".csv", ".xls", ".xlsx")):
             return {"error": "Unsupported file type"}
         
         table_ref = get_table("groups", "student")
         
-        upload_data_to_bigquery(df, table_ref, "student_id")
-        return {"message": "File uploaded to BigQuery"}
+        summary = await ingest_upload(file, table_ref, "student_id")
+        return {"message": "File uploaded to BigQuery", **summary}
+    except StorageDeadlineExceeded:
+        # Answered with 504 by the handler in main.py
+        raise
     except Exception as e:
         return {"error": str(e)}
 
@@ -81,9 +71,9 @@ async def add_students(students: List[Dict[str, Any]]):
             print(f"Student {i+1}: {student}")
         
         rows_to_insert = []
-        for student_data in students:
-            # Generate new sequential ID for each student
-            new_id = get_next_student_id()
+        # Reserve one sequential ID per student up front
+        new_ids = await get_next_student_ids(len(students))
+        for student_data, new_id in zip(students, new_ids):
             print(f"Generated ID: {new_id} for student: {student_data.get('first_name', 'Unknown')}")
             
             # Create row with all required fields
@@ -102,10 +92,7 @@ async def add_students(students: List[Dict[str, Any]]):
 
         # Insert all rows at once
         print(f"Inserting {len(rows_to_insert)} rows into BigQuery...")
-        errors = client.insert_rows_json(
-            f"{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}", 
-            rows_to_insert
-        )
+        errors = await run_storage_call(table_ref, insert_data_into_bigquery, table_ref, rows_to_insert, key_column="student_id")
         
         if errors:
             print(f"BigQuery errors: {errors}")
@@ -113,6 +100,9 @@ async def add_students(students: List[Dict[str, Any]]):
         
         print(f"Successfully added {len(students)} students")
         return {"message": f"Added {len(students)} student(s) successfully"}
+    except StorageDeadlineExceeded:
+        # Answered with 504 by the handler in main.py
+        raise
     except Exception as e:
         print(f"Error in add_students: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -126,13 +116,10 @@ async def update_student(students: list[StudentUpdate]):
         for i, student in enumerate(students):
             print(f"Student {i+1}: {student}")
         
-        # Use temporary table approach to avoid streaming buffer issues
-        temp_table_id = f"{table_ref.project}.{table_ref.dataset_id}.temp_update_{table_ref.table_id}"
-        
-        # Create temporary table with updated data
-        temp_data = []
+        # Collect the updated values
+        rows = []
         for student in students:
-            temp_data.append({
+            rows.append({
                 "student_id": student.student_id,
                 "first_name": student.first_name,
                 "last_name": student.last_name,
@@ -140,61 +127,53 @@ async def update_student(students: list[StudentUpdate]):
                 "gender": student.gender,
                 "address": student.address,
                 "parent_id": student.parent_id,
-                "teacher_id": student.teacher_id
+                "teacher_id": student.teacher_id,
+                "row_version": student.row_version
             })
-        
-        # Upload to temporary table
-        job_config = bigquery.LoadJobConfig(
-            write_disposition="WRITE_TRUNCATE",
-            autodetect=True
-        )
-        
-        temp_df = pd.DataFrame(temp_data)
-        client.load_table_from_dataframe(temp_df, temp_table_id, job_config=job_config).result()
-        print(f"Temporary table created: {temp_table_id}")
-        
-        # Use MERGE from temp table to main table
-        for student in students:
-            merge_query = f"""
-                MERGE `{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}` T
-                USING `{temp_table_id}` S
-                ON T.student_id = S.student_id
-                WHEN MATCHED THEN
-                    UPDATE SET
-                        first_name = S.first_name,
-                        last_name = S.last_name,
-                        date_of_birth = S.date_of_birth,
-                        gender = S.gender,
-                        address = S.address,
-                        parent_id = S.parent_id,
-                        teacher_id = S.teacher_id
-            """
-            print(f"Executing MERGE query for student {student.student_id}")
-            query_job = client.query(merge_query)
-            query_job.result()
-            print(f"MERGE completed for student {student.student_id}")
 
-        # Clean up temporary table
-        client.delete_table(temp_table_id, not_found_ok=True)
-        print("Temporary table deleted")
+        results = await schedule_upsert(table_ref, rows, "student_id")
 
         print("All update operations completed successfully")
-        return {"message": f"Updated {len(students)} student successfully"}
+        return {"message": f"Updated {count_updated(results)} of {len(students)} student(s)", "results": results}
     except Exception as e:
         print(f"Error in update_student: {e}")
-        # Clean up temporary table on error
-        try:
-            client.delete_table(temp_table_id, not_found_ok=True)
-        except:
-            pass
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        client.close()
+
+@router.patch("/update-student")
+async def patch_students(students: list[StudentPatch]):
+    """
+    Update only the fields sent for each student. Rows setting the same fields
+    are written together, and each statement only touches those columns.
+    With row_version set, a row changed by someone else since is left alone
+    and reported with status "conflict".
+    """
+    table_ref = get_table("groups", "student")
+    try:
+        rows = [student.model_dump(exclude_unset=True) for student in students]
+        results = await schedule_upsert(table_ref, rows, "student_id")
+        return {"message": f"Updated {count_updated(results)} of {len(students)} student(s)", "results": results}
+    except Exception as e:
+        print(f"Error in patch_students: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/delete-student/{student_id}")
 async def delete_student(student_id: str):
     table_ref = get_table("groups", "student")
-    return delete_data_from_bigquery(table_ref,"student_id", student_id)
+    return await schedule_delete(table_ref, "student_id", [student_id])
+
+@router.delete("/delete-student")
+async def delete_students(student_ids: list[str]):
+    """
+    Delete several students with a single statement. Expects a list of student_id values.
+    Reports which IDs were deleted, missing, or blocked by BigQuery's streaming buffer.
+    """
+    table_ref = get_table("groups", "student")
+    try:
+        report = await schedule_delete(table_ref, "student_id", student_ids)
+        return {"message": f"Deleted {len(report['deleted'])} student(s)", **report}
+    except Exception as e:
+        print(f"Error in delete_students: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/insert-student")
 async def insert_student(student: StudentCreate):
@@ -203,7 +182,7 @@ async def insert_student(student: StudentCreate):
     Use /add-student for multiple students from the grid interface.
     """
     table_ref = get_table("groups", "student")
-    new_id = get_next_student_id()
+    new_id = (await get_next_student_ids(1))[0]
     row_to_insert = {
         "student_id": new_id,
         "first_name": student.first_name,
@@ -215,7 +194,7 @@ async def insert_student(student: StudentCreate):
         "teacher_id": student.teacher_id
     }
 
-    errors = client.insert_rows_json(f"{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}", [row_to_insert])
+    errors = await run_storage_call(table_ref, insert_data_into_bigquery, table_ref, [row_to_insert], key_column="student_id")
     if errors:
         raise HTTPException(status_code=400, detail=str(errors))
     return {"message": "Inserted", "id": new_id}
\ No newline at end of file
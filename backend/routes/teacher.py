@@ -1,59 +1,58 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
 from services.bigquery_service import *
-from models.teacher import TeacherUpdate, TeacherCreate
-import pandas as pd
-from io import StringIO, BytesIO
-import re
+from services.id_allocator import allocate_ids
+from services.async_storage import run_storage_call
+from services.resilience import ID_LOOKUP, READ, StorageDeadlineExceeded, call_with_policy
+from services.write_scheduler import count_updated, schedule_delete, schedule_upsert
+from services.table_cache import cached_table_response
+from services.read_query import parse_read_query
+from services.streaming import ndjson_response, wants_ndjson
+from services.arrow_format import arrow_table_response, wants_arrow
+from services.ingest import ingest_upload
+from models.teacher import TeacherUpdate, TeacherPatch
 
 
 router = APIRouter()
 
-def get_next_teacher_id():
-    """Generate the next sequential teacher ID (T001, T002, etc.)"""
+async def get_next_teacher_ids(count):
+    """Reserve `count` sequential teacher IDs (T001, T002, etc.) with a single query"""
     table_ref = get_table("groups", "teacher")
-    try:
-        query = f"""
-            SELECT teacher_id FROM `{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}`
-            WHERE teacher_id LIKE 'T%'
-            ORDER BY teacher_id DESC
-            LIMIT 1
-        """
-        query_job = client.query(query)
-        results = query_job.result()
-        if results.total_rows == 0:
-            return "T001"
-        latest_id = list(results)[0]['teacher_id']
-        match = re.match(r'T(\d+)', latest_id)
-        if match:
-            next_num = int(match.group(1)) + 1
-            return f"T{next_num:03d}"
-        else:
-            return "T001"
-    except Exception as e:
-        print(f"Error generating next teacher ID: {e}")
-        return "T001"
+    return await call_with_policy(ID_LOOKUP, table_ref, allocate_ids, table_ref, "teacher_id", "T", count)
 
 @router.get("/get-teacher")
-async def get_data():
+async def get_data(request: Request):
+    """
+    List teachers. Optional query parameters: limit, cursor, columns, order_by,
+    descending, <column>=value and <column>_from / <column>_to.
+    Send Accept: application/x-ndjson to stream the rows as NDJSON, or
+    Accept: application/vnd.apache.arrow.stream for an Arrow IPC stream.
+    """
     table_ref = get_table("groups", "teacher")
-    return fetch_data_from_bigquery(table_ref)
+    read_query = parse_read_query(request, TeacherUpdate, "teacher_id")
+    if wants_ndjson(request):
+        return ndjson_response(table_ref, read_query)
+    if wants_arrow(request):
+        return await arrow_table_response(request, table_ref, read_query)
+    return await cached_table_response(
+        request,
+        table_ref,
+        lambda: call_with_policy(READ, table_ref, fetch_data_from_bigquery, table_ref, read_query),
+        variant=read_query.cache_key() if read_query else "",
+    )
 
 @router.post("/upload-teacher")
 async def upload_data(file: UploadFile = File(...)):
     try:
-        content = await file.read()
-
-        if file.filename.endswith(".csv"):
-            df = pd.read_csv(StringIO(content.decode("utf-8")))
-        elif file.filename.endswith((".xls", ".xlsx")):
-            df = pd.read_excel(BytesIO(content))
-        else:
+        if not file.filename.endswith((".csv", ".xls", ".xlsx")):
             return {"error": "Unsupported file type"}
         
         table_ref = get_table("groups", "teacher")
         
-        upload_data_to_bigquery(df, table_ref, "teacher_id")
-        return {"message": "File uploaded to BigQuery"}
+        summary = await ingest_upload(file, table_ref, "teacher_id")
+        return {"message": "File uploaded to BigQuery", **summary}
+    except StorageDeadlineExceeded:
+        # Answered with 504 by the handler in main.py
+        raise
     except Exception as e:
         return {"error": str(e)}
 
@@ -67,8 +66,8 @@ async def add_teachers(teachers: list[dict]):
     try:
         print(f"Received {len(teachers)} teachers to add:")
         rows_to_insert = []
-        for teacher_data in teachers:
-            new_id = get_next_teacher_id()
+        new_ids = await get_next_teacher_ids(len(teachers))
+        for teacher_data, new_id in zip(teachers, new_ids):
             print(f"Generated ID: {new_id} for teacher: {teacher_data.get('name', 'Unknown')}")
             row_to_insert = {
                 "teacher_id": new_id,
@@ -80,15 +79,15 @@ async def add_teachers(teachers: list[dict]):
             rows_to_insert.append(row_to_insert)
             print(f"Row to insert: {row_to_insert}")
         print(f"Inserting {len(rows_to_insert)} rows into BigQuery...")
-        errors = client.insert_rows_json(
-            f"{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}",
-            rows_to_insert
-        )
+        errors = await run_storage_call(table_ref, insert_data_into_bigquery, table_ref, rows_to_insert, key_column="teacher_id")
         if errors:
             print(f"BigQuery errors: {errors}")
             raise HTTPException(status_code=400, detail=str(errors))
         print(f"Successfully added {len(teachers)} teachers")
         return {"message": f"Added {len(teachers)} teacher(s) successfully"}
+    except StorageDeadlineExceeded:
+        # Answered with 504 by the handler in main.py
+        raise
     except Exception as e:
         print(f"Error in add_teachers: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -102,67 +101,58 @@ async def update_teacher(teachers: list[TeacherUpdate]):
         for i, teacher in enumerate(teachers):
             print(f"Teacher {i+1}: {teacher}")
         
-        # Use temporary table approach to avoid streaming buffer issues
-        temp_table_id = f"{table_ref.project}.{table_ref.dataset_id}.temp_update_{table_ref.table_id}"
-        
-        # Create temporary table with updated data
-        temp_data = []
+        # Collect the updated values
+        rows = []
         for teacher in teachers:
-            temp_data.append({
+            rows.append({
                 "teacher_id": teacher.teacher_id,
                 "name": teacher.name,
                 "email": teacher.email,
                 "phone_number": teacher.phone_number,
-                "class_id": teacher.class_id
+                "class_id": teacher.class_id,
+                "row_version": teacher.row_version
             })
-        
-        # Upload to temporary table
-        from google.cloud import bigquery
-        job_config = bigquery.LoadJobConfig(
-            write_disposition="WRITE_TRUNCATE",
-            autodetect=True
-        )
-        
-        temp_df = pd.DataFrame(temp_data)
-        client.load_table_from_dataframe(temp_df, temp_table_id, job_config=job_config).result()
-        print(f"Temporary table created: {temp_table_id}")
-        
-        # Use MERGE from temp table to main table
-        for teacher in teachers:
-            merge_query = f"""
-                MERGE `{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}` T
-                USING `{temp_table_id}` S
-                ON T.teacher_id = S.teacher_id
-                WHEN MATCHED THEN
-                    UPDATE SET
-                        name = S.name,
-                        email = S.email,
-                        phone_number = S.phone_number,
-                        class_id = S.class_id
-            """
-            print(f"Executing MERGE query for teacher {teacher.teacher_id}")
-            query_job = client.query(merge_query)
-            query_job.result()
-            print(f"MERGE completed for teacher {teacher.teacher_id}")
 
-        # Clean up temporary table
-        client.delete_table(temp_table_id, not_found_ok=True)
-        print("Temporary table deleted")
+        results = await schedule_upsert(table_ref, rows, "teacher_id")
 
         print("All update operations completed successfully")
-        return {"message": f"Updated {len(teachers)} teacher successfully"}
+        return {"message": f"Updated {count_updated(results)} of {len(teachers)} teacher(s)", "results": results}
     except Exception as e:
         print(f"Error in update_teacher: {e}")
-        # Clean up temporary table on error
-        try:
-            client.delete_table(temp_table_id, not_found_ok=True)
-        except:
-            pass
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        client.close()
+
+@router.patch("/update-teacher")
+async def patch_teachers(teachers: list[TeacherPatch]):
+    """
+    Update only the fields sent for each teacher. Rows setting the same fields
+    are written together, and each statement only touches those columns.
+    With row_version set, a row changed by someone else since is left alone
+    and reported with status "conflict".
+    """
+    table_ref = get_table("groups", "teacher")
+    try:
+        rows = [teacher.model_dump(exclude_unset=True) for teacher in teachers]
+        results = await schedule_upsert(table_ref, rows, "teacher_id")
+        return {"message": f"Updated {count_updated(results)} of {len(teachers)} teacher(s)", "results": results}
+    except Exception as e:
+        print(f"Error in patch_teachers: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/delete-teacher/{teacher_id}")
 async def delete_teacher(teacher_id: str):
     table_ref = get_table("groups", "teacher")
-    return delete_data_from_bigquery(table_ref,"teacher_id", teacher_id)
\ No newline at end of file
+    return await schedule_delete(table_ref, "teacher_id", [teacher_id])
+
+@router.delete("/delete-teacher")
+async def delete_teachers(teacher_ids: list[str]):
+    """
+    Delete several teachers with a single statement. Expects a list of teacher_id values.
+    Reports which IDs were deleted, missing, or blocked by BigQuery's streaming buffer.
+    """
+    table_ref = get_table("groups", "teacher")
+    try:
+        report = await schedule_delete(table_ref, "teacher_id", teacher_ids)
+        return {"message": f"Deleted {len(report['deleted'])} teacher(s)", **report}
+    except Exception as e:
+        print(f"Error in delete_teachers: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -0,0 +1,31 @@
+import pyarrow as pa
+
+from services.resilience import READ, call_with_policy
+from services.bigquery_service import fetch_arrow_from_bigquery
+from services.table_cache import cached_table_response
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def wants_arrow(request):
+    return ARROW_STREAM_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def serialize_arrow(table):
+    """Encode a pyarrow.Table as an Arrow IPC stream."""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+async def arrow_table_response(request, table_ref, read_query=None):
+    """Serve a table read as an Arrow IPC stream, through the same cache as the JSON reads."""
+    return await cached_table_response(
+        request,
+        table_ref,
+        lambda: call_with_policy(READ, table_ref, fetch_arrow_from_bigquery, table_ref, read_query),
+        variant=read_query.cache_key() if read_query else "",
+        media_type=ARROW_STREAM_MEDIA_TYPE,
+        serialize=serialize_arrow,
+    )
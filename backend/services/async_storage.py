@@ -0,0 +1,82 @@
+import asyncio
+import functools
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from config import settings
+
+# Storage clients are blocking (BigQuery jobs, sqlite3), so every call made from a
+# route handler runs on this pool instead of on the event loop. Created on first
+# use and shut down with the app (see main.lifespan).
+_executor = None
+_executor_lock = threading.Lock()
+
+# asyncio semaphores belong to one event loop, so keep one set per loop
+_table_semaphores = weakref.WeakKeyDictionary()
+
+
+def parse_table_limits(value):
+    """Parse "assessment=8,student=2" into {"assessment": 8, "student": 2}."""
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            table_id, limit = item.split("=", 1)
+            limits[table_id.strip()] = int(limit)
+    return limits
+
+
+table_limits = parse_table_limits(settings.STORAGE_TABLE_CONCURRENCY_OVERRIDES)
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.STORAGE_MAX_WORKERS, thread_name_prefix="storage")
+        return _executor
+
+
+def executor_stats():
+    """Worker count and calls waiting for a free worker, for the health report."""
+    executor = _executor
+    if executor is None:
+        return {"max_workers": settings.STORAGE_MAX_WORKERS, "threads": 0, "queued": 0}
+    return {
+        "max_workers": executor._max_workers,
+        "threads": len(executor._threads),
+        "queued": executor._work_queue.qsize(),
+    }
+
+
+def get_table_semaphore(table_ref):
+    loop = asyncio.get_running_loop()
+    semaphores = _table_semaphores.setdefault(loop, {})
+    if table_ref.full_id not in semaphores:
+        limit = table_limits.get(table_ref.table_id, settings.STORAGE_TABLE_CONCURRENCY)
+        semaphores[table_ref.full_id] = asyncio.Semaphore(limit)
+    return semaphores[table_ref.full_id]
+
+
+async def run_storage_call(table_ref, func, *args, **kwargs):
+    """
+    Await a blocking storage call without stalling the event loop.
+    At most STORAGE_TABLE_CONCURRENCY calls per table are in flight at once.
+    """
+    async with get_table_semaphore(table_ref):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a short blocking call (e.g. on the shared state file) on the pool, outside the per-table limits."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
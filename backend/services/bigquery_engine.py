@@ -0,0 +1,648 @@
+import datetime
+import json
+import os
+import tempfile
+import threading
+import tomllib
+import uuid
+from decimal import Decimal
+
+import google.auth
+from google.auth.credentials import with_scopes_if_required
+from google.api_core.exceptions import BadRequest
+from google.auth.transport.requests import AuthorizedSession, Request
+from google.cloud import bigquery
+from google.oauth2 import service_account
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import re
+import requests
+
+from config import settings
+from services.change_feed import tracked_write
+from services.read_query import build_order_clause, build_where_clause
+from services.schema_coercion import coerce_frame, normalize_type
+from services.storage_engine import (
+    QUARANTINE_SUFFIX,
+    TOMBSTONE_SUFFIX,
+    UPDATED_AT_COLUMN,
+    VERSION_COLUMN,
+    StorageEngine,
+    VersionConflict,
+    build_delete_report,
+    build_outcomes,
+    dedupe_rows,
+)
+
+
+def query_parameter(name, value):
+    """Build a typed BigQuery query parameter from a python value."""
+    if isinstance(value, bool):
+        return bigquery.ScalarQueryParameter(name, "BOOL", value)
+    if isinstance(value, int):
+        return bigquery.ScalarQueryParameter(name, "INT64", value)
+    if isinstance(value, float):
+        return bigquery.ScalarQueryParameter(name, "FLOAT64", value)
+    if isinstance(value, datetime.datetime):
+        return bigquery.ScalarQueryParameter(name, "TIMESTAMP", value)
+    if isinstance(value, datetime.date):
+        return bigquery.ScalarQueryParameter(name, "DATE", value)
+    return bigquery.ScalarQueryParameter(name, "STRING", value)
+
+
+def to_parameter_value(value):
+    """Convert pandas/numpy values into plain python values for query parameters."""
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def to_json_value(value):
+    """Convert pandas/numpy values into what a JSON load job accepts."""
+    value = to_parameter_value(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def rows_parameter(name, rows, columns, schema):
+    """ARRAY<STRUCT> parameter holding the rows, typed from the table schema."""
+    column_types = dict(schema)
+    return bigquery.ArrayQueryParameter(name, "STRUCT", [
+        bigquery.StructQueryParameter(None, *[
+            bigquery.ScalarQueryParameter(col, column_types.get(col, "STRING"), to_parameter_value(row[col]))
+            for col in columns
+        ])
+        for row in rows
+    ])
+
+
+def staging_job_config(schema, columns, extra_fields=(), write_disposition="WRITE_TRUNCATE"):
+    """
+    Parquet load config for a staging table. With a registered schema the columns get
+    explicit types, otherwise BigQuery autodetects them.
+    """
+    job_config = bigquery.LoadJobConfig(
+        write_disposition=write_disposition,
+        source_format=bigquery.SourceFormat.PARQUET
+    )
+    if schema is None:
+        job_config.autodetect = True
+        return job_config
+    column_types = dict(schema)
+    job_config.schema = [bigquery.SchemaField(col, column_types[col]) for col in columns] + list(extra_fields)
+    return job_config
+
+
+def load_credentials():
+    """
+    Resolve the service account, first match wins: GCP_SERVICE_ACCOUNT_JSON (inline JSON),
+    GOOGLE_APPLICATION_CREDENTIALS (key file), the [gcp_service_account] section of
+    STREAMLIT_SECRETS_PATH (the file the frontend reads), then application default
+    credentials. Returns (credentials, project id).
+    """
+    if settings.GCP_SERVICE_ACCOUNT_JSON:
+        credentials = service_account.Credentials.from_service_account_info(json.loads(settings.GCP_SERVICE_ACCOUNT_JSON))
+        return credentials, credentials.project_id
+    if settings.GOOGLE_APPLICATION_CREDENTIALS:
+        credentials = service_account.Credentials.from_service_account_file(settings.GOOGLE_APPLICATION_CREDENTIALS)
+        return credentials, credentials.project_id
+    if os.path.exists(settings.STREAMLIT_SECRETS_PATH):
+        with open(settings.STREAMLIT_SECRETS_PATH, "rb") as secrets_file:
+            secrets = tomllib.load(secrets_file)
+        if "gcp_service_account" in secrets:
+            credentials = service_account.Credentials.from_service_account_info(secrets["gcp_service_account"])
+            return credentials, credentials.project_id
+    return google.auth.default()
+
+
+class BigQueryEngine(StorageEngine):
+    name = "bigquery"
+
+    def __init__(self):
+        credentials, self.project_id = load_credentials()
+        # The HTTP session below is built from these, so they need the BigQuery scopes already
+        self.credentials = with_scopes_if_required(credentials, bigquery.Client.SCOPE)
+        self.client = self.create_client()
+        self.project = self.client.project
+        self.staging_ready = False
+        self.staging_lock = threading.Lock()
+
+    def create_client(self):
+        """
+        One client shared by every storage worker. Its HTTP session keeps up to
+        STORAGE_MAX_WORKERS connections open, so concurrent calls reuse warm TLS
+        connections instead of discarding them, and all calls share the
+        credentials' cached access token.
+        """
+        self.http_adapter = requests.adapters.HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=settings.STORAGE_MAX_WORKERS,
+        )
+        session = AuthorizedSession(self.credentials)
+        session.mount("https://", self.http_adapter)
+        return bigquery.Client(credentials=self.credentials, project=self.project_id, _http=session)
+
+    def warm_up(self):
+        # Fetch the access token now rather than on the first request
+        self.credentials.refresh(Request(self.client._http))
+
+    def health(self):
+        pools = []
+        for key in list(self.http_adapter.poolmanager.pools.keys()):
+            pool = self.http_adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append({
+                "host": pool.host,
+                # The pool queue is padded with None up to maxsize, count the open connections
+                "idle_connections": sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0,
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+            })
+        expiry = self.credentials.expiry
+        return {
+            "engine": self.name,
+            "project": self.project,
+            "token_valid": self.credentials.valid,
+            "token_expiry": expiry.isoformat() if expiry else None,
+            "pool_maxsize": settings.STORAGE_MAX_WORKERS,
+            "pools": pools,
+        }
+
+    def staging_table_id(self, table_ref):
+        """
+        Unique staging table for one write, in the staging dataset. Tables left behind
+        by a failed write expire with the dataset's default expiration.
+        """
+        dataset_id = f"{self.project}.{settings.STAGING_DATASET}"
+        if not self.staging_ready:
+            with self.staging_lock:
+                if not self.staging_ready:
+                    # Queries cannot join across locations, keep staging next to the data
+                    dataset = bigquery.Dataset(dataset_id)
+                    dataset.location = self.client.get_dataset(f"{self.project}.{table_ref.dataset_id}").location
+                    dataset.default_table_expiration_ms = settings.STAGING_TABLE_EXPIRATION_SECONDS * 1000
+                    self.client.create_dataset(dataset, exists_ok=True)
+                    self.staging_ready = True
+        return f"{dataset_id}.{table_ref.dataset_id}_{table_ref.table_id}_{uuid.uuid4().hex}"
+
+    def tombstone_table_id(self, table_ref):
+        return f"{table_ref.full_id}{TOMBSTONE_SUFFIX}"
+
+    def quarantine_table_id(self, table_ref):
+        return f"{table_ref.full_id}{QUARANTINE_SUFFIX}"
+
+    def migrate(self, table_refs):
+        """
+        Add the row version and updated_at columns and the tombstone table to tables
+        created before they existed, in one script job.
+        """
+        statements = []
+        for table_ref in table_refs:
+            statements.append(f"""
+                ALTER TABLE `{table_ref.full_id}`
+                ADD COLUMN IF NOT EXISTS {VERSION_COLUMN} INT64,
+                ADD COLUMN IF NOT EXISTS {UPDATED_AT_COLUMN} TIMESTAMP;
+                CREATE TABLE IF NOT EXISTS `{self.tombstone_table_id(table_ref)}` (deleted_key STRING, key_column STRING, deleted_at TIMESTAMP);
+                ALTER TABLE `{self.tombstone_table_id(table_ref)}` ADD COLUMN IF NOT EXISTS key_column STRING;""")
+        if statements:
+            self.client.query("".join(statements)).result()
+
+    def get_schema(self, table_ref):
+        table = self.client.get_table(table_ref.full_id)
+        return [(field.name, normalize_type(field.field_type)) for field in table.schema]
+
+    def build_select(self, table_ref, read_query):
+        """Return (query, job_config) for a plain or ReadQuery-shaped SELECT."""
+        if read_query is None:
+            query = f"""
+            SELECT * FROM `{table_ref.full_id}`
+"""
+            return query, bigquery.QueryJobConfig()
+
+        query_parameters = []
+
+        def placeholder(value):
+            name = f"p{len(query_parameters)}"
+            query_parameters.append(query_parameter(name, value))
+            return f"@{name}"
+
+        # Anti-join against the tombstone table, soft-deleted keys never become query parameters
+        tombstoned = f"""EXISTS (
+                SELECT 1 FROM `{self.tombstone_table_id(table_ref)}` T
+                WHERE T.deleted_key = M.{read_query.key_column}
+                AND T.deleted_at > COALESCE(M.{UPDATED_AT_COLUMN}, TIMESTAMP '1970-01-01'))"""
+        select_columns = read_query.select_columns()
+        select_list = ", ".join(select_columns) if select_columns else "*"
+        query = f"""
+            SELECT {select_list} FROM `{table_ref.full_id}` M
+            {build_where_clause(read_query, placeholder, tombstoned)}
+            {build_order_clause(read_query)}
+        """
+        if read_query.limit is not None:
+            query += f"LIMIT {read_query.limit + 1}"
+        return query, bigquery.QueryJobConfig(query_parameters=query_parameters)
+
+    def fetch_rows(self, table_ref, read_query=None):
+        query, job_config = self.build_select(table_ref, read_query)
+        results = self.client.query(query, job_config=job_config).result()
+        return [dict(row.items()) for row in results]
+
+    def fetch_arrow(self, table_ref, read_query=None):
+        query, job_config = self.build_select(table_ref, read_query)
+        return self.client.query(query, job_config=job_config).result().to_arrow()
+
+    def iter_pages(self, table_ref, read_query=None, page_size=1000):
+        query, job_config = self.build_select(table_ref, read_query)
+        results = self.client.query(query, job_config=job_config).result(page_size=page_size)
+        for page in results.pages:
+            yield [dict(row.items()) for row in page]
+
+    def max_id_number(self, table_ref, key_column, prefix):
+        # Compare the numeric part, string ordering puts "S999" above "S1000"
+        query = f"""
+            SELECT MAX(CAST(SUBSTR({key_column}, @prefix_length + 1) AS INT64)) AS max_number
+            FROM `{table_ref.full_id}`
+            WHERE REGEXP_CONTAINS({key_column}, @pattern)
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("prefix_length", "INT64", len(prefix)),
+                bigquery.ScalarQueryParameter("pattern", "STRING", f"^{re.escape(prefix)}[0-9]+$"),
+            ]
+        )
+        results = list(self.client.query(query, job_config=job_config).result())
+        return results[0]["max_number"] or 0
+
+    @tracked_write
+    def insert_rows(self, table_ref, rows, use_load_job=False, schema=None):
+        if not rows:
+            return []
+        updated_at = datetime.datetime.now(datetime.timezone.utc)
+        if use_load_job:
+            # Request values ("2010-01-01", "" for a DATE) are converted to the table's
+            # types and loaded with an explicit schema, like the staging loads
+            schema = schema or self.get_schema(table_ref)
+            df = coerce_frame(pd.DataFrame(rows).assign(**{UPDATED_AT_COLUMN: updated_at}), schema)
+            job_config = staging_job_config(schema, list(df.columns), write_disposition="WRITE_APPEND")
+            try:
+                self.client.load_table_from_dataframe(df, table_ref.full_id, job_config=job_config).result()
+            except BadRequest:
+                # Tell rows the table refuses apart from a load refused as a whole
+                errors = self.refused_rows(table_ref, df)
+                if not errors:
+                    raise
+                return errors
+            return []
+        return self.client.insert_rows_json(table_ref.full_id, [{**row, UPDATED_AT_COLUMN: updated_at.isoformat()} for row in rows])
+
+    def refused_rows(self, table_ref, df):
+        """
+        Load the rows into a staging table with the target's column definitions,
+        letting BigQuery skip the ones it refuses, and return one
+        {"index": ..., "errors": [...]} per skipped row. Parquet loads can't skip
+        bad records, so this load sends JSON.
+        """
+        row_column = "_insert_row"
+        fields = {field.name: field for field in self.client.get_table(table_ref.full_id).schema}
+        temp_table_id = self.staging_table_id(table_ref)
+        job_config = bigquery.LoadJobConfig(
+            write_disposition="WRITE_TRUNCATE",
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            schema=[fields[col] for col in df.columns if col in fields] + [bigquery.SchemaField(row_column, "INT64")],
+            max_bad_records=len(df),
+        )
+        records = [
+            {**{col: to_json_value(value) for col, value in zip(df.columns, values) if col in fields}, row_column: index}
+            for index, values in enumerate(df.itertuples(index=False, name=None))
+        ]
+        try:
+            job = self.client.load_table_from_json(records, temp_table_id, job_config=job_config)
+            job.result()
+            loaded = {row[row_column] for row in self.client.query(f"SELECT {row_column} FROM `{temp_table_id}`").result()}
+        finally:
+            self.client.delete_table(temp_table_id, not_found_ok=True)
+        messages = [error.get("message") for error in job.errors or []]
+        return [{"index": index, "errors": messages} for index in range(len(records)) if index not in loaded]
+
+    def merge_script(self, table_ref, source, columns, key_column, insert_missing):
+        """
+        Script that records which source keys already exist (with their stored version
+        and whether the expected version still matches), then applies the whole source
+        with a single MERGE. Leaves the keys in the matched_keys temp table.
+        """
+        versioned = VERSION_COLUMN in columns
+        data_columns = [col for col in columns if col not in (VERSION_COLUMN, UPDATED_AT_COLUMN)]
+        conflict = (
+            f"(S.{VERSION_COLUMN} IS NOT NULL AND COALESCE(T.{VERSION_COLUMN}, 0) != S.{VERSION_COLUMN})"
+            if versioned else "FALSE"
+        )
+
+        clauses = []
+        update_columns = [col for col in data_columns if col != key_column]
+        if update_columns:
+            update_clause = ",\n                    ".join(
+                [f"{col} = S.{col}" for col in update_columns]
+                + [f"{VERSION_COLUMN} = COALESCE(T.{VERSION_COLUMN}, 0) + 1",
+                   f"{UPDATED_AT_COLUMN} = CURRENT_TIMESTAMP()"]
+            )
+            clauses.append(f"""
+                WHEN MATCHED AND NOT {conflict} THEN
+                    UPDATE SET
+                    {update_clause}""")
+        if insert_missing:
+            clauses.append(f"""
+                WHEN NOT MATCHED THEN
+                    INSERT ({", ".join(data_columns)}, {VERSION_COLUMN}, {UPDATED_AT_COLUMN})
+                    VALUES ({", ".join(f"S.{col}" for col in data_columns)}, 1, CURRENT_TIMESTAMP())""")
+
+        script = f"""
+                CREATE TEMP TABLE matched_keys AS
+                SELECT S.{key_column} AS matched_key, T.{VERSION_COLUMN} AS stored_version, {conflict} AS conflict
+                FROM {source} S
+                JOIN `{table_ref.full_id}` T ON T.{key_column} = S.{key_column};
+"""
+        if clauses:
+            script += f"""
+                MERGE `{table_ref.full_id}` T
+                USING {source} S
+                ON T.{key_column} = S.{key_column}{"".join(clauses)};
+"""
+        return script
+
+    @tracked_write
+    def bulk_upsert(self, table_ref, rows, key_column, insert_missing=False, schema=None):
+        df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+        if df.empty:
+            return []
+        df = dedupe_rows(df, key_column)
+
+        # Stage the whole batch once as Parquet (avoids streaming buffer issues)
+        temp_table_id = self.staging_table_id(table_ref)
+        job_config = staging_job_config(schema, list(df.columns))
+        self.client.load_table_from_dataframe(df, temp_table_id, job_config=job_config).result()
+        # One script job: record which keys exist, run a single MERGE, drop the staging table,
+        # return the matched keys
+        script = self.merge_script(table_ref, f"`{temp_table_id}`", list(df.columns), key_column, insert_missing)
+        script += f"""
+                DROP TABLE IF EXISTS `{temp_table_id}`;
+                SELECT * FROM matched_keys;
+"""
+        results = list(self.client.query(script).result())
+        stored_versions = {row["matched_key"]: row["stored_version"] for row in results}
+        conflicts = [row["matched_key"] for row in results if row["conflict"]]
+        bumped = any(col not in (key_column, VERSION_COLUMN, UPDATED_AT_COLUMN) for col in df.columns)
+        return build_outcomes(df[key_column].tolist(), key_column, stored_versions, insert_missing, conflicts, bumped)
+
+    @tracked_write
+    def bulk_upsert_batches(self, table_ref, batches, key_column, schema=None):
+        # Spool the batches to a local Parquet file and feed it to a single load job
+        row_column = "_ingest_row"
+        temp_table_id = self.staging_table_id(table_ref)
+        fd, parquet_path = tempfile.mkstemp(suffix=".parquet")
+        os.close(fd)
+        try:
+            total_rows = 0
+            columns = None
+            writer = None
+            try:
+                for batch in batches:
+                    if writer is None:
+                        columns = batch.column_names
+                        writer = pq.ParquetWriter(parquet_path, batch.schema.append(pa.field(row_column, pa.int64())))
+                    row_numbers = pa.array(range(total_rows, total_rows + batch.num_rows), pa.int64())
+                    writer.write_table(batch.append_column(row_column, row_numbers))
+                    total_rows += batch.num_rows
+            finally:
+                if writer is not None:
+                    writer.close()
+            if total_rows == 0:
+                return {"rows": 0, "updated": 0, "inserted": 0}
+
+            job_config = staging_job_config(schema, columns, extra_fields=[bigquery.SchemaField(row_column, "INT64")])
+            with open(parquet_path, "rb") as source_file:
+                self.client.load_table_from_file(source_file, temp_table_id, job_config=job_config).result()
+
+            # Last row in the file wins per key
+            source = f"""(
+                    SELECT * EXCEPT({row_column}) FROM `{temp_table_id}`
+                    WHERE TRUE
+                    QUALIFY ROW_NUMBER() OVER (PARTITION BY {key_column} ORDER BY {row_column} DESC) = 1
+                )"""
+            script = self.merge_script(table_ref, source, columns, key_column, insert_missing=True)
+            script += f"""
+                CREATE TEMP TABLE upload_counts AS
+                SELECT
+                    (SELECT COUNT(*) FROM matched_keys) AS updated,
+                    (SELECT COUNT(DISTINCT {key_column}) FROM `{temp_table_id}`) AS unique_rows;
+                DROP TABLE IF EXISTS `{temp_table_id}`;
+                SELECT * FROM upload_counts;
+"""
+            result = list(self.client.query(script).result())[0]
+        finally:
+            os.remove(parquet_path)
+
+        return {"rows": total_rows, "updated": result["updated"], "inserted": result["unique_rows"] - result["updated"]}
+
+    @tracked_write
+    def delete_many(self, table_ref, key_column, key_values, record_tombstones=True):
+        keys = list(dict.fromkeys(key_values))
+        if not keys:
+            return build_delete_report([], [])
+        tombstones = f"""
+                    INSERT INTO `{self.tombstone_table_id(table_ref)}` (deleted_key, key_column, deleted_at)
+                    SELECT matched_key, @key_column, CURRENT_TIMESTAMP() FROM matched_keys;""" if record_tombstones else ""
+        # One script job: note which keys exist, delete them with a single DML statement
+        # and record their tombstones in the same transaction.
+        # A DELETE touching rows still in the streaming buffer fails as a whole,
+        # report the existing keys as blocked instead of failing the request.
+        script = f"""
+                CREATE TEMP TABLE matched_keys AS
+                SELECT {key_column} AS matched_key
+                FROM `{table_ref.full_id}`
+                WHERE {key_column} IN UNNEST(@ids);
+                BEGIN
+                    BEGIN TRANSACTION;
+                    DELETE FROM `{table_ref.full_id}`
+                    WHERE {key_column} IN UNNEST(@ids);{tombstones}
+                    COMMIT TRANSACTION;
+                    SELECT matched_key, TRUE AS deleted FROM matched_keys;
+                EXCEPTION WHEN ERROR THEN
+                    ROLLBACK TRANSACTION;
+                    IF CONTAINS_SUBSTR(@@error.message, 'streaming buffer') THEN
+                        SELECT matched_key, FALSE AS deleted FROM matched_keys;
+                    ELSE
+                        RAISE USING MESSAGE = @@error.message;
+                    END IF;
+                END;
+"""
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("ids", "STRING", keys),
+                bigquery.ScalarQueryParameter("key_column", "STRING", key_column),
+            ]
+        )
+        results = list(self.client.query(script, job_config=job_config).result())
+        deleted_keys = [row["matched_key"] for row in results if row["deleted"]]
+        blocked_keys = [row["matched_key"] for row in results if not row["deleted"]]
+        return build_delete_report(keys, deleted_keys, blocked_keys)
+
+    def existing_keys(self, table_ref, key_column, key_values):
+        query = f"""
+            SELECT {key_column} AS matched_key FROM `{table_ref.full_id}`
+            WHERE {key_column} IN UNNEST(@ids)
+"""
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("ids", "STRING", list(dict.fromkeys(key_values)))
+            ]
+        )
+        return [row["matched_key"] for row in self.client.query(query, job_config=job_config).result()]
+
+    @tracked_write
+    def record_tombstones(self, table_ref, key_column, key_values):
+        if not key_values:
+            return
+        # A streaming insert, not a DML job: no DML quota and no streaming buffer conflict
+        deleted_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        rows = [{"deleted_key": key, "key_column": key_column, "deleted_at": deleted_at} for key in key_values]
+        errors = self.client.insert_rows_json(self.tombstone_table_id(table_ref), rows)
+        if errors:
+            raise RuntimeError(f"Recording tombstones for {table_ref.full_id} failed: {errors}")
+
+    def record_quarantined(self, table_ref, entries):
+        quarantine_table = f"`{self.quarantine_table_id(table_ref)}`"
+        quarantined_at = datetime.datetime.now(datetime.timezone.utc)
+        rows = [
+            {"row_json": json.dumps(entry["row"], default=str), "errors": json.dumps(entry["errors"], default=str), "quarantined_at": quarantined_at}
+            for entry in entries
+        ]
+        columns = ["row_json", "errors", "quarantined_at"]
+        # A DML insert, streaming inserts can't see a table created moments ago
+        script = f"""
+                CREATE TABLE IF NOT EXISTS {quarantine_table} (row_json STRING, errors STRING, quarantined_at TIMESTAMP);
+                INSERT INTO {quarantine_table} (row_json, errors, quarantined_at)
+                SELECT row_json, errors, quarantined_at FROM UNNEST(@rows);
+"""
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                rows_parameter("rows", rows, columns, [("row_json", "STRING"), ("errors", "STRING"), ("quarantined_at", "TIMESTAMP")])
+            ]
+        )
+        self.client.query(script, job_config=job_config).result()
+
+    def pending_tombstones(self, table_ref):
+        tombstone_table = f"`{self.tombstone_table_id(table_ref)}`"
+        found = list(self.client.query(
+            f"SELECT key_column FROM {tombstone_table} WHERE key_column IS NOT NULL LIMIT 1"
+        ).result())
+        if not found:
+            return None, []
+        key_column = found[0]["key_column"]
+        query = f"""
+            SELECT DISTINCT T.deleted_key
+            FROM {tombstone_table} T
+            JOIN `{table_ref.full_id}` M ON M.{key_column} = T.deleted_key
+            WHERE T.deleted_at > COALESCE(M.{UPDATED_AT_COLUMN}, TIMESTAMP '1970-01-01')
+"""
+        return key_column, [row["deleted_key"] for row in self.client.query(query).result()]
+
+    @tracked_write
+    def execute_batch(self, operations):
+        # One script job in one transaction, every value is a query parameter
+        statements = []
+        query_parameters = []
+        for index, operation in enumerate(operations):
+            table_id = f"`{operation.table_ref.full_id}`"
+            key_column = operation.key_column
+            if operation.op == "delete":
+                query_parameters.append(bigquery.ArrayQueryParameter(f"keys_{index}", "STRING", operation.keys))
+                statements.append(
+                    f"INSERT INTO `{self.tombstone_table_id(operation.table_ref)}` (deleted_key, key_column, deleted_at) "
+                    f"SELECT DISTINCT {key_column}, '{key_column}', CURRENT_TIMESTAMP() FROM {table_id} "
+                    f"WHERE {key_column} IN UNNEST(@keys_{index});"
+                )
+                statements.append(f"DELETE FROM {table_id} WHERE {key_column} IN UNNEST(@keys_{index});")
+            else:
+                columns = operation.columns
+                query_parameters.append(rows_parameter(f"rows_{index}", operation.rows, columns, operation.schema))
+                if operation.op == "add":
+                    statements.append(
+                        f"INSERT INTO {table_id} ({', '.join(columns)}, {UPDATED_AT_COLUMN}) "
+                        f"SELECT {', '.join(columns)}, CURRENT_TIMESTAMP() FROM UNNEST(@rows_{index});"
+                    )
+                else:
+                    if VERSION_COLUMN in columns:
+                        # Abort the whole transaction if a row changed since it was read
+                        statements.append(
+                            f"SET conflict_keys = ARRAY(SELECT S.{key_column} FROM UNNEST(@rows_{index}) S "
+                            f"JOIN {table_id} T ON T.{key_column} = S.{key_column} "
+                            f"WHERE S.{VERSION_COLUMN} IS NOT NULL AND COALESCE(T.{VERSION_COLUMN}, 0) != S.{VERSION_COLUMN});"
+                        )
+                        statements.append(
+                            "IF ARRAY_LENGTH(conflict_keys) > 0 THEN "
+                            "RAISE USING MESSAGE = CONCAT('Version conflict: ', ARRAY_TO_STRING(conflict_keys, ', ')); END IF;"
+                        )
+                    set_clause = ", ".join(
+                        [f"{col} = S.{col}" for col in columns if col not in (key_column, VERSION_COLUMN, UPDATED_AT_COLUMN)]
+                        + [f"{VERSION_COLUMN} = COALESCE(T.{VERSION_COLUMN}, 0) + 1",
+                           f"{UPDATED_AT_COLUMN} = CURRENT_TIMESTAMP()"]
+                    )
+                    statements.append(
+                        f"UPDATE {table_id} T SET {set_clause} "
+                        f"FROM UNNEST(@rows_{index}) S WHERE T.{key_column} = S.{key_column};"
+                    )
+            statements.append("SET row_counts = ARRAY_CONCAT(row_counts, [@@row_count]);")
+
+        body = "\n                    ".join(statements)
+        script = f"""
+                DECLARE row_counts ARRAY<INT64> DEFAULT [];
+                DECLARE conflict_keys ARRAY<STRING> DEFAULT [];
+                BEGIN
+                    BEGIN TRANSACTION;
+                    {body}
+                    COMMIT TRANSACTION;
+                EXCEPTION WHEN ERROR THEN
+                    ROLLBACK TRANSACTION;
+                    RAISE USING MESSAGE = @@error.message;
+                END;
+                SELECT row_counts;
+"""
+        job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+        try:
+            results = list(self.client.query(script, job_config=job_config).result())
+        except Exception as e:
+            conflict = re.search(r"Version conflict: ([\w\-, ]+)", str(e))
+            if conflict:
+                raise VersionConflict(key.strip() for key in conflict.group(1).split(",")) from e
+            raise
+        return list(results[0]["row_counts"])
+
+    def fetch_changes(self, table_ref, key_column, since):
+        # Both lists come back in a single result row
+        query = f"""
+            SELECT
+                ARRAY(SELECT AS STRUCT * FROM `{table_ref.full_id}` WHERE {UPDATED_AT_COLUMN} > @since) AS changed_rows,
+                ARRAY(
+                    SELECT DISTINCT deleted_key FROM `{self.tombstone_table_id(table_ref)}`
+                    WHERE deleted_at > @since
+                ) AS deleted_keys
+"""
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("since", "TIMESTAMP", since)
+            ]
+        )
+        result = list(self.client.query(query, job_config=job_config).result())[0]
+        return [dict(row) for row in result["changed_rows"]], list(result["deleted_keys"])
+
+    def close(self):
+        self.client.close()
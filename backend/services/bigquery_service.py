@@ -1,101 +1,323 @@
-from google.cloud import bigquery
-from google.oauth2 import service_account
+import dataclasses
+
 import pandas as pd
-import streamlit as st
+import pyarrow as pa
+import pyarrow.compute as pc
 
+from config import settings
+from services.change_feed import feed_since, feed_watermark
+from services.schema_coercion import coerce_frame, to_arrow_table
+from services.insert_buffer import enqueue_rows, flush_pending, pending_rows
+from services.replica import get_replica
+from services.schema_registry import get_table_schema, schema_registry
+from services.storage_engine import (
+    UPDATED_AT_COLUMN,
+    VERSION_COLUMN,
+    WriteOperation,
+    get_storage_engine,
+    group_rows_by_columns,
+)
+from services.table_cache import table_cache
+from services.tombstones import compact_table, soft_delete, tombstoned_keys
+from services.upload_reader import iter_upload_frames
 
-credentials_info = st.secrets['gcp_service_account']
-credentials = service_account.Credentials.from_service_account_info(credentials_info)
-def get_bigquery_client():
-    client = bigquery.Client(credentials=credentials, project=credentials.project_id)
-    return client
 
+def get_bigquery_client():
+    """Return the BigQuery client of the active engine (only available with the bigquery engine)."""
+    return get_storage_engine().client
 
-# # Initialize the client
-client = get_bigquery_client()
 
 # referencing and getting the table
 def get_table(dataset_name, table_name):
-    dataset_ref = bigquery.DatasetReference(client.project, dataset_name)
-    tabel_ref = bigquery.TableReference(dataset_ref, table_name)
-    return tabel_ref
+    return get_storage_engine().get_table(dataset_name, table_name)
+
+
+def read_source(table_ref):
+    """The table's local replica when LOCAL_REPLICA_TABLES lists it, the storage engine otherwise."""
+    return get_replica(table_ref) or get_storage_engine()
+
+def with_pending_rows(table_ref, rows):
+    """Add the rows still waiting in the insert buffer to a full-table read."""
+    pending, key_column = pending_rows(table_ref)
+    if not pending:
+        return rows
+    # A flush may have landed between the read and now, don't list those rows twice
+    stored_keys = {row.get(key_column) for row in rows}
+    return rows + [row for row in pending if row.get(key_column) not in stored_keys]
+
+def without_tombstoned(table_ref, rows):
+    """Drop soft-deleted rows that are still stored."""
+    deleted, key_column = tombstoned_keys(table_ref)
+    if not deleted:
+        return rows
+    return [row for row in rows if row.get(key_column) not in deleted]
+
+def exclude_tombstoned(table_ref, read_query):
+    """Have a filtered or paged read skip soft-deleted rows, when the table has any."""
+    deleted, _ = tombstoned_keys(table_ref)
+    if not deleted:
+        return read_query
+    return dataclasses.replace(read_query, exclude_tombstoned=True)
+
+def flush_before_read(table_ref):
+    """Filtered and paged reads run in SQL, so queued rows are written first."""
+    try:
+        flush_pending(table_ref)
+    except Exception as e:
+        print(f"Reading {table_ref.full_id} without its queued rows: {e}")
 
 
 def upload_data_to_bigquery(df, table_ref, key_column):
-    from google.cloud import bigquery
-
-    # Create a temporary table name
-    temp_table_id = f"{table_ref.project}.{table_ref.dataset_id}.temp_{table_ref.table_id}"
-
-    # Get schema of the target table
-    table = client.get_table(table_ref)
-    existing_columns = [field.name for field in table.schema]
-    df = df[[col for col in df.columns if col in existing_columns]]
-
-    # Ensure date format is correct
-    if "date_of_birth" in df.columns:
-        df.loc[:, "date_of_birth"] = pd.to_datetime(df["date_of_birth"], errors="coerce").dt.date
-    
-    if "assessment_date" in df.columns:
-        df["assessment_date"] = pd.to_datetime(df["assessment_date"], errors="coerce").dt.date
-    # Ensure phone number is converted to string
-    if "phone_number" in df.columns:
-        df["phone_number"] = df["phone_number"].astype(str)
-    
-    if "grade_level" in df.columns:
-        df["grade_level"] = df["grade_level"].astype(str)
-
-    # Upload the new data to the temporary table
-    job_config = bigquery.LoadJobConfig(
-        write_disposition="WRITE_TRUNCATE",
-        autodetect=True
-    )
-    client.load_table_from_dataframe(df, temp_table_id, job_config=job_config).result()
-
-    # Build MERGE query from temp to main table
-    column_list = ", ".join(existing_columns)
-    insert_values = ", ".join([f"S.{col}" for col in existing_columns])
-    update_clause = ", ".join([f"{col} = S.{col}" for col in existing_columns if col != key_column])
-
-    merge_query = f"""
-        MERGE `{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}` T
-        USING `{temp_table_id}` S
-        ON T.{key_column} = S.{key_column}
-        WHEN MATCHED THEN
-            UPDATE SET {update_clause}
-        WHEN NOT MATCHED THEN
-            INSERT ({column_list}) VALUES ({insert_values})
-    """
-
-    query_job = client.query(merge_query)
-    query_job.result()
-
-    # Optional: delete the temporary table
-    client.delete_table(temp_table_id, not_found_ok=True)
-
-def fetch_data_from_bigquery(table_ref):
-    query = f"""
-        SELECT * FROM `{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}`
-"""
-    query_job = client.query(query)
-    results = query_job.result()
-    data = [dict(row.items()) for row in results]
-    return data
+    """Insert or update every row of an in-memory DataFrame, converted to the table's types."""
+    # Uploads overwrite unconditionally, version and updated_at columns in the file are ignored
+    return bulk_upsert(table_ref, df.drop(columns=[VERSION_COLUMN, UPDATED_AT_COLUMN], errors="ignore"), key_column, insert_missing=True)
+
+def ingest_file_into_bigquery(path, filename, table_ref, key_column, check_cancelled=None):
+    """
+    Insert or update the rows of an uploaded CSV/Excel file on disk. The file is parsed
+    and converted batch by batch and fed to the engine as one load, so memory stays
+    bounded by the batch size. check_cancelled is called before every batch and may
+    raise to stop the upload. Returns {"rows": ..., "updated": ..., "inserted": ...}.
+    """
+    flush_pending(table_ref)
+    # Uploaded rows may re-create deleted keys, remove the soft-deleted rows first
+    compact_table(table_ref)
+    schema = get_table_schema(table_ref)
+
+    def batches():
+        for frame in iter_upload_frames(path, filename, settings.UPLOAD_BLOCK_SIZE_BYTES):
+            if check_cancelled is not None:
+                check_cancelled()
+            if key_column not in frame.columns:
+                raise ValueError(f"Uploaded file has no {key_column} column")
+            frame = frame.drop(columns=[VERSION_COLUMN, UPDATED_AT_COLUMN], errors="ignore")
+            yield to_arrow_table(coerce_frame(frame, schema), schema)
+
+    try:
+        return get_storage_engine().bulk_upsert_batches(table_ref, batches(), key_column, schema=schema)
+    except Exception:
+        # The cached schema may be out of date, fetch it again next time
+        schema_registry.invalidate(table_ref)
+        raise
+    finally:
+        table_cache.invalidate(table_ref)
+
+def fetch_data_from_bigquery(table_ref, read_query=None):
+    """
+    Without a read_query return every row. With one, return a page:
+    {"rows": [...], "next_cursor": "..." or None}.
+    """
+    if read_query is None:
+        return without_tombstoned(table_ref, with_pending_rows(table_ref, read_source(table_ref).fetch_rows(table_ref)))
+    flush_before_read(table_ref)
+    return read_query.finish_page(read_source(table_ref).fetch_rows(table_ref, exclude_tombstoned(table_ref, read_query)))
+
+def fetch_arrow_from_bigquery(table_ref, read_query=None):
+    """
+    Arrow counterpart of fetch_data_from_bigquery. For a paged read the next cursor
+    is stored in the schema metadata under b"next_cursor".
+    """
+    if read_query is None:
+        table = read_source(table_ref).fetch_arrow(table_ref)
+        deleted, deleted_key_column = tombstoned_keys(table_ref)
+        if deleted:
+            table = table.filter(pc.invert(pc.is_in(table.column(deleted_key_column), pa.array(list(deleted)))))
+        pending, key_column = pending_rows(table_ref)
+        if not pending:
+            return table
+        stored_keys = set(table.column(key_column).to_pylist())
+        extra = [row for row in pending if row.get(key_column) not in stored_keys]
+        if not extra:
+            return table
+        schema = get_table_schema(table_ref)
+        frame = coerce_frame(pd.DataFrame(extra).reindex(columns=table.column_names), schema)
+        return pa.concat_tables([table, to_arrow_table(frame, schema).cast(table.schema)])
+    flush_before_read(table_ref)
+    table = read_source(table_ref).fetch_arrow(table_ref, exclude_tombstoned(table_ref, read_query))
+    next_cursor = None
+    if read_query.limit is not None and table.num_rows > read_query.limit:
+        table = table.slice(0, read_query.limit)
+        next_cursor = read_query.encode_cursor(table.slice(read_query.limit - 1, 1).to_pylist()[0])
+    if read_query.columns is not None:
+        table = table.select(read_query.columns)
+    if next_cursor is not None:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"next_cursor": next_cursor.encode("ascii")})
+    return table
+
+def stream_data_from_bigquery(table_ref, read_query=None, page_size=1000):
+    """
+    Yield pages of rows as the engine delivers them. A read_query limit caps the
+    number of rows, no cursor is produced in streaming mode.
+    """
+    if read_query is None:
+        yield from stream_with_pending_rows(table_ref, page_size)
+        return
+    flush_before_read(table_ref)
+    remaining = read_query.limit
+    for page in read_source(table_ref).iter_pages(table_ref, exclude_tombstoned(table_ref, read_query), page_size):
+        page = [read_query.project_row(row) for row in page]
+        if remaining is not None:
+            page = page[:remaining]
+            remaining -= len(page)
+        if page:
+            yield page
+        if remaining == 0:
+            break
+
+def stream_with_pending_rows(table_ref, page_size):
+    pending, key_column = pending_rows(table_ref)
+    stored_keys = set()
+    for page in read_source(table_ref).iter_pages(table_ref, None, page_size):
+        if pending:
+            stored_keys.update(row.get(key_column) for row in page)
+        page = without_tombstoned(table_ref, page)
+        if page:
+            yield page
+    extra = [row for row in pending if row.get(key_column) not in stored_keys]
+    for start in range(0, len(extra), page_size):
+        yield extra[start:start + page_size]
+
+def fetch_changes_from_bigquery(table_ref, key_column, since=None):
+    """
+    Rows inserted or updated and keys deleted since the watermark `since` (an aware
+    datetime), for patching a client-side copy of the table. Returns
+    {"rows": [...], "deleted": [...], "watermark": ...}; pass the watermark back as
+    `since` next time. Without `since` only the current watermark is returned.
+    Changes shortly before `since` are sent again (see services.change_feed.feed_since),
+    applying a change twice is harmless.
+    """
+    watermark = feed_watermark()
+    if since is None:
+        return {"rows": [], "deleted": [], "watermark": watermark.isoformat()}
+    flush_before_read(table_ref)
+    since = feed_since(since)
+    rows, deleted = get_storage_engine().fetch_changes(table_ref, key_column, since)
+    rows = without_tombstoned(table_ref, rows)
+    print(f"Change feed for {table_ref.full_id}: {len(rows)} changed, {len(deleted)} deleted")
+    return {"rows": rows, "deleted": deleted, "watermark": watermark.isoformat()}
 
 def delete_data_from_bigquery(table_ref, key_column, key_value):
-    query = f"""
-        DELETE FROM `{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}`
-        WHERE {key_column} = @value
-"""
-    job_config = bigquery.QueryJobConfig(
-        query_parameters = [
-            bigquery.ScalarQueryParameter("value", "STRING", key_value)
-        ]
-    )
-    print(f"Student with id {key_column} deleted")
-    return client.query(query, job_config=job_config).result()
-
-def update_data_in_bigquery():
-    query = f"""
-
-"""
\ No newline at end of file
+    result = bulk_delete_from_bigquery(table_ref, key_column, [key_value])
+    print(f"Row with {key_column} {key_value} deleted")
+    return result
+
+def bulk_delete_from_bigquery(table_ref, key_column, key_values):
+    """
+    Delete the rows with the given keys in one statement, or with SOFT_DELETE_ENABLED
+    write their tombstones and leave the rows to the compactor.
+    Returns {"deleted": [...], "missing": [...], "streaming_buffer": [...]}.
+    """
+    flush_pending(table_ref)
+    try:
+        if settings.SOFT_DELETE_ENABLED:
+            report = soft_delete(table_ref, key_column, key_values)
+        else:
+            report = get_storage_engine().delete_many(table_ref, key_column, key_values)
+    finally:
+        table_cache.invalidate(table_ref)
+    print(f"Deleted {len(report['deleted'])} row(s) by {key_column}")
+    return report
+
+def insert_data_into_bigquery(table_ref, rows, use_load_job=False, key_column=None):
+    """
+    Append rows to the table. Returns a list of row errors (empty on success).
+    With a key_column (and INSERT_BUFFER_ENABLED) the rows are queued in the
+    insert buffer and written by a batched load job shortly after.
+    """
+    rows = [{**row, VERSION_COLUMN: 1} for row in rows]
+    if key_column is not None and settings.INSERT_BUFFER_ENABLED:
+        enqueue_rows(table_ref, key_column, rows)
+        return []
+    try:
+        return get_storage_engine().insert_rows(table_ref, rows, use_load_job=use_load_job, schema=get_table_schema(table_ref))
+    finally:
+        table_cache.invalidate(table_ref)
+
+def update_data_in_bigquery(table_ref, rows, key_column):
+    """
+    Update existing rows (list of dicts) matched on key_column with one set-based statement.
+    Returns the per-row outcomes ("updated" or "not_found").
+    """
+    return bulk_upsert(table_ref, rows, key_column)
+
+def bulk_upsert(table_ref, rows, key_column, insert_missing=False):
+    """
+    Stage the batch once and apply it with a single MERGE, returning per-row outcomes.
+    Rows are converted to the table's registered schema, which the staging load also uses.
+    """
+    flush_pending(table_ref)
+    schema = get_table_schema(table_ref)
+    df = coerce_frame(rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows), schema)
+    deleted, _ = tombstoned_keys(table_ref)
+    if deleted and insert_missing and df[key_column].isin(deleted).any():
+        # Re-creating deleted keys, remove the soft-deleted rows first
+        compact_table(table_ref)
+        deleted, _ = tombstoned_keys(table_ref)
+    # Soft-deleted rows are gone as far as writes are concerned
+    gone = df[key_column].isin(deleted)
+    not_found = [{key_column: key, "status": "not_found"} for key in dict.fromkeys(df.loc[gone, key_column])]
+    df = df[~gone]
+    if df.empty:
+        return not_found
+    try:
+        return get_storage_engine().bulk_upsert(table_ref, df, key_column, insert_missing=insert_missing, schema=schema) + not_found
+    except Exception:
+        schema_registry.invalidate(table_ref)
+        raise
+    finally:
+        table_cache.invalidate(table_ref)
+
+def apply_batch_to_bigquery(operations):
+    """
+    Apply mixed adds, updates and deletes (WriteOperation, possibly across tables)
+    as one all-or-nothing transaction. Rows are converted to each table's schema,
+    rows setting different columns become separate statements.
+    Returns the number of affected rows per operation. Raises VersionConflict when an
+    update was based on an outdated row version, nothing is written then.
+    """
+    table_refs = list(dict.fromkeys(operation.table_ref for operation in operations))
+    for table_ref in table_refs:
+        flush_pending(table_ref)
+
+    statements = []
+    owners = []
+    for index, operation in enumerate(operations):
+        if operation.op == "delete":
+            # Soft-deleted keys are already gone, deleting them again affects no row
+            deleted, _ = tombstoned_keys(operation.table_ref)
+            keys = [key for key in operation.keys or [] if key not in deleted]
+            if keys:
+                statements.append(dataclasses.replace(operation, keys=keys))
+                owners.append(index)
+            continue
+        schema = get_table_schema(operation.table_ref)
+        operation_rows = operation.rows or []
+        if operation.op == "add":
+            operation_rows = [{**row, VERSION_COLUMN: 1} for row in operation_rows]
+        else:
+            # Soft-deleted rows are not updated
+            deleted, _ = tombstoned_keys(operation.table_ref)
+            operation_rows = [row for row in operation_rows if row.get(operation.key_column) not in deleted]
+        for rows in group_rows_by_columns(operation_rows):
+            frame = coerce_frame(pd.DataFrame(rows), schema)
+            tracking_columns = (operation.key_column, VERSION_COLUMN, UPDATED_AT_COLUMN)
+            if operation.op == "update" and not [col for col in frame.columns if col not in tracking_columns]:
+                continue
+            rows = frame.astype(object).where(frame.notna(), None).to_dict("records")
+            statements.append(WriteOperation(operation.table_ref, operation.op, operation.key_column, rows=rows, schema=schema))
+            owners.append(index)
+
+    row_counts = [0] * len(operations)
+    if not statements:
+        return row_counts
+    try:
+        for owner, count in zip(owners, get_storage_engine().execute_batch(statements)):
+            row_counts[owner] += count
+    except Exception:
+        for table_ref in table_refs:
+            schema_registry.invalidate(table_ref)
+        raise
+    finally:
+        for table_ref in table_refs:
+            table_cache.invalidate(table_ref)
+    return row_counts
@@ -0,0 +1,63 @@
+import contextlib
+import datetime
+import functools
+import threading
+
+from config import settings
+
+
+class InFlightWrites:
+    """
+    Start times of the storage writes running in this process. Rows are stamped with
+    their write's start time (CURRENT_TIMESTAMP, or the load job's updated_at) but only
+    become visible when it commits, so a change feed watermark must not pass the
+    start of a write that is still running.
+    """
+
+    def __init__(self):
+        self.started = {}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def track(self):
+        token = object()
+        with self.lock:
+            self.started[token] = datetime.datetime.now(datetime.timezone.utc)
+        try:
+            yield
+        finally:
+            with self.lock:
+                del self.started[token]
+
+    def watermark(self):
+        """Now, or the start of the oldest write still running if that is earlier."""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with self.lock:
+            return min([now, *self.started.values()])
+
+
+in_flight_writes = InFlightWrites()
+
+
+def tracked_write(method):
+    """Mark an engine method as a write the change feed watermark has to wait for."""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with in_flight_writes.track():
+            return method(*args, **kwargs)
+    return wrapper
+
+
+def feed_watermark():
+    """Watermark to hand out with a snapshot or a batch of changes, taken before reading them."""
+    return in_flight_writes.watermark()
+
+
+def feed_since(watermark):
+    """
+    Where to start reading changes for a watermark. Writes of other processes are
+    not tracked here, so go back at least as far as the longest write deadline
+    (and CHANGE_FEED_OVERLAP_SECONDS for clock skew between servers).
+    """
+    overlap = max(settings.CHANGE_FEED_OVERLAP_SECONDS, settings.STORAGE_UPLOAD_DEADLINE_SECONDS)
+    return watermark - datetime.timedelta(seconds=overlap)
@@ -0,0 +1,58 @@
+import threading
+
+from services.shared_state import shared_state
+from services.storage_engine import get_storage_engine
+
+
+class IdSequence:
+    """
+    Hands out sequential IDs (S001, S002, ..., S1000) for one table.
+
+    A reservation costs one storage round trip whatever its size: the highest
+    stored number is read once and the block is handed out from memory.
+    The in-memory high-water mark keeps concurrent requests from receiving the
+    same IDs while their rows are still on their way to storage. In multi-worker
+    mode the high-water mark lives in the shared state file instead, so two
+    workers never hand out the same ID either.
+    """
+
+    def __init__(self, table_ref, key_column, prefix):
+        self.table_ref = table_ref
+        self.key_column = key_column
+        self.prefix = prefix
+        self.next_number = 1
+        self.lock = threading.Lock()
+
+    def format_id(self, number):
+        return f"{self.prefix}{number:03d}"
+
+    def reserve(self, count):
+        """Reserve `count` consecutive IDs and return them in order."""
+        if count <= 0:
+            return []
+        with self.lock:
+            stored_max = get_storage_engine().max_id_number(self.table_ref, self.key_column, self.prefix)
+            if shared_state is not None:
+                sequence_key = f"{self.table_ref.full_id}|{self.key_column}|{self.prefix}"
+                start = shared_state.reserve_numbers(sequence_key, stored_max, count)
+            else:
+                start = max(stored_max + 1, self.next_number)
+            self.next_number = start + count
+        return [self.format_id(number) for number in range(start, start + count)]
+
+
+_sequences = {}
+_sequences_lock = threading.Lock()
+
+
+def get_id_sequence(table_ref, key_column, prefix):
+    key = (table_ref.full_id, key_column, prefix)
+    with _sequences_lock:
+        if key not in _sequences:
+            _sequences[key] = IdSequence(table_ref, key_column, prefix)
+        return _sequences[key]
+
+
+def allocate_ids(table_ref, key_column, prefix, count):
+    """Reserve `count` new IDs for the table in a single storage query."""
+    return get_id_sequence(table_ref, key_column, prefix).reserve(count)
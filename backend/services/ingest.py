@@ -0,0 +1,97 @@
+import os
+import tempfile
+import threading
+
+from services.resilience import UPLOAD, StorageDeadlineExceeded, call_with_policy
+from services.bigquery_service import ingest_file_into_bigquery
+
+SPOOL_CHUNK_BYTES = 1024 * 1024
+
+
+async def spool_upload(file):
+    """Copy an UploadFile to a temporary file in fixed-size chunks and return its path."""
+    suffix = os.path.splitext(file.filename or "")[1]
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            while chunk := await file.read(SPOOL_CHUNK_BYTES):
+                spool.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+class UploadCancelled(Exception):
+    """The request gave up on an upload (its deadline passed) before the rows were loaded."""
+
+
+class SpooledUpload:
+    """
+    An uploaded file spooled to disk, shared by the request and the ingest attempts
+    on the storage pool. The file is removed when the last of them is done with it.
+    Once the request has given up, attempts stop at their next batch.
+    """
+
+    def __init__(self, path, filename):
+        self.path = path
+        self.filename = filename
+        # The request holds the first reference
+        self.users = 1
+        self.abandoned = False
+        self.lock = threading.Lock()
+
+    def check(self):
+        if self.abandoned:
+            raise UploadCancelled(f"Upload of {self.filename} was abandoned after its deadline")
+
+    def acquire(self):
+        with self.lock:
+            self.check()
+            self.users += 1
+
+    def release(self, abandon=False):
+        with self.lock:
+            self.abandoned = self.abandoned or abandon
+            self.users -= 1
+            last = self.users == 0
+        if last:
+            os.remove(self.path)
+
+
+def ingest_attempt(upload, table_ref, key_column):
+    """One try at loading a spooled upload, reporting the outcome if the request has given up."""
+    upload.acquire()
+    try:
+        summary = ingest_file_into_bigquery(upload.path, upload.filename, table_ref, key_column, check_cancelled=upload.check)
+    except UploadCancelled:
+        print(f"Stopped the upload of {upload.filename} into {table_ref.full_id}: its deadline passed")
+        raise
+    except Exception as e:
+        if upload.abandoned:
+            print(f"Upload of {upload.filename} into {table_ref.full_id} failed after its deadline: {e}")
+        raise
+    finally:
+        upload.release()
+    if upload.abandoned:
+        # The load job was already running when the deadline passed
+        print(f"Upload of {upload.filename} into {table_ref.full_id} finished after its deadline: {summary}")
+    return summary
+
+
+async def ingest_upload(file, table_ref, key_column):
+    """
+    Spool an uploaded CSV/Excel file to disk and stream it into the table.
+    Past the upload deadline StorageDeadlineExceeded is raised; the ingest stops
+    at its next batch or, when its load job is already running, finishes and logs
+    the outcome.
+    """
+    upload = SpooledUpload(await spool_upload(file), file.filename)
+    abandoned = False
+    try:
+        return await call_with_policy(UPLOAD, table_ref, ingest_attempt, upload, table_ref, key_column)
+    except StorageDeadlineExceeded:
+        abandoned = True
+        raise
+    finally:
+        upload.release(abandon=abandoned)
@@ -0,0 +1,204 @@
+import threading
+import time
+from collections import deque
+
+from config import settings
+from services.schema_registry import get_table_schema
+from services.storage_engine import get_storage_engine
+from services.table_cache import table_cache
+
+# Most recent refused rows kept per table for the health report, all of them
+# are stored in the table's quarantine table
+QUARANTINE_SIZE = 100
+
+
+class InsertBuffer:
+    """
+    Write-behind queue of new rows for one table.
+
+    Adds from every request are collected here and written with one load job
+    when the buffer reaches INSERT_BUFFER_MAX_ROWS or its oldest row is
+    INSERT_BUFFER_FLUSH_SECONDS old. Load jobs skip BigQuery's streaming buffer,
+    so the rows can be updated or deleted as soon as they are flushed.
+    Until then reads serve the pending rows back (see services.bigquery_service).
+    """
+
+    def __init__(self, table_ref, key_column):
+        self.table_ref = table_ref
+        self.key_column = key_column
+        self.rows = []
+        self.first_added_at = None
+        self.lock = threading.Lock()
+        # Only one load job per table at a time, so no row is written twice
+        self.flush_lock = threading.Lock()
+        # Rows the table refused, most recent last
+        self.quarantined = deque(maxlen=QUARANTINE_SIZE)
+        self.quarantined_count = 0
+
+    def add(self, rows):
+        with self.lock:
+            if not self.rows:
+                self.first_added_at = time.monotonic()
+            self.rows.extend(rows)
+            return len(self.rows)
+
+    def pending(self):
+        with self.lock:
+            return list(self.rows)
+
+    def is_due(self, now):
+        with self.lock:
+            if not self.rows:
+                return False
+            return (len(self.rows) >= settings.INSERT_BUFFER_MAX_ROWS
+                    or now - self.first_added_at >= settings.INSERT_BUFFER_FLUSH_SECONDS)
+
+    def flush(self):
+        """
+        Write the pending rows with one load job. Returns the number of rows written.
+        Rows the table refuses are quarantined (moved to its quarantine table) so they
+        don't block every later write to the table. Failures of the load as a whole
+        raise and leave the rows queued for the next flush.
+        """
+        with self.flush_lock:
+            rows = self.pending()
+            if not rows:
+                return 0
+            done = []
+            try:
+                written = self.write(rows, done)
+            finally:
+                with self.lock:
+                    # Rows added during the load stay queued for the next flush
+                    done_ids = {id(row) for row in done}
+                    self.rows = [row for row in self.rows if id(row) not in done_ids]
+                    self.first_added_at = time.monotonic() if self.rows else None
+                if done:
+                    table_cache.invalidate(self.table_ref)
+            print(f"Flushed {written} row(s) into {self.table_ref.full_id}")
+            return written
+
+    def write(self, rows, done):
+        """
+        Load rows. Rows the engine reports as refused are quarantined and the others
+        loaded again; an error raised for the whole load leaves every row queued.
+        Appends every written or quarantined row to done, returns the number written.
+        """
+        engine = get_storage_engine()
+        schema = get_table_schema(self.table_ref)
+        while rows:
+            errors = engine.insert_rows(self.table_ref, rows, use_load_job=True, schema=schema)
+            if not errors:
+                done.extend(rows)
+                return len(rows)
+            refused = {error["index"]: error["errors"] for error in errors if "index" in error}
+            if not refused:
+                raise RuntimeError(f"Load into {self.table_ref.full_id} failed: {errors}")
+            self.quarantine([{"row": rows[index], "errors": row_errors} for index, row_errors in refused.items()])
+            done.extend(rows[index] for index in refused)
+            rows = [row for index, row in enumerate(rows) if index not in refused]
+        return 0
+
+    def quarantine(self, entries):
+        # Stored before they leave the queue, if this fails they stay queued
+        get_storage_engine().record_quarantined(self.table_ref, entries)
+        for entry in entries:
+            print(f"Quarantined a row refused by {self.table_ref.full_id}: {entry['errors']}")
+        with self.lock:
+            self.quarantined.extend(entries)
+            self.quarantined_count += len(entries)
+
+_buffers = {}
+_buffers_lock = threading.Lock()
+_flush_requested = threading.Event()
+_flusher = None
+
+
+def get_insert_buffer(table_ref, key_column=None):
+    with _buffers_lock:
+        if table_ref.full_id not in _buffers:
+            if key_column is None:
+                return None
+            _buffers[table_ref.full_id] = InsertBuffer(table_ref, key_column)
+        return _buffers[table_ref.full_id]
+
+
+def flush_due_buffers():
+    now = time.monotonic()
+    with _buffers_lock:
+        buffers = list(_buffers.values())
+    for buffer in buffers:
+        if buffer.is_due(now):
+            try:
+                buffer.flush()
+            except Exception as e:
+                # The rows stay queued and the next tick retries them
+                print(f"Insert buffer flush failed: {e}")
+
+
+def run_flusher():
+    while True:
+        _flush_requested.wait(settings.INSERT_BUFFER_FLUSH_SECONDS / 2)
+        _flush_requested.clear()
+        flush_due_buffers()
+
+
+def start_flusher():
+    global _flusher
+    with _buffers_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=run_flusher, name="insert-buffer-flusher", daemon=True)
+            _flusher.start()
+
+
+def enqueue_rows(table_ref, key_column, rows):
+    """Queue rows for the table's next load job."""
+    start_flusher()
+    size = get_insert_buffer(table_ref, key_column).add(rows)
+    table_cache.invalidate(table_ref)
+    if size >= settings.INSERT_BUFFER_MAX_ROWS:
+        _flush_requested.set()
+
+
+def pending_rows(table_ref):
+    """Rows added to the table that are not written yet, with the table's key column."""
+    buffer = get_insert_buffer(table_ref)
+    if buffer is None:
+        return [], None
+    return buffer.pending(), buffer.key_column
+
+
+def flush_pending(table_ref):
+    """Write the table's queued rows now, e.g. before a statement that must see them."""
+    buffer = get_insert_buffer(table_ref)
+    if buffer is not None:
+        buffer.flush()
+
+
+def flush_all():
+    with _buffers_lock:
+        buffers = list(_buffers.values())
+    for buffer in buffers:
+        try:
+            buffer.flush()
+        except Exception as e:
+            print(f"Insert buffer flush failed: {e}")
+
+
+def has_pending_rows(table_ref):
+    buffer = get_insert_buffer(table_ref)
+    return buffer is not None and bool(buffer.pending())
+
+
+# Reads that include queued rows must not be shared with other workers
+table_cache.has_pending_rows = has_pending_rows
+
+
+def quarantine_stats():
+    """Rows the add endpoints accepted but the table refused, per table: the count and the most recent ones."""
+    with _buffers_lock:
+        buffers = list(_buffers.values())
+    return {
+        buffer.table_ref.full_id: {"count": buffer.quarantined_count, "recent": list(buffer.quarantined)}
+        for buffer in buffers if buffer.quarantined_count
+    }
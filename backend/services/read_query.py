@@ -0,0 +1,191 @@
+import base64
+import hashlib
+import json
+from dataclasses import dataclass, field
+
+from fastapi import HTTPException
+from pydantic import TypeAdapter, ValidationError
+
+MAX_PAGE_SIZE = 5000
+
+# Query parameters that are not column filters
+RESERVED_PARAMS = {"limit", "cursor", "columns", "order_by", "descending"}
+
+
+@dataclass
+class ReadQuery:
+    """
+    Projection, filters, ordering and keyset pagination for a table read.
+    filters is a list of (column, operator, value) with operator in "=", ">=", "<=".
+    """
+    key_column: str
+    columns: list = None
+    filters: list = field(default_factory=list)
+    order_by: str = None
+    descending: bool = False
+    limit: int = None
+    after: list = None  # [order value, key value] of the last row of the previous page
+    exclude_tombstoned: bool = False  # drop soft-deleted rows, set by services.bigquery_service
+
+    @property
+    def sort_column(self):
+        return self.order_by or self.key_column
+
+    def select_columns(self):
+        """Requested columns plus the ones the cursor needs."""
+        if self.columns is None:
+            return None
+        needed = [self.key_column, self.sort_column]
+        return self.columns + [col for col in dict.fromkeys(needed) if col not in self.columns]
+
+    def fingerprint(self):
+        shape = [self.order_by, self.descending, [[col, op, str(value)] for col, op, value in self.filters]]
+        return hashlib.sha1(json.dumps(shape).encode("utf-8")).hexdigest()[:12]
+
+    def cache_key(self):
+        return json.dumps(
+            [self.columns, self.fingerprint(), self.limit, self.after], default=str
+        )
+
+    def encode_cursor(self, last_row):
+        after = [last_row.get(self.sort_column), last_row.get(self.key_column)]
+        payload = json.dumps({"q": self.fingerprint(), "after": after}, default=str)
+        return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+    def project_row(self, row):
+        """Drop the helper columns added by select_columns."""
+        if self.columns is None:
+            return row
+        return {col: row.get(col) for col in self.columns}
+
+    def finish_page(self, rows):
+        """Trim the look-ahead row, build the next cursor and drop helper columns."""
+        next_cursor = None
+        if self.limit is not None and len(rows) > self.limit:
+            rows = rows[:self.limit]
+            next_cursor = self.encode_cursor(rows[-1])
+        rows = [self.project_row(row) for row in rows]
+        return {"rows": rows, "next_cursor": next_cursor}
+
+
+def build_where_clause(read_query, placeholder, tombstoned=None):
+    """
+    Build the WHERE clause shared by the engines.
+    placeholder(value) registers a bound parameter and returns its SQL marker.
+    tombstoned is the engine's condition for a soft-deleted row, used when the
+    query excludes them.
+    """
+    conditions = []
+    for column, operator, value in read_query.filters:
+        conditions.append(f"{column} {operator} {placeholder(value)}")
+
+    if read_query.exclude_tombstoned:
+        conditions.append(f"NOT {tombstoned}")
+
+    if read_query.after is not None:
+        sort_column = read_query.sort_column
+        key_column = read_query.key_column
+        last_value, last_key = read_query.after
+        comparison = "<" if read_query.descending else ">"
+        # NULLs sort first ascending and last descending, the key breaks ties ascending
+        if sort_column == key_column:
+            condition = f"{key_column} {comparison} {placeholder(last_key)}"
+        elif last_value is None:
+            condition = f"({sort_column} IS NULL AND {key_column} > {placeholder(last_key)})"
+            if not read_query.descending:
+                condition = f"({condition} OR {sort_column} IS NOT NULL)"
+        else:
+            condition = (
+                f"({sort_column} {comparison} {placeholder(last_value)} "
+                f"OR ({sort_column} = {placeholder(last_value)} AND {key_column} > {placeholder(last_key)})"
+            )
+            if read_query.descending:
+                condition += f" OR {sort_column} IS NULL"
+            condition += ")"
+        conditions.append(condition)
+
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+
+def build_order_clause(read_query):
+    direction = "DESC" if read_query.descending else "ASC"
+    if read_query.sort_column == read_query.key_column:
+        return f"ORDER BY {read_query.key_column} {direction}"
+    return f"ORDER BY {read_query.sort_column} {direction}, {read_query.key_column} ASC"
+
+
+def decode_cursor(cursor):
+    """Return the payload of a cursor made by encode_cursor, 400 for anything else."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeError):
+        payload = None
+    # Valid base64 JSON is not enough: {"q": fingerprint, "after": [sort value, key]}
+    if (not isinstance(payload, dict) or not isinstance(payload.get("q"), str)
+            or not isinstance(payload.get("after"), list) or len(payload["after"]) != 2):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return payload
+
+
+def parse_read_query(request, model, key_column):
+    """
+    Build a ReadQuery from the request's query string, or None for a plain full-table read.
+    The entity's Pydantic model lists the valid columns and converts filter values to their types.
+
+    Supported parameters: limit, cursor, columns=a,b, order_by, descending=true,
+    <column>=value for equality and <column>_from / <column>_to for ranges.
+    """
+    params = request.query_params
+    if not params:
+        return None
+
+    fields = model.model_fields
+
+    def check_column(column):
+        if column not in fields:
+            raise HTTPException(status_code=400, detail=f"Unknown column: {column}")
+        return column
+
+    def convert(column, value):
+        try:
+            return TypeAdapter(fields[column].annotation).validate_python(value)
+        except ValidationError:
+            raise HTTPException(status_code=400, detail=f"Invalid value for {column}: {value}")
+
+    read_query = ReadQuery(key_column=key_column)
+
+    if "columns" in params:
+        read_query.columns = [check_column(col.strip()) for col in params["columns"].split(",") if col.strip()]
+    if "order_by" in params:
+        read_query.order_by = check_column(params["order_by"])
+    read_query.descending = params.get("descending", "false").lower() == "true"
+    if "limit" in params:
+        try:
+            read_query.limit = int(params["limit"])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="limit must be an integer")
+        if not 1 <= read_query.limit <= MAX_PAGE_SIZE:
+            raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    for name, value in params.items():
+        if name in RESERVED_PARAMS:
+            continue
+        if name.endswith("_from") and name[:-5] in fields:
+            read_query.filters.append((name[:-5], ">=", convert(name[:-5], value)))
+        elif name.endswith("_to") and name[:-3] in fields:
+            read_query.filters.append((name[:-3], "<=", convert(name[:-3], value)))
+        else:
+            read_query.filters.append((check_column(name), "=", convert(name, value)))
+
+    if "cursor" in params:
+        if read_query.limit is None:
+            raise HTTPException(status_code=400, detail="cursor requires limit")
+        payload = decode_cursor(params["cursor"])
+        if payload.get("q") != read_query.fingerprint():
+            raise HTTPException(status_code=400, detail="Cursor does not match the filters or ordering")
+        last_value, last_key = payload["after"]
+        if last_value is not None:
+            last_value = convert(read_query.sort_column, last_value)
+        read_query.after = [last_value, last_key]
+
+    return read_query
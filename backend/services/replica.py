@@ -0,0 +1,223 @@
+import functools
+import operator
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from config import settings
+from services.change_feed import feed_since, feed_watermark
+from services.schema_coercion import coerce_frame, to_arrow_table
+from services.schema_registry import get_table_schema
+from services.storage_engine import get_storage_engine
+from services.table_cache import table_cache
+from services.tombstones import tombstoned_keys
+
+
+def parse_replica_tables(value):
+    """Parse "student=student_id,class=class_id" into {"student": "student_id", "class": "class_id"}."""
+    tables = {}
+    for item in value.split(","):
+        if "=" in item:
+            table_id, key_column = item.split("=", 1)
+            tables[table_id.strip()] = key_column.strip()
+    return tables
+
+
+replica_tables = parse_replica_tables(settings.LOCAL_REPLICA_TABLES)
+
+
+def literal(table, column, value):
+    """A filter value typed like its column, e.g. "2010-05-01" against a DATE column."""
+    try:
+        return pa.scalar(value).cast(table.schema.field(column).type)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+        return pa.scalar(value)
+
+
+def query_arrow(table, read_query):
+    """
+    Apply a ReadQuery to an Arrow table the way the engines' SELECT does: filters,
+    cursor, ordering (NULLs first ascending, last descending),
+    one look-ahead row past the limit and the projection.
+    """
+    key_column = read_query.key_column
+    sort_column = read_query.sort_column
+    conditions = []
+    for column, op, value in read_query.filters:
+        field = pc.field(column)
+        value = literal(table, column, value)
+        conditions.append(field == value if op == "=" else field >= value if op == ">=" else field <= value)
+
+    if read_query.after is not None:
+        last_value, last_key = read_query.after
+        key, sort = pc.field(key_column), pc.field(sort_column)
+        after_key = key < last_key if read_query.descending and sort_column == key_column else key > last_key
+        if sort_column == key_column:
+            condition = after_key
+        elif last_value is None:
+            condition = sort.is_null() & after_key
+            if not read_query.descending:
+                condition = condition | ~sort.is_null()
+        else:
+            last_value = literal(table, sort_column, last_value)
+            beyond = sort < last_value if read_query.descending else sort > last_value
+            condition = beyond | ((sort == last_value) & after_key)
+            if read_query.descending:
+                condition = condition | sort.is_null()
+        conditions.append(condition)
+
+    if conditions:
+        table = table.filter(functools.reduce(operator.and_, conditions))
+
+    direction = "descending" if read_query.descending else "ascending"
+    sort_keys = [(sort_column, direction)]
+    if sort_column != key_column:
+        sort_keys.append((key_column, "ascending"))
+    indices = pc.sort_indices(table, sort_keys=sort_keys, null_placement="at_end" if read_query.descending else "at_start")
+    table = table.take(indices)
+
+    if read_query.limit is not None:
+        table = table.slice(0, read_query.limit + 1)
+    select_columns = read_query.select_columns()
+    if select_columns:
+        table = table.select(select_columns)
+    return table
+
+
+class TableReplica:
+    """
+    In-memory Arrow copy of one table, answering reads like a storage engine
+    (fetch_rows, fetch_arrow, iter_pages) without a warehouse round trip.
+
+    The copy is loaded in full once, then patched from the change feed: before
+    a read when a write through this process has bumped the table's cache
+    version, and every LOCAL_REPLICA_REFRESH_SECONDS for changes made elsewhere.
+    Soft-deleted keys are dropped from the copy, the service layer filters them anyway.
+    """
+
+    def __init__(self, table_ref, key_column):
+        self.table_ref = table_ref
+        self.key_column = key_column
+        self.table = None
+        self.watermark = None
+        self.synced_version = None
+        self.synced_at = None
+        self.lock = threading.Lock()
+
+    def is_current(self):
+        return self.table is not None and self.synced_version == table_cache.version(self.table_ref)
+
+    def sync(self, force=False):
+        """Load or patch the copy unless it already reflects every write made through this process."""
+        if not force and self.is_current():
+            return self.table
+        with self.lock:
+            # Someone else may have synced while we waited for the lock
+            if not force and self.is_current():
+                return self.table
+            version = table_cache.version(self.table_ref)
+            watermark = feed_watermark()
+            engine = get_storage_engine()
+            if self.table is None:
+                table = engine.fetch_arrow(self.table_ref)
+            else:
+                since = feed_since(self.watermark)
+                rows, deleted = engine.fetch_changes(self.table_ref, self.key_column, since)
+                table = self.patch(self.table, rows, deleted)
+            self.table = self.without_tombstoned(table)
+            self.watermark = watermark
+            self.synced_version = version
+            self.synced_at = time.monotonic()
+            return self.table
+
+    def patch(self, table, rows, deleted):
+        """Replace the changed rows and drop the deleted keys (a key both changed and deleted was re-created)."""
+        keys = [row[self.key_column] for row in rows] + list(deleted)
+        if not keys:
+            return table
+        table = table.filter(~pc.field(self.key_column).isin(keys))
+        if not rows:
+            return table
+        schema = get_table_schema(self.table_ref)
+        frame = coerce_frame(pd.DataFrame(rows).reindex(columns=table.column_names), schema)
+        return pa.concat_tables([table, to_arrow_table(frame, schema).cast(table.schema)])
+
+    def without_tombstoned(self, table):
+        deleted, key_column = tombstoned_keys(self.table_ref)
+        if not deleted:
+            return table
+        return table.filter(~pc.field(key_column).isin(list(deleted)))
+
+    def fetch_arrow(self, table_ref, read_query=None):
+        table = self.sync()
+        if read_query is None:
+            return table
+        if read_query.exclude_tombstoned:
+            # Keys soft deleted since the last sync, the copy is in memory so the set filters it
+            table = self.without_tombstoned(table)
+        return query_arrow(table, read_query)
+
+    def fetch_rows(self, table_ref, read_query=None):
+        return self.fetch_arrow(table_ref, read_query).to_pylist()
+
+    def iter_pages(self, table_ref, read_query=None, page_size=1000):
+        table = self.fetch_arrow(table_ref, read_query)
+        for start in range(0, table.num_rows, page_size):
+            yield table.slice(start, page_size).to_pylist()
+
+    def stats(self):
+        table = self.table
+        return {
+            "rows": table.num_rows if table is not None else None,
+            "bytes": table.nbytes if table is not None else None,
+            "synced_seconds_ago": round(time.monotonic() - self.synced_at, 1) if self.synced_at else None,
+        }
+
+
+_replicas = {}
+_replicas_lock = threading.Lock()
+_refresher = None
+
+
+def get_replica(table_ref):
+    """The table's replica if LOCAL_REPLICA_TABLES lists it, else None."""
+    key_column = replica_tables.get(table_ref.table_id)
+    if key_column is None:
+        return None
+    with _replicas_lock:
+        if table_ref.full_id not in _replicas:
+            _replicas[table_ref.full_id] = TableReplica(table_ref, key_column)
+            start_refresher()
+        return _replicas[table_ref.full_id]
+
+
+def refresh_all():
+    with _replicas_lock:
+        replicas = list(_replicas.values())
+    for replica in replicas:
+        try:
+            replica.sync(force=True)
+        except Exception as e:
+            # Reads keep the current copy, the next run tries again
+            print(f"Replica refresh of {replica.table_ref.full_id} failed: {e}")
+
+
+def run_refresher():
+    while True:
+        time.sleep(settings.LOCAL_REPLICA_REFRESH_SECONDS)
+        refresh_all()
+
+
+def start_refresher():
+    global _refresher
+    if _refresher is None:
+        _refresher = threading.Thread(target=run_refresher, name="replica-refresher", daemon=True)
+        _refresher.start()
+
+
+def replica_stats():
+    with _replicas_lock:
+        return {full_id: replica.stats() for full_id, replica in _replicas.items()}
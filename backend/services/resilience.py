@@ -0,0 +1,191 @@
+import asyncio
+import math
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, stop_before_delay, wait_random_exponential
+
+from config import settings
+from services.async_storage import run_storage_call
+
+# HTTP statuses and BigQuery error reasons worth another attempt
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+TRANSIENT_REASONS = {"backendError", "internalError", "rateLimitExceeded", "jobBackendError", "jobInternalError"}
+
+
+class StorageDeadlineExceeded(TimeoutError):
+    """A storage call (with its retries) took longer than its endpoint's deadline."""
+
+    def __init__(self, table_ref, deadline_seconds):
+        super().__init__(f"Storage call on {table_ref.full_id} did not finish within {deadline_seconds:g}s")
+        self.table_ref = table_ref
+        self.deadline_seconds = deadline_seconds
+
+
+@dataclass(frozen=True)
+class CallPolicy:
+    """
+    How one kind of storage call is run: its overall deadline, whether it is
+    safe to retry (idempotent) and whether a slow attempt gets a hedged duplicate.
+    """
+    name: str
+    deadline_seconds: float
+    retry: bool = True
+    hedge: bool = False
+
+
+READ = CallPolicy("read", settings.STORAGE_READ_DEADLINE_SECONDS, hedge=settings.STORAGE_HEDGED_READS_ENABLED)
+ID_LOOKUP = CallPolicy("id_lookup", settings.STORAGE_ID_LOOKUP_DEADLINE_SECONDS)
+# Uploads are MERGEs, running one again leaves the same rows behind
+UPLOAD = CallPolicy("upload", settings.STORAGE_UPLOAD_DEADLINE_SECONDS)
+
+
+def is_transient(error):
+    """
+    Whether a failed storage call may succeed when tried again.
+    Errors are told apart by module and attributes, so checking them doesn't
+    import requests or google-cloud up front.
+    """
+    if isinstance(error, StorageDeadlineExceeded):
+        return False
+    if isinstance(error, sqlite3.OperationalError):
+        return "locked" in str(error) or "busy" in str(error)
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    module = type(error).__module__
+    if module.startswith(("requests.", "urllib3.")) and isinstance(error, OSError):
+        # Dropped connections and socket timeouts below the BigQuery client
+        return True
+    if module.startswith("google.auth") and type(error).__name__ == "TransportError":
+        return True
+    if module.startswith("google."):
+        # google.api_core.exceptions carry the HTTP status and BigQuery's error reasons
+        if getattr(error, "code", None) in TRANSIENT_STATUS_CODES:
+            return True
+        reasons = {item.get("reason") for item in getattr(error, "errors", None) or [] if isinstance(item, dict)}
+        return bool(reasons & TRANSIENT_REASONS)
+    return False
+
+
+class LatencyTracker:
+    """Recent durations of one kind of call, to know when an attempt is slower than usual."""
+
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, percent):
+        """The given percentile of the recent durations, None until there are enough of them."""
+        with self.lock:
+            samples = sorted(self.samples)
+        if len(samples) < settings.STORAGE_HEDGE_MIN_SAMPLES:
+            return None
+        index = max(math.ceil(percent / 100 * len(samples)) - 1, 0)
+        return samples[index]
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+# Counters for the health report
+stats = {"retries": 0, "hedges": 0, "hedge_wins": 0, "deadlines_exceeded": 0}
+
+
+def get_latency_tracker(table_ref, func):
+    key = (table_ref.full_id, getattr(func, "__name__", repr(func)))
+    with _trackers_lock:
+        if key not in _trackers:
+            _trackers[key] = LatencyTracker(settings.STORAGE_LATENCY_WINDOW)
+        return _trackers[key]
+
+
+def resilience_stats():
+    return {**stats, "tracked_calls": len(_trackers)}
+
+
+async def timed_call(tracker, table_ref, func, args, kwargs):
+    start = time.monotonic()
+    result = await run_storage_call(table_ref, func, *args, **kwargs)
+    tracker.record(time.monotonic() - start)
+    return result
+
+
+async def hedged_call(table_ref, func, args, kwargs):
+    """
+    Run a read, and run it a second time if it is still going after the
+    STORAGE_HEDGE_PERCENTILE latency of its recent calls. The first answer wins;
+    the other call can't be cancelled once on a worker, its result is dropped.
+    """
+    tracker = get_latency_tracker(table_ref, func)
+    hedge_after = tracker.percentile(settings.STORAGE_HEDGE_PERCENTILE)
+    first = asyncio.ensure_future(timed_call(tracker, table_ref, func, args, kwargs))
+    if hedge_after is None:
+        return await first
+    done, _ = await asyncio.wait({first}, timeout=hedge_after)
+    if done:
+        return first.result()
+
+    stats["hedges"] += 1
+    second = asyncio.ensure_future(timed_call(tracker, table_ref, func, args, kwargs))
+    pending = {first, second}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        stats["hedge_wins"] += 1
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in pending:
+            # Leave the loser running, but don't log its outcome as never retrieved
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+
+async def call_with_policy(policy, table_ref, func, *args, **kwargs):
+    """
+    Await a blocking storage call like run_storage_call, under the policy's deadline.
+    Transient failures are retried with jittered exponential backoff while the
+    deadline allows; a call past its deadline raises StorageDeadlineExceeded.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + policy.deadline_seconds
+    retrying = AsyncRetrying(
+        stop=stop_after_attempt(settings.STORAGE_RETRY_ATTEMPTS if policy.retry else 1) | stop_before_delay(policy.deadline_seconds),
+        wait=wait_random_exponential(multiplier=settings.STORAGE_RETRY_BASE_SECONDS, max=settings.STORAGE_RETRY_MAX_WAIT_SECONDS),
+        retry=retry_if_exception(is_transient),
+        before_sleep=lambda state: log_retry(policy, table_ref, state),
+        reraise=True,
+    )
+    async for attempt in retrying:
+        with attempt:
+            try:
+                if policy.hedge:
+                    call = hedged_call(table_ref, func, args, kwargs)
+                else:
+                    call = run_storage_call(table_ref, func, *args, **kwargs)
+                result = await asyncio.wait_for(call, timeout=max(deadline - loop.time(), 0))
+            except TimeoutError:
+                if loop.time() < deadline:
+                    # Raised by the call itself (e.g. a socket timeout), not by the deadline
+                    raise
+                stats["deadlines_exceeded"] += 1
+                raise StorageDeadlineExceeded(table_ref, policy.deadline_seconds)
+    return result
+
+
+def log_retry(policy, table_ref, state):
+    stats["retries"] += 1
+    print(
+        f"Retrying {policy.name} on {table_ref.full_id} in {state.upcoming_sleep:.2f}s "
+        f"(attempt {state.attempt_number} failed: {state.outcome.exception()})"
+    )
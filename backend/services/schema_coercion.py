@@ -0,0 +1,93 @@
+from decimal import Decimal
+
+import pandas as pd
+import pyarrow as pa
+
+# Canonical column types (BigQuery standard SQL names) shared by the engines
+TYPE_ALIASES = {
+    "TEXT": "STRING",
+    "VARCHAR": "STRING",
+    "REAL": "FLOAT64",
+    "FLOAT": "FLOAT64",
+    "DOUBLE": "FLOAT64",
+    "INTEGER": "INT64",
+    "INT": "INT64",
+    "BOOLEAN": "BOOL",
+    "BIGNUMERIC": "NUMERIC",
+}
+
+ARROW_TYPES = {
+    "STRING": pa.string(),
+    "DATE": pa.date32(),
+    "DATETIME": pa.timestamp("us"),
+    "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+    "INT64": pa.int64(),
+    "FLOAT64": pa.float64(),
+    "NUMERIC": pa.decimal128(38, 9),
+    "BOOL": pa.bool_(),
+}
+
+
+def normalize_type(type_name):
+    type_name = (type_name or "STRING").upper()
+    return TYPE_ALIASES.get(type_name, type_name)
+
+
+def to_string(value):
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return None
+    # Spreadsheets hand phone numbers and grades back as floats (5551234.0)
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def to_bool(value):
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return None
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes", "y")
+    return bool(value)
+
+
+def coerce_column(series, column_type):
+    """Convert a column to the given schema type, unparseable values become null."""
+    if column_type == "DATE":
+        return pd.to_datetime(series, errors="coerce").dt.date
+    if column_type == "DATETIME":
+        return pd.to_datetime(series, errors="coerce")
+    if column_type == "TIMESTAMP":
+        return pd.to_datetime(series, errors="coerce", utc=True)
+    if column_type == "INT64":
+        return pd.to_numeric(series, errors="coerce").astype("Int64")
+    if column_type == "FLOAT64":
+        return pd.to_numeric(series, errors="coerce").astype("float64")
+    if column_type == "NUMERIC":
+        numbers = pd.to_numeric(series, errors="coerce")
+        return numbers.map(lambda value: None if pd.isna(value) else Decimal(str(value)))
+    if column_type == "BOOL":
+        return series.map(to_bool).astype("boolean")
+    return series.map(to_string).astype(object)
+
+
+def coerce_frame(df, schema):
+    """
+    Keep the columns of df that exist in the table and convert them to the table's types.
+    schema is a list of (column name, canonical type).
+    """
+    column_types = dict(schema)
+    df = df[[col for col in df.columns if col in column_types]].copy()
+    for col in df.columns:
+        df[col] = coerce_column(df[col], column_types[col])
+    return df
+
+
+def arrow_schema(schema, columns=None):
+    column_types = dict(schema)
+    columns = columns if columns is not None else list(column_types)
+    return pa.schema([pa.field(col, ARROW_TYPES.get(column_types[col], pa.string())) for col in columns])
+
+
+def to_arrow_table(df, schema):
+    """Build a pyarrow.Table with the table's explicit types (no inference per batch)."""
+    return pa.Table.from_pandas(df, schema=arrow_schema(schema, list(df.columns)), preserve_index=False)
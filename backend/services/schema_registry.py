@@ -0,0 +1,43 @@
+import threading
+import time
+
+from config import settings
+from services.storage_engine import get_storage_engine
+
+
+class SchemaRegistry:
+    """
+    In-process cache of table schemas ([(column name, canonical type)]).
+    Uploads and bulk writes use it to type their data and to give load jobs an
+    explicit schema, instead of a metadata round trip and autodetection each time.
+    """
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, table_ref):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(table_ref.full_id)
+        if entry is not None and now - entry[1] < self.ttl_seconds:
+            return entry[0]
+        schema = get_storage_engine().get_schema(table_ref)
+        with self.lock:
+            self.entries[table_ref.full_id] = (schema, now)
+        return schema
+
+    def invalidate(self, table_ref=None):
+        with self.lock:
+            if table_ref is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(table_ref.full_id, None)
+
+
+schema_registry = SchemaRegistry(settings.SCHEMA_CACHE_TTL_SECONDS)
+
+
+def get_table_schema(table_ref):
+    return schema_registry.get(table_ref)
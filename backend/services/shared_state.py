@@ -0,0 +1,134 @@
+import os
+import sqlite3
+import threading
+
+from config import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS table_versions (table_id TEXT PRIMARY KEY, version INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS cache_entries (
+    table_id TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    etag TEXT NOT NULL,
+    body BLOB NOT NULL,
+    fetched_at REAL NOT NULL,
+    watermark TEXT,
+    PRIMARY KEY (table_id, variant)
+);
+CREATE TABLE IF NOT EXISTS tombstone_versions (table_id TEXT PRIMARY KEY, version INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS id_sequences (sequence_key TEXT PRIMARY KEY, next_number INTEGER NOT NULL);
+"""
+
+
+class SharedState:
+    """
+    State shared by the worker processes of one host, kept in a local SQLite file
+    (MULTI_WORKER_STATE_PATH): the version of every table, serialized table reads,
+    the version of every table's soft-deleted keys and the ID high-water marks.
+
+    A write in any worker bumps the table's version here, and every worker
+    checks the version on each read. That check is the invalidation broadcast:
+    no worker serves a read cached before another worker's write.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # sqlite3 connections stay on the thread that opened them
+        self.local = threading.local()
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            # Files written before cache entries had a watermark get the column now
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(cache_entries)")}
+            if "watermark" not in columns:
+                try:
+                    connection.execute("ALTER TABLE cache_entries ADD COLUMN watermark TEXT")
+                except sqlite3.OperationalError:
+                    # Added by another worker in the meantime
+                    pass
+            self.local.connection = connection
+        return connection
+
+    def version(self, table_id):
+        row = self.connection().execute("SELECT version FROM table_versions WHERE table_id = ?", (table_id,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, table_id):
+        """Move the table to a new version and drop its cached reads, in every worker."""
+        connection = self.connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            version = connection.execute(
+                "INSERT INTO table_versions (table_id, version) VALUES (?, 1) "
+                "ON CONFLICT (table_id) DO UPDATE SET version = version + 1 RETURNING version",
+                (table_id,),
+            ).fetchone()[0]
+            connection.execute("DELETE FROM cache_entries WHERE table_id = ?", (table_id,))
+        return version
+
+    def tombstone_version(self, table_id):
+        row = self.connection().execute("SELECT version FROM tombstone_versions WHERE table_id = ?", (table_id,)).fetchone()
+        return row[0] if row else 0
+
+    def bump_tombstones(self, table_id):
+        """Tell every worker the table's soft-deleted keys changed (a delete or a compaction)."""
+        return self.connection().execute(
+            "INSERT INTO tombstone_versions (table_id, version) VALUES (?, 1) "
+            "ON CONFLICT (table_id) DO UPDATE SET version = version + 1 RETURNING version",
+            (table_id,),
+        ).fetchone()[0]
+
+    def get_entry(self, table_id, variant, version):
+        """(body, etag, fetched_at, watermark) of a read cached at this version, or None."""
+        return self.connection().execute(
+            "SELECT body, etag, fetched_at, watermark FROM cache_entries WHERE table_id = ? AND variant = ? AND version = ?",
+            (table_id, variant, version),
+        ).fetchone()
+
+    def put_entry(self, table_id, variant, version, etag, body, fetched_at, watermark):
+        """Store a read, unless the table has moved past the version it was read at."""
+        connection = self.connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            current = connection.execute("SELECT version FROM table_versions WHERE table_id = ?", (table_id,)).fetchone()
+            if (current[0] if current else 0) == version:
+                connection.execute(
+                    "INSERT OR REPLACE INTO cache_entries (table_id, variant, version, etag, body, fetched_at, watermark) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (table_id, variant, version, etag, body, fetched_at, watermark),
+                )
+
+    def reserve_numbers(self, sequence_key, stored_max, count):
+        """
+        Reserve `count` consecutive numbers above both stored_max and every number
+        handed out by any worker, and return the first one.
+        """
+        connection = self.connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT next_number FROM id_sequences WHERE sequence_key = ?", (sequence_key,)).fetchone()
+            start = max(stored_max + 1, row[0] if row else 1)
+            connection.execute(
+                "INSERT OR REPLACE INTO id_sequences (sequence_key, next_number) VALUES (?, ?)",
+                (sequence_key, start + count),
+            )
+        return start
+
+    def stats(self):
+        connection = self.connection()
+        cached_reads, cached_bytes = connection.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM cache_entries").fetchone()
+        return {"path": self.path, "pid": os.getpid(), "cached_reads": cached_reads, "cached_bytes": cached_bytes}
+
+
+# None in single-process mode
+shared_state = SharedState(settings.MULTI_WORKER_STATE_PATH) if settings.MULTI_WORKER_STATE_PATH else None
+
+
+def shared_state_stats():
+    return shared_state.stats() if shared_state is not None else None
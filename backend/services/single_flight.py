@@ -0,0 +1,33 @@
+import asyncio
+import weakref
+
+# Counters for the health report
+stats = {"calls": 0, "shared": 0}
+
+# asyncio futures belong to one event loop, so keep one set of in-flight calls per loop
+_in_flight = weakref.WeakKeyDictionary()
+
+
+async def single_flight(key, func):
+    """
+    Await func(), unless a call with the same key is already running: then wait
+    for that one and share its result (or error). The key has to identify
+    everything the result depends on, e.g. table, table version and query.
+    A waiter that gives up (client gone) doesn't cancel the call for the others.
+    """
+    calls = _in_flight.setdefault(asyncio.get_running_loop(), {})
+    stats["calls"] += 1
+    future = calls.get(key)
+    if future is None:
+        future = asyncio.ensure_future(func())
+        calls[key] = future
+        future.add_done_callback(lambda _: calls.pop(key, None))
+        # Retrieve the error even if every waiter gave up, so it isn't logged as unhandled
+        future.add_done_callback(lambda future: future.cancelled() or future.exception())
+    else:
+        stats["shared"] += 1
+    return await asyncio.shield(future)
+
+
+def single_flight_stats():
+    return {**stats, "in_flight": sum(len(calls) for calls in _in_flight.values())}
@@ -0,0 +1,449 @@
+import datetime
+import json
+import sqlite3
+import threading
+from decimal import Decimal
+
+import pandas as pd
+
+from services.read_query import build_order_clause, build_where_clause
+from services.schema_coercion import coerce_frame, normalize_type, to_arrow_table
+from services.storage_engine import (
+    QUARANTINE_SUFFIX,
+    TOMBSTONE_SUFFIX,
+    UPDATED_AT_COLUMN,
+    VERSION_COLUMN,
+    StorageEngine,
+    VersionConflict,
+    build_delete_report,
+    build_outcomes,
+    dedupe_rows,
+    expected_version,
+)
+
+# Column definitions for the tables the API knows about, key column first,
+# row_version and updated_at last (see storage_engine.VERSION_COLUMN and UPDATED_AT_COLUMN).
+# Tables are created on first use so an empty database file works out of the box.
+TABLE_SCHEMAS = {
+    ("groups", "student"): [
+        ("student_id", "TEXT"),
+        ("first_name", "TEXT"),
+        ("last_name", "TEXT"),
+        ("date_of_birth", "DATE"),
+        ("gender", "TEXT"),
+        ("address", "TEXT"),
+        ("parent_id", "TEXT"),
+        ("teacher_id", "TEXT"),
+        ("row_version", "INTEGER"),
+        ("updated_at", "TIMESTAMP"),
+    ],
+    ("groups", "parent"): [
+        ("parent_id", "TEXT"),
+        ("name", "TEXT"),
+        ("phone_number", "TEXT"),
+        ("email", "TEXT"),
+        ("address", "TEXT"),
+        ("row_version", "INTEGER"),
+        ("updated_at", "TIMESTAMP"),
+    ],
+    ("groups", "teacher"): [
+        ("teacher_id", "TEXT"),
+        ("name", "TEXT"),
+        ("email", "TEXT"),
+        ("phone_number", "TEXT"),
+        ("class_id", "TEXT"),
+        ("row_version", "INTEGER"),
+        ("updated_at", "TIMESTAMP"),
+    ],
+    ("groups", "class"): [
+        ("class_id", "TEXT"),
+        ("class_name", "TEXT"),
+        ("grade_level", "TEXT"),
+        ("teacher_id", "TEXT"),
+        ("room_number", "TEXT"),
+        ("schedule", "TEXT"),
+        ("row_version", "INTEGER"),
+        ("updated_at", "TIMESTAMP"),
+    ],
+    ("assessment", "assessment"): [
+        ("assessment_id", "TEXT"),
+        ("student_id", "TEXT"),
+        ("assessment_name", "TEXT"),
+        ("assessment_date", "DATE"),
+        ("assessment_score", "REAL"),
+        ("assessment_notes", "TEXT"),
+        ("row_version", "INTEGER"),
+        ("updated_at", "TIMESTAMP"),
+    ],
+}
+TOMBSTONE_SCHEMA = [
+    ("deleted_key", "TEXT"),
+    ("key_column", "TEXT"),
+    ("deleted_at", "TIMESTAMP"),
+]
+QUARANTINE_SCHEMA = [
+    ("row_json", "TEXT"),
+    ("errors", "TEXT"),
+    ("quarantined_at", "TIMESTAMP"),
+]
+
+# Write time as UTC text with millisecond precision, so timestamps compare as strings
+NOW_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+def sqlite_timestamp(value):
+    """Format an aware datetime like NOW_SQL does."""
+    return value.astimezone(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+
+def to_sqlite_value(value):
+    """Convert python/pandas values into something sqlite3 can bind."""
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.date().isoformat()
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+class SQLiteEngine(StorageEngine):
+    """
+    Embedded engine for small schools, offline use, tests and benchmarks.
+    Each dataset/table pair is stored as a `{dataset}_{table}` table in a single file.
+    """
+    name = "sqlite"
+    project = "local"
+
+    def __init__(self, database_path=":memory:"):
+        self.database_path = database_path
+        self.connection = sqlite3.connect(database_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        if database_path != ":memory:":
+            self.connection.execute("PRAGMA journal_mode=WAL")
+        self.lock = threading.RLock()
+        self.created_tables = set()
+
+    def table_name(self, table_ref):
+        return f'"{table_ref.dataset_id}_{table_ref.table_id}"'
+
+    def tombstone_table_name(self, table_ref):
+        return f'"{table_ref.dataset_id}_{table_ref.table_id}{TOMBSTONE_SUFFIX}"'
+
+    def quarantine_table_name(self, table_ref):
+        return f'"{table_ref.dataset_id}_{table_ref.table_id}{QUARANTINE_SUFFIX}"'
+
+    def ensure_table(self, table_ref):
+        key = (table_ref.dataset_id, table_ref.table_id)
+        if key in self.created_tables:
+            return
+        schema = TABLE_SCHEMAS.get(key)
+        with self.lock, self.connection:
+            if schema:
+                self.create_table(self.table_name(table_ref), schema, primary_key=True)
+            self.create_table(self.tombstone_table_name(table_ref), TOMBSTONE_SCHEMA)
+            self.create_table(self.quarantine_table_name(table_ref), QUARANTINE_SCHEMA)
+        self.created_tables.add(key)
+
+    def create_table(self, table_name, schema, primary_key=False):
+        columns = [f"{name} {col_type}" for name, col_type in schema]
+        if primary_key:
+            columns[0] += " PRIMARY KEY"
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(columns)})")
+        # Database files created before a column was added get it now
+        existing = {row["name"] for row in self.connection.execute(f"PRAGMA table_info({table_name})")}
+        for name, col_type in schema:
+            if name not in existing:
+                self.connection.execute(f"ALTER TABLE {table_name} ADD COLUMN {name} {col_type}")
+
+    def execute(self, table_ref, query, params=()):
+        self.ensure_table(table_ref)
+        with self.lock, self.connection:
+            return self.connection.execute(query, params).fetchall()
+
+    def executemany(self, table_ref, query, param_rows):
+        self.ensure_table(table_ref)
+        with self.lock, self.connection:
+            return self.connection.executemany(query, param_rows).rowcount
+
+    def get_schema(self, table_ref):
+        rows = self.execute(table_ref, f"PRAGMA table_info({self.table_name(table_ref)})")
+        return [(row["name"], normalize_type(row["type"])) for row in rows]
+
+    def build_select(self, table_ref, read_query):
+        """Return (query, params) for a plain or ReadQuery-shaped SELECT."""
+        if read_query is None:
+            return f"SELECT * FROM {self.table_name(table_ref)}", []
+
+        params = []
+
+        def placeholder(value):
+            params.append(to_sqlite_value(value))
+            return "?"
+
+        # Same test as pending_tombstones: a tombstone newer than the row's last write
+        tombstoned = (
+            f"EXISTS (SELECT 1 FROM {self.tombstone_table_name(table_ref)} T "
+            f"WHERE T.deleted_key = M.{read_query.key_column} AND T.deleted_at > COALESCE(M.{UPDATED_AT_COLUMN}, ''))"
+        )
+        select_columns = read_query.select_columns()
+        select_list = ", ".join(select_columns) if select_columns else "*"
+        query = (
+            f"SELECT {select_list} FROM {self.table_name(table_ref)} M "
+            f"{build_where_clause(read_query, placeholder, tombstoned)} {build_order_clause(read_query)}"
+        )
+        if read_query.limit is not None:
+            query += f" LIMIT {read_query.limit + 1}"
+        return query, params
+
+    def fetch_rows(self, table_ref, read_query=None):
+        query, params = self.build_select(table_ref, read_query)
+        return [dict(row) for row in self.execute(table_ref, query, params)]
+
+    def fetch_arrow(self, table_ref, read_query=None):
+        # SQLite hands back dates as text, type the columns from the table schema
+        rows = self.fetch_rows(table_ref, read_query)
+        schema = self.get_schema(table_ref)
+        columns = (read_query.select_columns() if read_query is not None else None) or [name for name, _ in schema]
+        return to_arrow_table(coerce_frame(pd.DataFrame(rows, columns=columns), schema), schema)
+
+    def iter_pages(self, table_ref, read_query=None, page_size=1000):
+        query, params = self.build_select(table_ref, read_query)
+        self.ensure_table(table_ref)
+        with self.lock:
+            cursor = self.connection.execute(query, params)
+        while True:
+            # Only hold the lock per page so writers are not blocked for the whole stream
+            with self.lock:
+                rows = cursor.fetchmany(page_size)
+            if not rows:
+                break
+            yield [dict(row) for row in rows]
+
+    def max_id_number(self, table_ref, key_column, prefix):
+        rows = self.execute(
+            table_ref,
+            f"SELECT MAX(CAST(substr({key_column}, ?) AS INTEGER)) AS max_number "
+            f"FROM {self.table_name(table_ref)} "
+            f"WHERE substr({key_column}, 1, ?) = ? "
+            f"AND substr({key_column}, ?) GLOB '[0-9]*' "
+            f"AND substr({key_column}, ?) NOT GLOB '*[^0-9]*'",
+            (len(prefix) + 1, len(prefix), prefix, len(prefix) + 1, len(prefix) + 1),
+        )
+        return rows[0]["max_number"] or 0
+
+    def insert_rows(self, table_ref, rows, use_load_job=False, schema=None):
+        if not rows:
+            return []
+        updated_at = sqlite_timestamp(datetime.datetime.now(datetime.timezone.utc))
+        rows = [{**row, UPDATED_AT_COLUMN: updated_at} for row in rows]
+        columns = list(rows[0].keys())
+        query = (
+            f"INSERT INTO {self.table_name(table_ref)} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)})"
+        )
+        self.ensure_table(table_ref)
+        errors = []
+        with self.lock, self.connection:
+            for index, row in enumerate(rows):
+                try:
+                    self.connection.execute(query, [to_sqlite_value(row.get(col)) for col in columns])
+                except sqlite3.OperationalError:
+                    # A locked or busy database (retried, see services.resilience) or a
+                    # missing table, not something wrong with this row
+                    raise
+                except sqlite3.Error as e:
+                    errors.append({"index": index, "errors": [str(e)]})
+            if errors:
+                # All or nothing, like a refused load job
+                self.connection.rollback()
+        return errors
+
+    def bulk_upsert(self, table_ref, rows, key_column, insert_missing=False, schema=None):
+        df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+        if df.empty:
+            return []
+        df = dedupe_rows(df, key_column)
+        expected = {row[key_column]: expected_version(row) for row in df.to_dict("records")}
+        columns = [col for col in df.columns if col not in (VERSION_COLUMN, UPDATED_AT_COLUMN)]
+        keys = df[key_column].tolist()
+        values = [[to_sqlite_value(value) for value in row] for row in df[columns].itertuples(index=False, name=None)]
+        key_index = columns.index(key_column)
+        update_columns = [col for col in columns if col != key_column]
+        table_name = self.table_name(table_ref)
+
+        self.ensure_table(table_ref)
+        with self.lock, self.connection:
+            stored_versions = {}
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                found = self.connection.execute(
+                    f"SELECT {key_column}, {VERSION_COLUMN} FROM {table_name} "
+                    f"WHERE {key_column} IN ({', '.join('?' for _ in chunk)})",
+                    chunk,
+                ).fetchall()
+                stored_versions.update((row[0], row[1]) for row in found)
+            conflicts = {
+                key for key, version in stored_versions.items()
+                if expected[key] is not None and (version or 0) != expected[key]
+            }
+
+            matched_values = [row for row in values if row[key_index] in stored_versions and row[key_index] not in conflicts]
+            if update_columns and matched_values:
+                set_clause = ", ".join(f"{col} = ?" for col in update_columns)
+                self.connection.executemany(
+                    f"UPDATE {table_name} SET {set_clause}, {VERSION_COLUMN} = COALESCE({VERSION_COLUMN}, 0) + 1, "
+                    f"{UPDATED_AT_COLUMN} = {NOW_SQL} WHERE {key_column} = ?",
+                    [[row[columns.index(col)] for col in update_columns] + [row[key_index]] for row in matched_values],
+                )
+            if insert_missing:
+                self.connection.executemany(
+                    f"INSERT INTO {table_name} ({', '.join(columns)}, {VERSION_COLUMN}, {UPDATED_AT_COLUMN}) "
+                    f"VALUES ({', '.join('?' for _ in columns)}, 1, {NOW_SQL})",
+                    [row for row in values if row[key_index] not in stored_versions],
+                )
+
+        return build_outcomes(keys, key_column, stored_versions, insert_missing, conflicts, bool(update_columns))
+
+    def delete_many(self, table_ref, key_column, key_values, record_tombstones=True):
+        keys = list(dict.fromkeys(key_values))
+        self.ensure_table(table_ref)
+        with self.lock, self.connection:
+            deleted_keys = self.delete_keys(table_ref, key_column, keys, record_tombstones)
+        return build_delete_report(keys, deleted_keys)
+
+    def delete_keys(self, table_ref, key_column, keys, record_tombstones=True):
+        """Delete the rows and record a tombstone per deleted key. Returns the deleted keys."""
+        table_name = self.table_name(table_ref)
+        deleted_keys = []
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            in_clause = f"{key_column} IN ({', '.join('?' for _ in chunk)})"
+            found = self.connection.execute(f"SELECT {key_column} FROM {table_name} WHERE {in_clause}", chunk).fetchall()
+            self.connection.execute(f"DELETE FROM {table_name} WHERE {in_clause}", chunk)
+            deleted_keys += [row[0] for row in found]
+        if record_tombstones:
+            self.insert_tombstones(table_ref, key_column, deleted_keys)
+        return deleted_keys
+
+    def insert_tombstones(self, table_ref, key_column, keys):
+        self.connection.executemany(
+            f"INSERT INTO {self.tombstone_table_name(table_ref)} (deleted_key, key_column, deleted_at) "
+            f"VALUES (?, ?, {NOW_SQL})",
+            [[key, key_column] for key in keys],
+        )
+
+    def existing_keys(self, table_ref, key_column, key_values):
+        keys = list(dict.fromkeys(key_values))
+        found = []
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            found += self.execute(
+                table_ref,
+                f"SELECT {key_column} FROM {self.table_name(table_ref)} WHERE {key_column} IN ({', '.join('?' for _ in chunk)})",
+                chunk,
+            )
+        return [row[0] for row in found]
+
+    def record_tombstones(self, table_ref, key_column, key_values):
+        self.ensure_table(table_ref)
+        with self.lock, self.connection:
+            self.insert_tombstones(table_ref, key_column, key_values)
+
+    def record_quarantined(self, table_ref, entries):
+        self.executemany(
+            table_ref,
+            f"INSERT INTO {self.quarantine_table_name(table_ref)} (row_json, errors, quarantined_at) VALUES (?, ?, {NOW_SQL})",
+            [[json.dumps(entry["row"], default=str), json.dumps(entry["errors"], default=str)] for entry in entries],
+        )
+
+    def pending_tombstones(self, table_ref):
+        tombstone_table = self.tombstone_table_name(table_ref)
+        found = self.execute(table_ref, f"SELECT key_column FROM {tombstone_table} WHERE key_column IS NOT NULL LIMIT 1")
+        if not found:
+            return None, []
+        key_column = found[0][0]
+        rows = self.execute(
+            table_ref,
+            f"SELECT DISTINCT T.deleted_key FROM {tombstone_table} T "
+            f"JOIN {self.table_name(table_ref)} M ON M.{key_column} = T.deleted_key "
+            f"WHERE T.deleted_at > COALESCE(M.{UPDATED_AT_COLUMN}, '')",
+        )
+        return key_column, [row[0] for row in rows]
+
+    def fetch_changes(self, table_ref, key_column, since):
+        since = sqlite_timestamp(since)
+        rows = self.execute(
+            table_ref,
+            f"SELECT * FROM {self.table_name(table_ref)} WHERE {UPDATED_AT_COLUMN} > ?",
+            (since,),
+        )
+        deleted = self.execute(
+            table_ref,
+            f"SELECT DISTINCT deleted_key FROM {self.tombstone_table_name(table_ref)} WHERE deleted_at > ?",
+            (since,),
+        )
+        return [dict(row) for row in rows], [row[0] for row in deleted]
+
+    def check_versions(self, table_name, key_column, rows):
+        """Raise VersionConflict for rows whose expected version no longer matches."""
+        expected = {row[key_column]: expected_version(row) for row in rows if expected_version(row) is not None}
+        keys = list(expected)
+        conflicts = []
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            found = self.connection.execute(
+                f"SELECT {key_column}, {VERSION_COLUMN} FROM {table_name} WHERE {key_column} IN ({', '.join('?' for _ in chunk)})",
+                chunk,
+            ).fetchall()
+            conflicts += [row[0] for row in found if (row[1] or 0) != expected[row[0]]]
+        if conflicts:
+            raise VersionConflict(conflicts)
+
+    def execute_batch(self, operations):
+        for operation in operations:
+            self.ensure_table(operation.table_ref)
+
+        row_counts = []
+        # The connection context commits at the end or rolls everything back on error
+        with self.lock, self.connection:
+            for operation in operations:
+                table_name = self.table_name(operation.table_ref)
+                key_column = operation.key_column
+                if operation.op == "delete":
+                    keys = list(dict.fromkeys(operation.keys))
+                    row_counts.append(len(self.delete_keys(operation.table_ref, key_column, keys)))
+                    continue
+
+                columns = operation.columns
+                if operation.op == "add":
+                    query = (
+                        f"INSERT INTO {table_name} ({', '.join(columns)}, {UPDATED_AT_COLUMN}) "
+                        f"VALUES ({', '.join('?' for _ in columns)}, {NOW_SQL})"
+                    )
+                    values = [[to_sqlite_value(row[col]) for col in columns] for row in operation.rows]
+                else:
+                    self.check_versions(table_name, key_column, operation.rows)
+                    update_columns = [col for col in columns if col not in (key_column, VERSION_COLUMN, UPDATED_AT_COLUMN)]
+                    query = (
+                        f"UPDATE {table_name} SET {', '.join(f'{col} = ?' for col in update_columns)}, "
+                        f"{VERSION_COLUMN} = COALESCE({VERSION_COLUMN}, 0) + 1, {UPDATED_AT_COLUMN} = {NOW_SQL} "
+                        f"WHERE {key_column} = ?"
+                    )
+                    values = [[to_sqlite_value(row[col]) for col in update_columns] + [row[key_column]] for row in operation.rows]
+                row_counts.append(self.connection.executemany(query, values).rowcount)
+        return row_counts
+
+    def warm_up(self):
+        for dataset_id, table_id in TABLE_SCHEMAS:
+            self.ensure_table(self.get_table(dataset_id, table_id))
+
+    def health(self):
+        return {"engine": self.name, "database": self.database_path, "tables": len(self.created_tables)}
+
+    def close(self):
+        self.connection.close()
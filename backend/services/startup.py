@@ -0,0 +1,68 @@
+import importlib
+import threading
+import time
+
+from models.entities import ENTITIES
+from services.storage_engine import get_storage_engine
+
+# (module, milliseconds) in import order, filled in by timed_import
+import_costs = []
+
+_ready = threading.Event()
+_warm_up_lock = threading.Lock()
+_warm_up_thread = None
+warm_up_seconds = None
+warm_up_error = None
+
+
+def timed_import(module_name):
+    """Import a module and record how long it took (shared dependencies count once, for the first importer)."""
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    import_costs.append((module_name, round((time.perf_counter() - start) * 1000, 1)))
+    return module
+
+
+def warm_up():
+    """
+    Open the storage engine (credentials, client, access token) before requests need it,
+    and migrate the entity tables.
+    """
+    global warm_up_seconds, warm_up_error
+    start = time.perf_counter()
+    try:
+        engine = get_storage_engine()
+        engine.warm_up()
+        engine.migrate([engine.get_table(dataset, table) for dataset, table, *_ in ENTITIES.values()])
+    except Exception as e:
+        warm_up_error = str(e)
+        print(f"Storage warm-up failed: {e}")
+        return
+    warm_up_seconds = round(time.perf_counter() - start, 3)
+    warm_up_error = None
+    _ready.set()
+    print(f"Storage warm-up finished in {warm_up_seconds}s")
+
+
+def start_warm_up():
+    """Run warm_up in the background, again if the last attempt failed."""
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _ready.is_set() or (_warm_up_thread is not None and _warm_up_thread.is_alive()):
+            return
+        _warm_up_thread = threading.Thread(target=warm_up, name="storage-warm-up", daemon=True)
+        _warm_up_thread.start()
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def startup_report():
+    return {
+        "ready": is_ready(),
+        "warm_up_seconds": warm_up_seconds,
+        "warm_up_error": warm_up_error,
+        "import_total_ms": round(sum(ms for _, ms in import_costs), 1),
+        "imports": [{"module": module, "ms": ms} for module, ms in import_costs],
+    }
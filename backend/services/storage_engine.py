@@ -0,0 +1,294 @@
+import threading
+from dataclasses import dataclass
+
+# Every table carries a row version, bumped by each write. An update that sends the
+# version it was based on only applies if nobody changed the row since.
+VERSION_COLUMN = "row_version"
+# Set to the write time by every insert and update, the change feed reads the rows
+# written after a watermark from it.
+UPDATED_AT_COLUMN = "updated_at"
+# Deleted keys are recorded with their key column and deletion time in a
+# `{table}_tombstones` companion table, so the change feed can report deletions too.
+# With soft deletes the tombstone is written first and the row removed later
+# (see services.tombstones).
+TOMBSTONE_SUFFIX = "_tombstones"
+# Rows the insert buffer accepted but the table refused are kept, as JSON with the
+# errors, in a `{table}_quarantine` companion table (see services.insert_buffer).
+QUARANTINE_SUFFIX = "_quarantine"
+
+
+class VersionConflict(Exception):
+    """Raised when a batch update was based on an outdated row version."""
+
+    def __init__(self, keys):
+        self.keys = list(keys)
+        super().__init__(f"Version conflict: {', '.join(map(str, self.keys))}")
+
+
+@dataclass(frozen=True)
+class TableRef:
+    """Engine-neutral reference to a table (same attributes as bigquery.TableReference)."""
+    project: str
+    dataset_id: str
+    table_id: str
+
+    @property
+    def full_id(self):
+        return f"{self.project}.{self.dataset_id}.{self.table_id}"
+
+
+@dataclass
+class WriteOperation:
+    """
+    One statement of a batch. op is "add" or "update" (rows, all with the same
+    columns) or "delete" (keys). schema lists (column, canonical type) for typing values.
+    """
+    table_ref: TableRef
+    op: str
+    key_column: str
+    rows: list = None
+    keys: list = None
+    schema: list = None
+
+    @property
+    def columns(self):
+        return list(self.rows[0]) if self.rows else []
+
+
+def group_rows_by_columns(rows):
+    """Split rows into runs that set the same columns, in first-seen order."""
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row), []).append(row)
+    return list(groups.values())
+
+
+def dedupe_rows(df, key_column):
+    """Keep the last row per key, a MERGE may match each target row only once."""
+    return df.drop_duplicates(subset=[key_column], keep="last").reset_index(drop=True)
+
+
+def expected_version(row):
+    """The row version an update was based on, or None for an unconditional write."""
+    value = row.get(VERSION_COLUMN)
+    if value is None or value != value:  # None or NaN
+        return None
+    return int(value)
+
+
+def build_outcomes(keys, key_column, stored_versions, insert_missing, conflicts=(), bumped=True):
+    """
+    Per-row outcomes of an upsert. stored_versions maps the keys that existed to
+    their version before the write (None counts as 0), conflicts lists the keys
+    that were left alone because their version had moved on. bumped is False when
+    the write set no columns on the matched rows, so their version did not change.
+    """
+    conflicts = set(conflicts)
+    missing_status = "inserted" if insert_missing else "not_found"
+    outcomes = []
+    for key in keys:
+        if key in conflicts:
+            outcome = {key_column: key, "status": "conflict", VERSION_COLUMN: stored_versions[key] or 0}
+        elif key in stored_versions:
+            outcome = {key_column: key, "status": "updated", VERSION_COLUMN: (stored_versions[key] or 0) + int(bumped)}
+        elif insert_missing:
+            outcome = {key_column: key, "status": missing_status, VERSION_COLUMN: 1}
+        else:
+            outcome = {key_column: key, "status": missing_status}
+        outcomes.append(outcome)
+    return outcomes
+
+
+def build_delete_report(keys, deleted_keys, blocked_keys=()):
+    """Split the requested keys into deleted, missing and blocked by the streaming buffer."""
+    deleted_keys, blocked_keys = set(deleted_keys), set(blocked_keys)
+    keys = list(dict.fromkeys(keys))
+    return {
+        "deleted": [key for key in keys if key in deleted_keys],
+        "missing": [key for key in keys if key not in deleted_keys and key not in blocked_keys],
+        "streaming_buffer": [key for key in keys if key in blocked_keys],
+    }
+
+
+class StorageEngine:
+    """
+    Interface implemented by every storage backend.
+    The routers only talk to the functions in services.bigquery_service,
+    which delegate to the engine selected by settings.STORAGE_ENGINE.
+    """
+    name = "base"
+    project = None
+
+    def get_table(self, dataset_name, table_name):
+        return TableRef(self.project, dataset_name, table_name)
+
+    def get_schema(self, table_ref):
+        """Return the table schema as a list of (column name, canonical type), in order."""
+        raise NotImplementedError
+
+    def get_columns(self, table_ref):
+        """Return the column names of the table, in schema order."""
+        return [name for name, _ in self.get_schema(table_ref)]
+
+    def fetch_rows(self, table_ref, read_query=None):
+        """
+        Return the rows of the table as a list of dicts. A services.read_query.ReadQuery
+        pushes projection, filters, ordering and limit (+1 look-ahead row) into the SQL.
+        """
+        raise NotImplementedError
+
+    def fetch_arrow(self, table_ref, read_query=None):
+        """Same rows as fetch_rows, as a pyarrow.Table."""
+        raise NotImplementedError
+
+    def iter_pages(self, table_ref, read_query=None, page_size=1000):
+        """Yield the rows of fetch_rows as lists of at most page_size dicts, as they arrive."""
+        raise NotImplementedError
+
+    def max_id_number(self, table_ref, key_column, prefix):
+        """Return the highest numeric suffix of IDs shaped like prefix + digits (0 if none)."""
+        raise NotImplementedError
+
+    def insert_rows(self, table_ref, rows, use_load_job=False, schema=None):
+        """
+        Append rows (list of dicts). schema ([(column, canonical type)]) types the
+        load job's columns. Returns one {"index": position in rows, "errors": [...]}
+        per row the table refused, in which case no row of the load job is written.
+        Failures that are not down to particular rows (missing table, permissions,
+        a locked database) raise.
+        """
+        raise NotImplementedError
+
+    def bulk_upsert(self, table_ref, rows, key_column, insert_missing=False, schema=None):
+        """
+        Apply a batch of rows (list of dicts or DataFrame) matched on key_column
+        as one set-based statement. Rows whose key is missing are inserted when
+        insert_missing is set. schema ([(column, canonical type)]) types the staging load.
+        A VERSION_COLUMN value in a row makes its update conditional on that version,
+        every applied row gets its version bumped and UPDATED_AT_COLUMN set.
+        Returns one {key_column: ..., "status": ...} per key, with status
+        "updated", "inserted" or "not_found".
+        """
+        raise NotImplementedError
+
+    def bulk_upsert_batches(self, table_ref, batches, key_column, schema=None):
+        """
+        Insert or update rows arriving as an iterator of pyarrow.Tables (all with the
+        same columns), later rows winning per key. Returns
+        {"rows": total rows, "updated": ..., "inserted": ...}.
+        Engines override this to feed a single load job; the default upserts per batch.
+        """
+        summary = {"rows": 0, "updated": 0, "inserted": 0}
+        for batch in batches:
+            outcomes = self.bulk_upsert(table_ref, batch.to_pandas(), key_column, insert_missing=True, schema=schema)
+            summary["rows"] += batch.num_rows
+            summary["updated"] += sum(1 for outcome in outcomes if outcome["status"] == "updated")
+            summary["inserted"] += sum(1 for outcome in outcomes if outcome["status"] == "inserted")
+        return summary
+
+    def delete_rows(self, table_ref, key_column, key_value):
+        """Delete the rows whose key_column equals key_value."""
+        return self.delete_many(table_ref, key_column, [key_value])
+
+    def delete_many(self, table_ref, key_column, key_values, record_tombstones=True):
+        """
+        Delete every row whose key is in key_values with one statement, recording a
+        tombstone per deleted key unless record_tombstones is False (compaction of
+        keys that already have one).
+        Returns build_delete_report(...): {"deleted": [...], "missing": [...], "streaming_buffer": [...]}.
+        """
+        raise NotImplementedError
+
+    def existing_keys(self, table_ref, key_column, key_values):
+        """Return the keys in key_values that have a stored row."""
+        raise NotImplementedError
+
+    def record_tombstones(self, table_ref, key_column, key_values):
+        """Append a tombstone per key without touching the rows (a soft delete)."""
+        raise NotImplementedError
+
+    def record_quarantined(self, table_ref, entries):
+        """Keep rows the table refused ({"row": ..., "errors": [...]}) in its quarantine table."""
+        raise NotImplementedError
+
+    def pending_tombstones(self, table_ref):
+        """
+        Return (key_column, keys) of the rows that have a tombstone newer than their
+        last write but are still stored, i.e. soft deleted and not yet compacted.
+        key_column is None when the table has no tombstones.
+        """
+        raise NotImplementedError
+
+    def fetch_changes(self, table_ref, key_column, since):
+        """
+        Return (rows, deleted_keys): the rows inserted or updated after since (an aware
+        datetime, compared with UPDATED_AT_COLUMN) and the keys deleted after it.
+        """
+        raise NotImplementedError
+
+    def execute_batch(self, operations):
+        """
+        Apply a list of WriteOperation as one transaction, all or nothing.
+        Returns the number of rows each operation affected. Raises VersionConflict
+        when an update carries a VERSION_COLUMN value that no longer matches.
+        """
+        raise NotImplementedError
+
+    def warm_up(self):
+        """Do the slow first-use work (auth, connections, tables) ahead of the first request."""
+        pass
+
+    def migrate(self, table_refs):
+        """
+        Bring existing tables up to the columns and side tables the API relies on.
+        Runs once at startup (services.startup), never as part of a request.
+        """
+        pass
+
+    def health(self):
+        """Connection and credential state for the health endpoint (a JSON-ready dict)."""
+        return {"engine": self.name}
+
+    def close(self):
+        pass
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def create_storage_engine(engine_name):
+    engine_name = engine_name.lower()
+    if engine_name == "bigquery":
+        from services.bigquery_engine import BigQueryEngine
+        return BigQueryEngine()
+    if engine_name == "sqlite":
+        from config import settings
+        from services.sqlite_engine import SQLiteEngine
+        return SQLiteEngine(settings.SQLITE_DATABASE_PATH)
+    raise ValueError(f"Unknown storage engine: {engine_name}")
+
+
+def get_storage_engine():
+    """Return the process-wide engine, creating it on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                from config import settings
+                _engine = create_storage_engine(settings.STORAGE_ENGINE)
+    return _engine
+
+
+def set_storage_engine(engine):
+    """Replace the process-wide engine (e.g. an in-memory SQLite engine for benchmarks)."""
+    global _engine
+    _engine = engine
+
+
+def close_storage_engine():
+    """Close the process-wide engine's connections, the next call to get_storage_engine opens a new one."""
+    global _engine
+    engine, _engine = _engine, None
+    if engine is not None:
+        engine.close()
@@ -0,0 +1,36 @@
+import json
+
+from fastapi.responses import StreamingResponse
+
+from services.async_storage import run_storage_call
+from services.bigquery_service import stream_data_from_bigquery
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def wants_ndjson(request):
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def json_default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def ndjson_response(table_ref, read_query=None):
+    """
+    Stream a table read as newline-delimited JSON. Each result page is pulled on the
+    storage executor and written out before the next one is fetched, so memory stays
+    at one page and the first rows go out as soon as the first page arrives.
+    """
+    pages = stream_data_from_bigquery(table_ref, read_query)
+
+    async def body():
+        while True:
+            page = await run_storage_call(table_ref, next, pages, None)
+            if page is None:
+                break
+            yield "".join(json.dumps(row, default=json_default) + "\n" for row in page)
+
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE)
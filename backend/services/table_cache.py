@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+
+from config import settings
+from services.async_storage import run_blocking
+from services.change_feed import feed_watermark
+from services.shared_state import shared_state
+from services.single_flight import single_flight
+
+
+@dataclass
+class CacheEntry:
+    body: bytes
+    etag: str
+    version: int
+    fetched_at: float
+    # Change feed watermark taken before the read: /changes?since=watermark has every change the body misses
+    watermark: str = None
+    refreshing: bool = False
+
+
+def serialize_json(rows):
+    return json.dumps(jsonable_encoder(rows), separators=(",", ":")).encode("utf-8")
+
+
+class TableCache:
+    """
+    Read-through cache of serialized table reads, keyed by table (plus an optional
+    variant for parameterized reads).
+
+    Every write through services.bigquery_service bumps the table's version, which
+    makes the next read reload synchronously. Entries that merely aged past the TTL
+    (changes made outside this process) are served stale while a background task
+    refreshes them.
+
+    With a SharedState (multi-worker mode) the versions live in the shared file, so
+    a write in one worker invalidates the reads cached by all of them, and reads
+    missing in this worker are looked up in the shared file before storage.
+    Only reads of what is in storage are shared: while this worker still queues
+    rows of a table, its reads of that table (which include them) stay local.
+    The shared file is accessed on the storage pool, never on the event loop.
+    """
+
+    def __init__(self, ttl_seconds, max_stale_seconds, shared=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_stale_seconds = max_stale_seconds
+        self.shared = shared
+        self.entries = {}
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.background_tasks = set()
+        # Whether this process holds rows of a table that are not in storage yet,
+        # set by services.insert_buffer
+        self.has_pending_rows = lambda table_ref: False
+
+    def version(self, table_ref):
+        if self.shared is not None:
+            return self.shared.version(table_ref.full_id)
+        with self.lock:
+            return self.versions.get(table_ref.full_id, 0)
+
+    async def current_version(self, table_ref):
+        """version() for the event loop."""
+        if self.shared is None:
+            return self.version(table_ref)
+        return await run_blocking(self.version, table_ref)
+
+    def shares(self, table_ref):
+        return self.shared is not None and not self.has_pending_rows(table_ref)
+
+    def invalidate(self, table_ref):
+        """Bump the table version and drop its cached reads."""
+        if self.shared is not None:
+            self.shared.bump(table_ref.full_id)
+        with self.lock:
+            self.versions[table_ref.full_id] = self.versions.get(table_ref.full_id, 0) + 1
+            for key in [key for key in self.entries if key[0] == table_ref.full_id]:
+                del self.entries[key]
+
+    async def load(self, table_ref, variant, loader, version, serialize, keep=True):
+        if not settings.READ_SINGLE_FLIGHT_ENABLED:
+            return await self.fetch(table_ref, variant, loader, version, serialize, keep)
+        # Identical reads arriving together (same table version, query and format)
+        # share one storage call and one serialization
+        return await single_flight(
+            (table_ref.full_id, variant, version),
+            lambda: self.fetch(table_ref, variant, loader, version, serialize, keep),
+        )
+
+    async def fetch(self, table_ref, variant, loader, version, serialize, keep):
+        # Checked before the read: rows queued during it bump the version and the
+        # shared file refuses the entry
+        shares = self.shares(table_ref)
+        watermark = feed_watermark().isoformat()
+        body = serialize(await loader())
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        # Wall-clock time, entries are shared between processes in multi-worker mode
+        entry = CacheEntry(body, etag, version, time.time(), watermark)
+        # A write that landed while we were reading makes this result stale, don't keep it
+        if keep and await self.current_version(table_ref) == version:
+            with self.lock:
+                self.entries[(table_ref.full_id, variant)] = entry
+            if shares:
+                await run_blocking(self.shared.put_entry, table_ref.full_id, variant, version, etag, body, entry.fetched_at, watermark)
+        return entry
+
+    async def refresh(self, table_ref, variant, loader, entry, serialize):
+        try:
+            await self.load(table_ref, variant, loader, entry.version, serialize)
+        except Exception as e:
+            print(f"Background refresh of {table_ref.full_id} failed: {e}")
+        finally:
+            entry.refreshing = False
+
+    async def get(self, table_ref, loader, variant="", serialize=None):
+        serialize = serialize or serialize_json
+        version = await self.current_version(table_ref)
+        entry = self.entries.get((table_ref.full_id, variant))
+        if (entry is None or entry.version != version) and self.shares(table_ref):
+            # Read by another worker since the last write
+            shared_entry = await run_blocking(self.shared.get_entry, table_ref.full_id, variant, version)
+            if shared_entry is not None:
+                entry = CacheEntry(shared_entry[0], shared_entry[1], version, shared_entry[2], shared_entry[3])
+                with self.lock:
+                    self.entries[(table_ref.full_id, variant)] = entry
+        if entry is None or entry.version != version:
+            return await self.load(table_ref, variant, loader, version, serialize)
+
+        age = time.time() - entry.fetched_at
+        if age < self.ttl_seconds:
+            return entry
+        if age < self.ttl_seconds + self.max_stale_seconds:
+            # Stale-while-revalidate: answer now, refresh once in the background
+            if not entry.refreshing:
+                entry.refreshing = True
+                task = asyncio.create_task(self.refresh(table_ref, variant, loader, entry, serialize))
+                self.background_tasks.add(task)
+                task.add_done_callback(self.background_tasks.discard)
+            return entry
+        return await self.load(table_ref, variant, loader, version, serialize)
+
+
+table_cache = TableCache(settings.TABLE_CACHE_TTL_SECONDS, settings.TABLE_CACHE_MAX_STALE_SECONDS, shared_state)
+
+
+def etag_matches(request, etag):
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [value.strip().removeprefix("W/") for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+async def cached_table_response(request, table_ref, loader, variant="", media_type="application/json", serialize=None):
+    """
+    Serve a table read through the cache. The response carries an ETag and
+    a matching If-None-Match header gets an empty 304. X-Change-Watermark is the
+    change feed watermark of the body (also on a 304 and when served stale).
+    serialize turns the loader's result into the response body (JSON by default).
+    """
+    serialize = serialize or serialize_json
+    variant = f"{media_type}|{variant}"
+    if not settings.TABLE_CACHE_ENABLED:
+        entry = await table_cache.load(table_ref, variant, loader, await table_cache.current_version(table_ref), serialize, keep=False)
+        return Response(content=entry.body, media_type=media_type, headers={"X-Change-Watermark": entry.watermark})
+
+    entry = await table_cache.get(table_ref, loader, variant, serialize)
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache", "Vary": "Accept", "X-Change-Watermark": entry.watermark}
+    if etag_matches(request, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type=media_type, headers=headers)
@@ -0,0 +1,154 @@
+import threading
+import time
+
+from config import settings
+from services.shared_state import shared_state
+from services.storage_engine import build_delete_report, get_storage_engine
+from services.table_cache import table_cache
+
+
+class TombstoneSet:
+    """
+    Soft-deleted keys of one table: their tombstones are written but the rows are
+    still stored. Reads filter these keys out (see services.bigquery_service) and
+    the compactor removes the rows with one DELETE per table every
+    TOMBSTONE_COMPACTION_SECONDS. The tombstones themselves are durable, a new
+    process loads the keys still waiting for compaction on first use.
+    In multi-worker mode every delete and compaction bumps the table's tombstone
+    version in the shared state file, and the other workers load the keys again.
+    """
+
+    def __init__(self, table_ref):
+        self.table_ref = table_ref
+        self.key_column = None
+        self.keys = set()
+        self.version = None  # tombstone version the keys were loaded at, None until loaded
+        self.lock = threading.Lock()
+        # One load per table at a time, without blocking the other tables
+        self.load_lock = threading.Lock()
+        # Only one compaction per table at a time
+        self.compact_lock = threading.Lock()
+
+    def ensure_loaded(self):
+        """Load the keys on first use, and again once another worker changed them."""
+        if self.version is not None and (shared_state is None or self.version == shared_state.tombstone_version(self.table_ref.full_id)):
+            return
+        with self.load_lock:
+            # Taken before the load, a delete landing meanwhile makes the next call load again
+            version = shared_state.tombstone_version(self.table_ref.full_id) if shared_state is not None else 0
+            if self.version == version:
+                return
+            key_column, keys = get_storage_engine().pending_tombstones(self.table_ref)
+            with self.lock:
+                self.key_column = key_column or self.key_column
+                self.keys = set(keys)
+                self.version = version
+        if keys:
+            # Left over by an earlier process, or deleted by another worker
+            start_compactor()
+
+    def changed(self):
+        """Let the other workers know the keys changed."""
+        if shared_state is None:
+            return
+        version = shared_state.bump_tombstones(self.table_ref.full_id)
+        with self.lock:
+            # Nobody else changed them in between, the keys in memory are current
+            if self.version is not None and version == self.version + 1:
+                self.version = version
+
+    def snapshot(self):
+        with self.lock:
+            return frozenset(self.keys)
+
+    def add(self, key_column, keys):
+        with self.lock:
+            self.key_column = key_column
+            self.keys.update(keys)
+        self.changed()
+
+    def discard(self, keys):
+        with self.lock:
+            self.keys.difference_update(keys)
+        self.changed()
+
+    def compact(self):
+        """Physically delete the soft-deleted rows. Returns the number of rows removed."""
+        with self.compact_lock:
+            keys = list(self.snapshot())
+            if not keys:
+                return 0
+            report = get_storage_engine().delete_many(self.table_ref, self.key_column, keys, record_tombstones=False)
+            # Rows still in BigQuery's streaming buffer stay soft deleted until the next run
+            self.discard(report["deleted"] + report["missing"])
+            table_cache.invalidate(self.table_ref)
+            print(f"Compacted {len(report['deleted'])} soft-deleted row(s) of {self.table_ref.full_id}")
+            return len(report["deleted"])
+
+
+_sets = {}
+_sets_lock = threading.Lock()
+_compactor = None
+_compactor_lock = threading.Lock()
+
+
+def get_tombstone_set(table_ref):
+    with _sets_lock:
+        if table_ref.full_id not in _sets:
+            _sets[table_ref.full_id] = TombstoneSet(table_ref)
+        tombstone_set = _sets[table_ref.full_id]
+    # Outside _sets_lock, loading one table's keys doesn't hold up reads of the others
+    tombstone_set.ensure_loaded()
+    return tombstone_set
+
+
+def compact_all():
+    with _sets_lock:
+        tombstone_sets = list(_sets.values())
+    for tombstone_set in tombstone_sets:
+        try:
+            tombstone_set.compact()
+        except Exception as e:
+            # The keys stay soft deleted and the next run retries them
+            print(f"Tombstone compaction failed: {e}")
+
+
+def run_compactor():
+    while True:
+        time.sleep(settings.TOMBSTONE_COMPACTION_SECONDS)
+        compact_all()
+
+
+def start_compactor():
+    global _compactor
+    with _compactor_lock:
+        if _compactor is None:
+            _compactor = threading.Thread(target=run_compactor, name="tombstone-compactor", daemon=True)
+            _compactor.start()
+
+
+def soft_delete(table_ref, key_column, key_values):
+    """
+    Delete rows by writing their tombstones only, the compactor removes the rows later.
+    Returns the same report as a hard delete; rows in the streaming buffer can be
+    soft deleted, so "streaming_buffer" stays empty.
+    """
+    keys = list(dict.fromkeys(key_values))
+    tombstone_set = get_tombstone_set(table_ref)
+    already_deleted = tombstone_set.snapshot()
+    existing = [key for key in get_storage_engine().existing_keys(table_ref, key_column, keys) if key not in already_deleted]
+    get_storage_engine().record_tombstones(table_ref, key_column, existing)
+    tombstone_set.add(key_column, existing)
+    start_compactor()
+    return build_delete_report(keys, existing)
+
+
+def tombstoned_keys(table_ref):
+    """Soft-deleted keys of the table waiting for compaction, with the table's key column."""
+    tombstone_set = get_tombstone_set(table_ref)
+    return tombstone_set.snapshot(), tombstone_set.key_column
+
+
+def compact_table(table_ref):
+    """Remove the table's soft-deleted rows now, e.g. before a write that re-creates their keys."""
+    get_tombstone_set(table_ref).compact()
@@ -0,0 +1,45 @@
+import csv
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+
+def read_csv_header(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return next(csv.reader(f), [])
+
+
+def iter_csv_frames(path, block_size):
+    """
+    Parse a CSV in record batches with pyarrow's streaming reader. Every column is
+    read as a string, types are applied per batch from the table schema.
+    """
+    header = read_csv_header(path)
+    if not header:
+        return
+    reader = pa_csv.open_csv(
+        path,
+        read_options=pa_csv.ReadOptions(block_size=block_size),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={name: pa.string() for name in header},
+            strings_can_be_null=True,
+        ),
+    )
+    for batch in reader:
+        yield batch.to_pandas()
+
+
+def iter_excel_frames(path, batch_rows=50000):
+    # Excel workbooks cannot be parsed incrementally, only the coercion is batched
+    df = pd.read_excel(path)
+    for start in range(0, len(df), batch_rows):
+        yield df.iloc[start:start + batch_rows]
+
+
+def iter_upload_frames(path, filename, block_size):
+    if filename.endswith(".csv"):
+        return iter_csv_frames(path, block_size)
+    if filename.endswith((".xls", ".xlsx")):
+        return iter_excel_frames(path)
+    raise ValueError("Unsupported file type")
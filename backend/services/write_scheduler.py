@@ -0,0 +1,221 @@
+import asyncio
+import weakref
+from dataclasses import dataclass, field
+
+from config import settings
+from services.async_storage import run_storage_call
+from services.bigquery_service import bulk_delete_from_bigquery, bulk_upsert
+from services.storage_engine import VERSION_COLUMN, expected_version
+
+
+@dataclass
+class PendingWrite:
+    """One caller's upsert (rows) or delete (keys), waiting for the next batch."""
+    kind: str  # "upsert" or "delete"
+    key_column: str
+    rows: list = field(default_factory=list)
+    keys: list = field(default_factory=list)
+    insert_missing: bool = False
+    future: asyncio.Future = None
+
+    def write_keys(self):
+        if self.kind == "delete":
+            return list(dict.fromkeys(self.keys))
+        return list(dict.fromkeys(row[self.key_column] for row in self.rows))
+
+
+def split_rounds(writes):
+    """
+    Cut a window of writes into consecutive rounds in which a key written with a row
+    version is written by no other write of the round, so merging writes never
+    folds a version check into another write.
+    """
+    rounds = [[]]
+    # Keys written in the current round, and whether any of those writes carries a version
+    touched = {}
+    for write in writes:
+        versioned = {}
+        if write.kind == "delete":
+            versioned = dict.fromkeys(write.write_keys(), False)
+        else:
+            for row in write.rows:
+                key = row[write.key_column]
+                versioned[key] = versioned.get(key, False) or expected_version(row) is not None
+        if any(key in touched and (touched[key] or flag) for key, flag in versioned.items()):
+            rounds.append([])
+            touched = {}
+        rounds[-1].append(write)
+        for key, flag in versioned.items():
+            touched[key] = touched.get(key, False) or flag
+    return rounds
+
+
+def apply_write_batch(table_ref, writes):
+    """
+    Apply a window of writes to one table with one upsert per column set and one
+    delete per round (see split_rounds, usually the whole window is one round).
+    Returns one result per write, in order: a list of per-row outcomes for upserts,
+    a delete report for deletes.
+    """
+    results = []
+    for round_writes in split_rounds(writes):
+        results += apply_write_round(table_ref, round_writes)
+    return results
+
+
+def apply_write_round(table_ref, writes):
+    """
+    Apply writes of which none carries a row version for a key another one writes.
+    The last write per key wins, updates of the same key are merged field by field.
+    """
+    # Final write per key, by position in the round
+    final = {}
+    deleted_earlier = set()
+    for index, write in enumerate(writes):
+        if write.kind == "delete":
+            for key in write.write_keys():
+                final[key] = (index, None)
+            continue
+        for row in write.rows:
+            key = row[write.key_column]
+            previous = final.get(key)
+            if previous is not None and previous[1] is None:
+                if not write.insert_missing:
+                    # The row is gone by the time this update would run
+                    continue
+                deleted_earlier.add(key)
+            elif previous is not None:
+                # Partial updates of the same row add up, later values win
+                row = {**previous[1], **row}
+            final[key] = (index, row)
+
+    delete_keys = [key for key, (_, row) in final.items() if row is None]
+    upsert_groups = {}
+    for key, (index, row) in final.items():
+        if row is not None:
+            write = writes[index]
+            group = (write.key_column, write.insert_missing, tuple(row))
+            upsert_groups.setdefault(group, []).append(row)
+
+    # Whether each key existed before the batch, and the outcome of its final write
+    existed = {}
+    statuses = {}
+    versions = {}
+    if delete_keys:
+        key_column = next(write.key_column for write in writes if write.kind == "delete")
+        report = bulk_delete_from_bigquery(table_ref, key_column, delete_keys)
+        for status, keys in report.items():
+            for key in keys:
+                statuses[key] = status
+                existed[key] = status != "missing"
+    for (key_column, insert_missing, _), rows in upsert_groups.items():
+        for outcome in bulk_upsert(table_ref, rows, key_column, insert_missing=insert_missing):
+            key = outcome[key_column]
+            existed[key] = outcome["status"] in ("updated", "conflict")
+            statuses[key] = "inserted" if key in deleted_earlier else outcome["status"]
+            if VERSION_COLUMN in outcome:
+                versions[key] = outcome[VERSION_COLUMN]
+
+    results = []
+    for index, write in enumerate(writes):
+        if write.kind == "delete":
+            report = {"deleted": [], "missing": [], "streaming_buffer": []}
+            for key in write.write_keys():
+                if final[key][0] == index:
+                    report[statuses[key]].append(key)
+                else:
+                    # Rewritten by a later write in the same round
+                    report["deleted" if existed[key] else "missing"].append(key)
+            results.append(report)
+            continue
+
+        outcomes = []
+        for key in write.write_keys():
+            final_index = final[key][0]
+            if final_index == index:
+                status = statuses[key]
+            elif final_index < index:
+                status = "not_found"
+            elif existed[key]:
+                status = "updated"
+            else:
+                status = "inserted" if write.insert_missing else "not_found"
+            outcome = {write.key_column: key, "status": status}
+            if key in versions and status != "not_found":
+                outcome[VERSION_COLUMN] = versions[key]
+            outcomes.append(outcome)
+        results.append(outcomes)
+    return results
+
+
+class TableWriteQueue:
+    """
+    Collects the writes made to one table during WRITE_BATCH_WINDOW_SECONDS and
+    applies them as one batch. Only one batch per table runs at a time, writes
+    arriving meanwhile are gathered into the next one.
+    """
+
+    def __init__(self, table_ref):
+        self.table_ref = table_ref
+        self.pending = []
+        self.scheduled = False
+        self.running = asyncio.Lock()
+        self.tasks = set()
+
+    async def submit(self, write):
+        write.future = asyncio.get_running_loop().create_future()
+        self.pending.append(write)
+        if not self.scheduled:
+            self.scheduled = True
+            task = asyncio.create_task(self.drain())
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        return await write.future
+
+    async def drain(self):
+        await asyncio.sleep(settings.WRITE_BATCH_WINDOW_SECONDS)
+        async with self.running:
+            self.scheduled = False
+            writes, self.pending = self.pending, []
+            try:
+                results = await run_storage_call(self.table_ref, apply_write_batch, self.table_ref, writes)
+            except Exception as e:
+                print(f"Write batch on {self.table_ref.full_id} failed: {e}")
+                for write in writes:
+                    write.future.set_exception(e)
+                return
+            print(f"Applied {len(writes)} write(s) to {self.table_ref.full_id} in one batch")
+            for write, result in zip(writes, results):
+                write.future.set_result(result)
+
+
+# asyncio futures and locks belong to one event loop, so keep one set of queues per loop
+_write_queues = weakref.WeakKeyDictionary()
+
+
+def get_write_queue(table_ref):
+    queues = _write_queues.setdefault(asyncio.get_running_loop(), {})
+    if table_ref.full_id not in queues:
+        queues[table_ref.full_id] = TableWriteQueue(table_ref)
+    return queues[table_ref.full_id]
+
+
+async def schedule_upsert(table_ref, rows, key_column, insert_missing=False):
+    """Queue an upsert for the table's next write batch and return its per-row outcomes."""
+    if not rows:
+        return []
+    write = PendingWrite("upsert", key_column, rows=rows, insert_missing=insert_missing)
+    return await get_write_queue(table_ref).submit(write)
+
+
+def count_updated(results):
+    """Rows an upsert actually changed, conflicts and unknown keys left out."""
+    return sum(1 for result in results if result["status"] == "updated")
+
+
+async def schedule_delete(table_ref, key_column, keys):
+    """Queue a delete for the table's next write batch and return its delete report."""
+    if not keys:
+        return {"deleted": [], "missing": [], "streaming_buffer": []}
+    write = PendingWrite("delete", key_column, keys=keys)
+    return await get_write_queue(table_ref).submit(write)
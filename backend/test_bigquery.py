@@ -12,7 +12,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Import the BigQuery service
-from services.bigquery_service import client, get_table
+from services.bigquery_service import get_bigquery_client, get_table
 
 def test_bigquery_connection():
     """Test the BigQuery connection and basic operations."""
@@ -20,6 +20,7 @@ def test_bigquery_connection():
         print("🔍 Testing BigQuery connection...")
         
         # Test 1: Check if client is initialized
+        client = get_bigquery_client()
         if client is None:
             print("❌ BigQuery client is not initialized")
             return False
@@ -0,0 +1,41 @@
+import os
+
+# Settings are read at import time: run every test on an in-memory SQLite engine
+os.environ.setdefault("STORAGE_ENGINE", "sqlite")
+os.environ.setdefault("SQLITE_DATABASE_PATH", ":memory:")
+os.environ.setdefault("MULTI_WORKER_STATE_PATH", "")
+os.environ.setdefault("LOCAL_REPLICA_TABLES", "")
+# Tests flush the insert buffer themselves
+os.environ.setdefault("INSERT_BUFFER_FLUSH_SECONDS", "3600")
+
+import pytest
+from fastapi.testclient import TestClient
+
+from services import id_allocator, insert_buffer, tombstones
+from services.schema_registry import schema_registry
+from services.sqlite_engine import SQLiteEngine
+from services.storage_engine import set_storage_engine
+from services.table_cache import table_cache
+
+
+@pytest.fixture(autouse=True)
+def engine():
+    """A fresh empty database per test, and no state left over from the previous one."""
+    engine = SQLiteEngine(":memory:")
+    set_storage_engine(engine)
+    insert_buffer._buffers.clear()
+    tombstones._sets.clear()
+    id_allocator._sequences.clear()
+    schema_registry.invalidate()
+    with table_cache.lock:
+        table_cache.entries.clear()
+    yield engine
+    set_storage_engine(None)
+
+
+@pytest.fixture
+def client(engine):
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
@@ -0,0 +1,206 @@
+import datetime
+import json
+import sqlite3
+
+import pytest
+
+from services.bigquery_service import get_table
+from services.insert_buffer import flush_pending, pending_rows
+from services.read_query import ReadQuery
+from services.tombstones import compact_all
+
+STUDENT = get_table("groups", "student")
+
+
+def student(first_name, **fields):
+    return {"first_name": first_name, "last_name": "Doe", "date_of_birth": "2015-04-01", "gender": "F",
+            "address": "1 Main St", "parent_id": "P001", "teacher_id": "T001", **fields}
+
+
+def add_students(client, *names, flush=True):
+    response = client.post("/add-student", json=[student(name) for name in names])
+    assert response.status_code == 200
+    if flush:
+        flush_pending(STUDENT)
+
+
+def students(client):
+    return {row["student_id"]: row for row in client.get("/get-student").json()}
+
+
+def test_added_students_are_listed_before_and_after_the_flush(client):
+    add_students(client, "Ann", "Bob", flush=False)
+    assert len(pending_rows(STUDENT)[0]) == 2
+    assert {key: row["first_name"] for key, row in students(client).items()} == {"S001": "Ann", "S002": "Bob"}
+
+    flush_pending(STUDENT)
+    assert pending_rows(STUDENT)[0] == []
+    listed = students(client)
+    assert {key: row["first_name"] for key, row in listed.items()} == {"S001": "Ann", "S002": "Bob"}
+    assert listed["S001"]["row_version"] == 1
+
+
+def test_etag_and_not_modified(client):
+    add_students(client, "Ann")
+    first = client.get("/get-student")
+    etag = first.headers["ETag"]
+    assert client.get("/get-student", headers={"If-None-Match": etag}).status_code == 304
+
+    assert client.patch("/update-student", json=[{"student_id": "S001", "first_name": "Anna"}]).status_code == 200
+    changed = client.get("/get-student", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.json()[0]["first_name"] == "Anna"
+
+
+def test_cursor_pagination_visits_every_row_once(client):
+    add_students(client, "Ann", "Bob", "Cat", "Dan", "Eve")
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, "columns": "student_id"}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get("/get-student", params=params).json()
+        assert len(page["rows"]) <= 2
+        seen += [row["student_id"] for row in page["rows"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == ["S001", "S002", "S003", "S004", "S005"]
+
+
+def test_cursor_must_match_the_query(client):
+    add_students(client, "Ann", "Bob", "Cat")
+    cursor = client.get("/get-student", params={"limit": 1}).json()["next_cursor"]
+    other_order = client.get("/get-student", params={"limit": 1, "order_by": "first_name", "cursor": cursor})
+    assert other_order.status_code == 400
+    assert client.get("/get-student", params={"limit": 1, "cursor": "WzFd"}).status_code == 400
+
+
+def test_put_with_outdated_row_version_is_a_conflict(client):
+    add_students(client, "Ann")
+    row = students(client)["S001"]
+    current = client.put("/update-student", json=[{**row, "first_name": "Anna", "row_version": 1}])
+    assert current.json()["results"] == [{"student_id": "S001", "status": "updated", "row_version": 2}]
+    assert current.json()["message"] == "Updated 1 of 1 student(s)"
+
+    stale = client.put("/update-student", json=[{**row, "first_name": "Annie", "row_version": 1}])
+    assert stale.json()["results"][0]["status"] == "conflict"
+    assert stale.json()["message"] == "Updated 0 of 1 student(s)"
+    assert students(client)["S001"]["first_name"] == "Anna"
+
+
+def test_patch_with_and_without_row_version(client):
+    add_students(client, "Ann")
+    stale = client.patch("/update-student", json=[{"student_id": "S001", "last_name": "Lee", "row_version": 7}])
+    assert stale.json()["results"][0]["status"] == "conflict"
+
+    blind = client.patch("/update-student", json=[{"student_id": "S001", "last_name": "Lee"}])
+    assert blind.json()["results"] == [{"student_id": "S001", "status": "updated", "row_version": 2}]
+    row = students(client)["S001"]
+    assert (row["first_name"], row["last_name"]) == ("Ann", "Lee")
+
+
+def test_batch_applies_every_operation(client):
+    add_students(client, "Ann", "Bob")
+    response = client.post("/batch", json=[
+        {"entity": "student", "op": "add", "rows": [student("Cat")]},
+        {"entity": "student", "op": "update", "rows": [{"student_id": "S001", "first_name": "Anna", "row_version": 1}]},
+        {"entity": "student", "op": "delete", "ids": ["S002"]},
+    ])
+    assert response.status_code == 200
+    assert response.json()["results"][0]["ids"] == ["S003"]
+    assert {key: row["first_name"] for key, row in students(client).items()} == {"S001": "Anna", "S003": "Cat"}
+
+
+def test_batch_with_a_conflict_applies_nothing(client):
+    add_students(client, "Ann")
+    response = client.post("/batch", json=[
+        {"entity": "student", "op": "add", "rows": [student("Cat")]},
+        {"entity": "student", "op": "update", "rows": [{"student_id": "S001", "first_name": "Anna", "row_version": 5}]},
+    ])
+    assert response.status_code == 409
+    assert response.json()["detail"]["conflicts"] == ["S001"]
+    assert {key: row["first_name"] for key, row in students(client).items()} == {"S001": "Ann"}
+
+
+def test_soft_delete_hides_the_row_until_compaction_removes_it(client, engine):
+    add_students(client, "Ann", "Bob")
+    watermark = client.get("/changes/student").json()["watermark"]
+    report = client.delete("/delete-student/S001").json()
+    assert report["deleted"] == ["S001"]
+
+    assert list(students(client)) == ["S002"]
+    # Only the tombstone is written so far
+    assert sorted(row["student_id"] for row in engine.fetch_rows(STUDENT)) == ["S001", "S002"]
+    assert client.get("/changes/student", params={"since": watermark}).json()["deleted"] == ["S001"]
+
+    compact_all()
+    assert [row["student_id"] for row in engine.fetch_rows(STUDENT)] == ["S002"]
+    assert list(students(client)) == ["S002"]
+    assert client.delete("/delete-student/S001").json()["missing"] == ["S001"]
+
+
+def test_paged_read_skips_soft_deleted_rows_without_binding_their_keys(client, engine):
+    add_students(client, "Ann", "Bob", "Cat")
+    client.delete("/delete-student/S002")
+    page = client.get("/get-student", params={"limit": 10, "columns": "student_id"}).json()
+    assert [row["student_id"] for row in page["rows"]] == ["S001", "S003"]
+
+    read_query = ReadQuery(key_column="student_id", limit=10, exclude_tombstoned=True)
+    _, params = engine.build_select(STUDENT, read_query)
+    assert params == []
+
+
+def test_flush_quarantines_only_the_refused_row(client, engine):
+    add_students(client, "Ann", "Bob", flush=False)
+    # Someone else stored S002 while the rows were queued
+    engine.insert_rows(STUDENT, [{"student_id": "S002", "first_name": "Other"}])
+    flush_pending(STUDENT)
+
+    assert pending_rows(STUDENT)[0] == []
+    assert {key: row["first_name"] for key, row in students(client).items()} == {"S001": "Ann", "S002": "Other"}
+    quarantine = client.get("/health/storage").json()["insert_quarantine"][STUDENT.full_id]
+    assert quarantine["count"] == 1
+    assert quarantine["recent"][0]["row"]["first_name"] == "Bob"
+    stored = engine.execute(STUDENT, 'SELECT row_json FROM "groups_student_quarantine"')
+    assert [json.loads(row["row_json"])["first_name"] for row in stored] == ["Bob"]
+
+
+def test_flush_refused_as_a_whole_keeps_the_rows_queued(client, engine, monkeypatch):
+    add_students(client, "Ann", flush=False)
+
+    def locked(*args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(engine, "insert_rows", locked)
+    with pytest.raises(sqlite3.OperationalError):
+        flush_pending(STUDENT)
+    assert [row["student_id"] for row in pending_rows(STUDENT)[0]] == ["S001"]
+    assert client.get("/health/storage").json()["insert_quarantine"] == {}
+
+    monkeypatch.undo()
+    flush_pending(STUDENT)
+    assert [row["student_id"] for row in engine.fetch_rows(STUDENT)] == ["S001"]
+
+
+def test_changes_since_a_watermark(client):
+    add_students(client, "Ann")
+    watermark = client.get("/changes/student").json()["watermark"]
+    client.patch("/update-student", json=[{"student_id": "S001", "first_name": "Anna"}])
+    changes = client.get("/changes/student", params={"since": watermark}).json()
+    assert [row["first_name"] for row in changes["rows"]] == ["Anna"]
+    assert datetime.datetime.fromisoformat(changes["watermark"]) >= datetime.datetime.fromisoformat(watermark)
+
+
+def test_snapshot_carries_the_watermark_it_covers(client):
+    add_students(client, "Ann")
+    first = client.get("/get-student")
+    watermark = first.headers["X-Change-Watermark"]
+    unchanged = client.get("/get-student", headers={"If-None-Match": first.headers["ETag"]})
+    assert unchanged.status_code == 304
+    assert unchanged.headers["X-Change-Watermark"] == watermark
+
+    client.patch("/update-student", json=[{"student_id": "S001", "first_name": "Anna"}])
+    changes = client.get("/changes/student", params={"since": watermark}).json()
+    assert [row["first_name"] for row in changes["rows"]] == ["Anna"]
@@ -0,0 +1,25 @@
+import datetime
+import threading
+
+from services.change_feed import feed_watermark, in_flight_writes
+
+
+def test_watermark_waits_for_writes_still_running():
+    started, release = threading.Event(), threading.Event()
+
+    def write():
+        with in_flight_writes.track():
+            started.set()
+            release.wait()
+
+    thread = threading.Thread(target=write)
+    before = datetime.datetime.now(datetime.timezone.utc)
+    thread.start()
+    started.wait()
+    held = feed_watermark()
+    assert before <= held <= datetime.datetime.now(datetime.timezone.utc)
+    assert feed_watermark() == held
+
+    release.set()
+    thread.join()
+    assert feed_watermark() > held
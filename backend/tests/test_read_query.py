@@ -0,0 +1,34 @@
+import base64
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from services.read_query import ReadQuery, decode_cursor
+
+
+def encode(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8")).decode("ascii")
+
+
+def test_cursor_round_trip():
+    read_query = ReadQuery(key_column="student_id", limit=2)
+    payload = decode_cursor(read_query.encode_cursor({"student_id": "S002"}))
+    assert payload == {"q": read_query.fingerprint(), "after": ["S002", "S002"]}
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"\xff\xfe").decode("ascii"),
+    encode([1]),
+    encode("text"),
+    encode({"q": "abc"}),
+    encode({"q": "abc", "after": ["S001"]}),
+    encode({"q": "abc", "after": ["x", "S001", "extra"]}),
+    encode({"q": 1, "after": [None, "S001"]}),
+])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
+    assert error.value.detail == "Invalid cursor"
@@ -0,0 +1,75 @@
+from services.bigquery_service import get_table
+from services.write_scheduler import PendingWrite, apply_write_batch, split_rounds
+
+STUDENT = get_table("groups", "student")
+
+
+def update(**row):
+    return PendingWrite("upsert", "student_id", rows=[{"student_id": "S001", **row}])
+
+
+def stored_row(engine):
+    return engine.fetch_rows(STUDENT)[0]
+
+
+def seed(engine, version):
+    """Store S001 at the given row version."""
+    engine.bulk_upsert(STUDENT, [{"student_id": "S001", "first_name": "Ann"}], "student_id", insert_missing=True)
+    for _ in range(version - 1):
+        engine.bulk_upsert(STUDENT, [{"student_id": "S001", "first_name": "Ann"}], "student_id")
+
+
+def statuses(results):
+    return [[outcome["status"] for outcome in result] for result in results]
+
+
+def test_writes_without_versions_share_one_round():
+    writes = [update(first_name="A"), update(last_name="B"), PendingWrite("delete", "student_id", keys=["S002"])]
+    assert split_rounds(writes) == [writes]
+
+
+def test_versioned_write_gets_its_own_round():
+    writes = [update(first_name="A"), update(last_name="B", row_version=1), update(gender="F")]
+    assert split_rounds(writes) == [[writes[0]], [writes[1]], [writes[2]]]
+
+
+def test_blind_write_after_stale_versioned_write(engine):
+    seed(engine, version=2)
+    results = apply_write_batch(STUDENT, [update(first_name="Stale", row_version=1), update(last_name="Blind")])
+    assert statuses(results) == [["conflict"], ["updated"]]
+    row = stored_row(engine)
+    assert (row["first_name"], row["last_name"], row["row_version"]) == ("Ann", "Blind", 3)
+
+
+def test_versioned_write_after_blind_write(engine):
+    seed(engine, version=1)
+    results = apply_write_batch(STUDENT, [update(last_name="Blind"), update(first_name="Late", row_version=1)])
+    # The blind write moved the row to version 2 first
+    assert statuses(results) == [["updated"], ["conflict"]]
+    row = stored_row(engine)
+    assert (row["first_name"], row["last_name"], row["row_version"]) == ("Ann", "Blind", 2)
+
+
+def test_current_versioned_write_then_blind_write(engine):
+    seed(engine, version=1)
+    results = apply_write_batch(STUDENT, [update(first_name="Checked", row_version=1), update(last_name="Blind")])
+    assert statuses(results) == [["updated"], ["updated"]]
+    assert [result[0]["row_version"] for result in results] == [2, 3]
+    row = stored_row(engine)
+    assert (row["first_name"], row["last_name"]) == ("Checked", "Blind")
+
+
+def test_patches_of_one_key_apply_the_union_of_their_fields(engine):
+    seed(engine, version=1)
+    results = apply_write_batch(STUDENT, [update(first_name="Bea"), update(last_name="Lee"), update(first_name="Cat")])
+    assert statuses(results) == [["updated"], ["updated"], ["updated"]]
+    row = stored_row(engine)
+    # One statement: later values win and the version moves once
+    assert (row["first_name"], row["last_name"], row["row_version"]) == ("Cat", "Lee", 2)
+
+
+def test_update_after_delete_in_the_same_window(engine):
+    seed(engine, version=1)
+    results = apply_write_batch(STUDENT, [PendingWrite("delete", "student_id", keys=["S001"]), update(first_name="Gone")])
+    assert results[0]["deleted"] == ["S001"]
+    assert statuses(results[1:]) == [["not_found"]]
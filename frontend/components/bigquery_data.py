@@ -4,6 +4,9 @@ from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode
 import requests
 from config import get_backend_url
 import datetime
+import pyarrow as pa
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
 
 class BigqueryData:
     def __init__(self, table, file):
@@ -30,6 +33,84 @@ class BigqueryData:
                     else:
                         st.error("Upload failed")
        
+    def fetch_dataframe(self):
+        """
+        Fetch the table as an Arrow IPC stream (JSON from older backends), revalidating
+        the last copy with its ETag (304 = unchanged). Keeps the change feed watermark
+        sent with the snapshot, so later refreshes fetch exactly what it misses.
+        """
+        etag_key = f'{self.table}_etag'
+        frame_key = f'{self.table}_cached_frame'
+        watermark_key = f'{self.table}_watermark'
+        headers = {"Accept": f"{ARROW_STREAM_MEDIA_TYPE}, application/json;q=0.9"}
+        if etag_key in st.session_state and frame_key in st.session_state:
+            headers["If-None-Match"] = st.session_state[etag_key]
+        response = requests.get(f"{self.backend_url}/get-{self.table}", headers=headers)
+        response.raise_for_status()
+        if "X-Change-Watermark" in response.headers:
+            st.session_state[watermark_key] = response.headers["X-Change-Watermark"]
+        elif watermark_key in st.session_state:
+            # No watermark for this snapshot, the next refresh loads the whole table
+            del st.session_state[watermark_key]
+        if response.status_code == 304:
+            return st.session_state[frame_key].copy()
+        if response.headers.get("content-type", "").startswith(ARROW_STREAM_MEDIA_TYPE):
+            # Arrow buffers become the DataFrame's blocks without a row-by-row copy
+            table = pa.ipc.open_stream(response.content).read_all()
+            frame = table.to_pandas(split_blocks=True, self_destruct=True)
+        else:
+            frame = pd.DataFrame(response.json())
+        if "ETag" in response.headers:
+            st.session_state[etag_key] = response.headers["ETag"]
+            st.session_state[frame_key] = frame.copy()
+        return frame
+
+    def apply_changes(self):
+        """
+        Patch the loaded table with the rows changed and deleted since it was loaded,
+        instead of fetching the whole table again. Returns False when no table is loaded.
+        """
+        data_key = f'{self.table}_data'
+        watermark_key = f'{self.table}_watermark'
+        if data_key not in st.session_state or watermark_key not in st.session_state:
+            return False
+        response = requests.get(
+            f"{self.backend_url}/changes/{self.table}",
+            params={"since": st.session_state[watermark_key]},
+        )
+        response.raise_for_status()
+        feed = response.json()
+
+        id_col = f'{self.table}_id'
+        data = st.session_state[data_key]
+        # Rows added in the grid have no ID yet, the feed brings them back with theirs
+        data = data[data[id_col].notna() & (data[id_col] != "")].set_index(id_col)
+        data = data.drop(index=[key for key in feed["deleted"] if key in data.index])
+        changed = pd.DataFrame(feed["rows"])
+        if not changed.empty:
+            changed = changed.set_index(id_col).reindex(columns=data.columns)
+            for col in changed.columns:
+                if pd.api.types.is_datetime64_any_dtype(data[col]):
+                    changed[col] = pd.to_datetime(changed[col], format="ISO8601", utc=data[col].dt.tz is not None)
+            existing = changed.index.isin(data.index)
+            data.loc[changed.index[existing]] = changed[existing]
+            data = pd.concat([data, changed[~existing]])
+        data = data.reset_index()
+
+        st.session_state[data_key] = data
+        st.session_state[f'{self.table}_original_data'] = data.to_dict("records")
+        st.session_state[watermark_key] = feed["watermark"]
+        return True
+
+    def refresh_table(self):
+        """Show the latest data on the next run, patched in place when possible."""
+        if not self.apply_changes():
+            if f'{self.table}_data' in st.session_state:
+                del st.session_state[f'{self.table}_data']
+            if f'{self.table}_original_data' in st.session_state:
+                del st.session_state[f'{self.table}_original_data']
+        st.rerun()
+
     def get_table_operations(self):
         st.subheader(f"📄 Current {self.table}s in Database")
 
@@ -38,10 +119,8 @@ class BigqueryData:
             data = st.session_state[f'{self.table}_data']
         else:
             try:
-                # Fetch data
-                response = requests.get(f"{self.backend_url}/get-{self.table}")
-                response.raise_for_status()
-                data = pd.DataFrame(response.json())
+                # Fetch data, later saves and deletes only fetch what changed since
+                data = self.fetch_dataframe()
 
                 if data.empty:
                     st.warning(f"No {self.table} data found in the database")
@@ -128,6 +207,9 @@ class BigqueryData:
             editType='fullRow',
             stopEditingWhenCellsLoseFocus=True
         )
+        for col in ("row_version", "updated_at"):
+            if col in data.columns:
+                gb.configure_column(col, editable=False)
         grid_options = gb.build()
         grid_response = AgGrid(
             data,
@@ -213,24 +295,49 @@ class BigqueryData:
                         if isinstance(v, datetime.date):
                             row[k] = v.strftime("%Y-%m-%d")
                     return row
-                new_rows = [convert_dates(row) for row in new_rows]
+                new_rows = [convert_dates({k: v for k, v in row.items() if k not in ("row_version", "updated_at")}) for row in new_rows]
                 existing_rows = [convert_dates(row) for row in existing_rows]
-                # Handle new rows
+                # Only send the fields that actually changed
+                def comparable(value):
+                    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+                        return None
+                    if isinstance(value, datetime.date):
+                        return value.strftime("%Y-%m-%d")
+                    return value
+                id_col = f'{self.table}_id'
+                original_rows = {row.get(id_col): row for row in original_data}
+                changed_rows = []
+                for row in existing_rows:
+                    original_row = original_rows.get(row[id_col], {})
+                    changes = {
+                        k: v for k, v in row.items()
+                        if k not in (id_col, "row_version", "updated_at") and comparable(v) != comparable(original_row.get(k))
+                    }
+                    if changes:
+                        # The version the edit was based on, the backend refuses the save if the row changed since
+                        version = comparable(original_row.get("row_version"))
+                        if version is not None:
+                            changes["row_version"] = int(version)
+                        changed_rows.append({id_col: row[id_col], **changes})
+                existing_rows = changed_rows
+                # New rows and updates go in one all-or-nothing request
+                operations = []
+                if new_rows:
+                    operations.append({"entity": self.table, "op": "add", "rows": new_rows})
+                if existing_rows:
+                    operations.append({"entity": self.table, "op": "update", "rows": existing_rows})
+                if operations:
+                    batch_response = requests.post(f"{self.backend_url}/batch", json=operations)
+                    if batch_response.status_code == 409:
+                        conflicts = batch_response.json()["detail"]["conflicts"]
+                        st.error(f"{', '.join(conflicts)} changed since you loaded them. Reload the table and reapply your edits.")
+                        return
+                    batch_response.raise_for_status()
                 if new_rows:
-                    add_response = requests.post(f"{self.backend_url}/add-{self.table}", json=new_rows)
-                    add_response.raise_for_status()
                     st.success(f"Added {len(new_rows)} new {self.table}(s) successfully!")
-                # Handle existing row updates
                 if existing_rows:
-                    update_response = requests.put(f"{self.backend_url}/update-{self.table}", json=existing_rows)
-                    update_response.raise_for_status()
                     st.success(f"Updated {len(existing_rows)} existing {self.table}(s) successfully!")
-                # Clear session state and refresh
-                if f'{self.table}_data' in st.session_state:
-                    del st.session_state[f'{self.table}_data']
-                if f'{self.table}_original_data' in st.session_state:
-                    del st.session_state[f'{self.table}_original_data']
-                st.rerun()
+                self.refresh_table()
             except requests.exceptions.RequestException as e:
                 error_str = str(e)
                 if "streaming buffer" in error_str:
@@ -270,25 +377,17 @@ class BigqueryData:
                     st.warning("No valid IDs found in selected rows")
                     return
                 with st.spinner("Deleting selected rows..."):
-                    success_count = 0
-                    for row_id in ids:
-                        try:
-                            response = requests.delete(f"{self.backend_url}/delete-{self.table}/{row_id}")
-                            response.raise_for_status()
-                            success_count += 1
-                        except requests.exceptions.RequestException as e:
-                            error_str = str(e)
-                            if "streaming buffer" in error_str:
-                                st.error(f"Row {row_id} is still being processed by BigQuery and cannot be deleted yet. Please wait a few minutes and try again.")
-                            else:
-                                st.error(f"Failed to delete {self.table} {row_id}: {e}")
-                    if success_count > 0:
-                        st.success(f"Deleted {success_count} {self.table}(s) successfully")
-                        if f'{self.table}_data' in st.session_state:
-                            del st.session_state[f'{self.table}_data']
-                        if f'{self.table}_original_data' in st.session_state:
-                            del st.session_state[f'{self.table}_original_data']
-                        st.rerun()
+                    # One request and one DML statement for the whole selection
+                    response = requests.delete(f"{self.backend_url}/delete-{self.table}", json=ids)
+                    response.raise_for_status()
+                    result = response.json()
+                    if result["streaming_buffer"]:
+                        st.error(f"Rows {', '.join(result['streaming_buffer'])} are still being processed by BigQuery and cannot be deleted yet. Please wait a few minutes and try again.")
+                    if result["missing"]:
+                        st.warning(f"Already deleted or not found: {', '.join(result['missing'])}")
+                    if result["deleted"]:
+                        st.success(f"Deleted {len(result['deleted'])} {self.table}(s) successfully")
+                        self.refresh_table()
             except Exception as e:
                 st.error(f"An error occurred during deletion: {e}")
                 st.write(f"Debug - selected_rows type: {type(selected_rows)}")